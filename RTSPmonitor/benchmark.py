@@ -0,0 +1,302 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from include.engine import CaptureEngine
+
+
+def make_synthetic_video(path, width=1280, height=720, fps=25, seconds=10):
+    # Рухомий прямокутник і шум, щоб кодек мав реальну роботу
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not writer.isOpened():
+        path = os.path.splitext(path)[0] + '.avi'
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    for index in range(int(fps * seconds)):
+        frame = background.copy()
+        x = (index * 8) % max(width - 200, 1)
+        cv2.rectangle(frame, (x, height // 3), (x + 200, height // 3 + 150), (0, 0, 255), -1)
+        cv2.putText(frame, f'frame {index}', (20, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (255, 255, 255), 3)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+class PacedCapture():
+    # Відтворює файл у темпі живого потоку і по колу, як RTSP-камера
+    def __init__(self, path, fps=None):
+        self.path = path
+        self.cap = cv2.VideoCapture(path, cv2.CAP_FFMPEG)
+        self.fps = fps or self.cap.get(cv2.CAP_PROP_FPS) or 25
+        self.next_frame = time.monotonic()
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def grab(self):
+        delay = self.next_frame - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_frame = max(self.next_frame + 1 / self.fps, time.monotonic() - 1)
+        if self.cap.grab():
+            return True
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        return self.cap.grab()
+
+    def retrieve(self):
+        return self.cap.retrieve()
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def set(self, prop, value):
+        return self.cap.set(prop, value)
+
+    def release(self):
+        self.cap.release()
+
+
+class BenchmarkEngine(CaptureEngine):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.snapshot_times = {}
+        self.lock = threading.Lock()
+
+    async def async_save_frame(self, frame, device_name, save_path, device):
+        with self.lock:
+            self.snapshot_times.setdefault(device.id, []).append(time.monotonic())
+        await super().async_save_frame(frame, device_name, save_path, device)
+
+
+def start_ftp_server(root):
+    try:
+        from pyftpdlib.authorizers import DummyAuthorizer
+        from pyftpdlib.handlers import FTPHandler
+        from pyftpdlib.servers import ThreadedFTPServer
+    except ImportError:
+        logging.warning("pyftpdlib is not installed, FTP upload is not measured")
+        return None, None
+    authorizer = DummyAuthorizer()
+    authorizer.add_user('bench', 'bench', root, perm='elradfmw')
+    handler = type('BenchFTPHandler', (FTPHandler,), {'authorizer': authorizer})
+    server = ThreadedFTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, name='bench-ftp', daemon=True).start()
+    return server, server.address[1]
+
+
+def start_sftp_server(root):
+    # Локальний SFTP-сервер на paramiko з користувачем bench/bench і коренем root
+    try:
+        import paramiko
+    except ImportError:
+        logging.warning("paramiko is not installed, SFTP upload is not measured")
+        return None, None
+
+    class BenchServer(paramiko.ServerInterface):
+        def check_auth_password(self, username, password):
+            if (username, password) == ('bench', 'bench'):
+                return paramiko.AUTH_SUCCESSFUL
+            return paramiko.AUTH_FAILED
+
+        def get_allowed_auths(self, username):
+            return 'password'
+
+        def check_channel_request(self, kind, chanid):
+            if kind == 'session':
+                return paramiko.OPEN_SUCCEEDED
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    class BenchSFTP(paramiko.SFTPServerInterface):
+        def _local(self, path):
+            return os.path.join(root, self.canonicalize(path).lstrip('/'))
+
+        def _call(self, action, *args):
+            try:
+                return action(*args)
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+
+        def stat(self, path):
+            return self._call(lambda: paramiko.SFTPAttributes.from_stat(os.stat(self._local(path))))
+
+        lstat = stat
+
+        def open(self, path, flags, attr):
+            def open_handle():
+                fd = os.open(self._local(path), flags | getattr(os, 'O_BINARY', 0), 0o644)
+                handle = paramiko.SFTPHandle(flags)
+                handle.filename = self._local(path)
+                handle.readfile = handle.writefile = os.fdopen(fd, 'rb+' if flags & os.O_RDWR else
+                                                               'wb' if flags & os.O_WRONLY else 'rb')
+                return handle
+            return self._call(open_handle)
+
+        def mkdir(self, path, attr):
+            return self._call(lambda: os.mkdir(self._local(path)) or paramiko.SFTP_OK)
+
+        def remove(self, path):
+            return self._call(lambda: os.remove(self._local(path)) or paramiko.SFTP_OK)
+
+        def posix_rename(self, oldpath, newpath):
+            return self._call(lambda: os.replace(self._local(oldpath), self._local(newpath)) or paramiko.SFTP_OK)
+
+        rename = posix_rename
+
+        def list_folder(self, path):
+            local = self._local(path)
+            return self._call(lambda: [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(local, name)), name)
+                                       for name in os.listdir(local)])
+
+    host_key = paramiko.RSAKey.generate(2048)
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', 0))
+    server.listen(16)
+
+    def accept():
+        while True:
+            try:
+                connection, _ = server.accept()
+            except OSError:
+                return  # сокет закрито
+            transport = paramiko.Transport(connection)
+            transport.add_server_key(host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, BenchSFTP)
+            transport.start_server(server=BenchServer())
+
+    threading.Thread(target=accept, name='bench-sftp', daemon=True).start()
+    return server, server.getsockname()[1]
+
+
+def jitter(times, interval):
+    gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+    if not gaps:
+        return None, None
+    deviations = [abs(gap - interval) for gap in gaps]
+    return statistics.mean(deviations), max(deviations)
+
+
+def run_step(args, workdir, source, device_count, ftp_port, sftp_port=None):
+    save_path = os.path.join(workdir, f'pictures_{device_count}')
+    os.makedirs(save_path, exist_ok=True)
+    ftp_config_path = os.path.join(workdir, 'ftp_data.conf')
+    with open(ftp_config_path, 'w') as config_file:
+        if ftp_port:
+            config_file.write(f'[FTP]\nhost = 127.0.0.1\nusername = bench\npassword = bench\nport = {ftp_port}\n')
+    # Окрема черга на диску для кожного кроку, щоб кроки не догружали знімки один одного
+    spool_config_path = os.path.join(workdir, 'spool.conf')
+    with open(spool_config_path, 'w') as config_file:
+        config_file.write(f"[SPOOL]\npath = {os.path.join(workdir, f'spool_{device_count}')}\nfsync = no\n")
+    destinations_config_path = os.path.join(workdir, 'destinations.conf')
+    with open(destinations_config_path, 'w') as config_file:
+        if sftp_port:
+            os.makedirs(os.path.join(workdir, 'sftp'), exist_ok=True)
+            config_file.write(f'[sftp]\ntype = sftp\nhost = 127.0.0.1\nport = {sftp_port}\n'
+                              f'username = bench\npassword = bench\nremote_path = /sftp\n')
+        if args.mirror:
+            config_file.write(f"[mirror]\ntype = local\npath = {os.path.join(workdir, f'mirror_{device_count}')}\n")
+
+    engine = BenchmarkEngine(ftp_config_path=ftp_config_path, spool_config_path=spool_config_path,
+                             destinations_config_path=destinations_config_path,
+                             ledger_path=os.path.join(workdir, f'uploaded_{device_count}.txt'),
+                             db_url=f"sqlite:///{os.path.join(workdir, f'bench_{device_count}.db')}",
+                             capture_factory=lambda device, *timeouts: PacedCapture(device.rtsp_url, args.fps))
+    devices = [SimpleNamespace(id=index, name=f'bench{index}', rtsp_url=source, save_path=save_path,
+                               interval=args.interval, capture_mode=args.mode, jpeg_quality=90)
+               for index in range(device_count)]
+
+    cpu_started = time.process_time()
+    started = time.monotonic()
+    engine.start()
+    for device in devices:
+        engine.scheduler.add_device(device)
+    time.sleep(args.duration)
+    elapsed = time.monotonic() - started
+    cpu_used = time.process_time() - cpu_started
+    stats = [engine.scheduler.stats[device.id] for device in devices if device.id in engine.scheduler.stats]
+    metrics = engine.get_metrics()
+    engine.stop()
+
+    jitters = [jitter(times, args.interval) for times in engine.snapshot_times.values()]
+    jitters = [value for value in jitters if value[0] is not None]
+    return {
+        'devices': device_count,
+        'frames_grabbed_per_sec': round(sum(item.frames_grabbed for item in stats) / elapsed, 1),
+        'frames_retrieved_per_sec': round(sum(item.frames_retrieved for item in stats) / elapsed, 2),
+        'cpu_percent_per_stream': round(100.0 * cpu_used / elapsed / device_count, 2),
+        'snapshots': sum(len(times) for times in engine.snapshot_times.values()),
+        'jitter_avg': round(statistics.mean(value[0] for value in jitters), 4) if jitters else None,
+        'jitter_max': round(max(value[1] for value in jitters), 4) if jitters else None,
+        'encode_avg': metrics['writer']['encode_avg'],
+        'write_avg': metrics['writer']['write_avg'],
+        'writer_dropped': metrics['writer']['dropped'],
+        'ftp_bytes_per_sec': round(metrics['upload']['bytes_sent'] / elapsed, 1),
+        'ftp_queue_depth': metrics['upload']['queue_depth'],
+        'destination_bytes_per_sec': {name: round(destination['bytes_sent'] / elapsed, 1)
+                                      for name, destination in metrics['destinations'].items()},
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="RTSP Monitor capture/snapshot/upload benchmark")
+    parser.add_argument('--devices', default='1,5,10,25,50,100', help="comma separated device counts")
+    parser.add_argument('--duration', type=float, default=15, help="seconds per step")
+    parser.add_argument('--interval', type=float, default=1, help="Device.interval for every synthetic device")
+    parser.add_argument('--mode', default='grab', help="capture mode (read, grab, keyframe)")
+    parser.add_argument('--source', help="video file or RTSP URL instead of a generated clip")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--fps', type=float, default=25)
+    parser.add_argument('--no-ftp', action='store_true', help="do not start the local FTP server")
+    parser.add_argument('--sftp', action='store_true', help="also upload to a local SFTP server (paramiko)")
+    parser.add_argument('--mirror', action='store_true', help="also mirror snapshots to a local folder")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    with tempfile.TemporaryDirectory(prefix='rtsp_bench_') as workdir:
+        source = args.source or make_synthetic_video(
+            os.path.join(workdir, 'synthetic.mp4'), args.width, args.height, int(args.fps))
+        server, ftp_port = (None, None) if args.no_ftp else start_ftp_server(workdir)
+        sftp_server, sftp_port = start_sftp_server(workdir) if args.sftp else (None, None)
+
+        results = []
+        for device_count in (int(value) for value in args.devices.split(',')):
+            result = run_step(args, workdir, source, device_count, ftp_port, sftp_port)
+            results.append(result)
+            print(json.dumps(result), flush=True)
+
+        if server is not None:
+            server.close_all()
+        if sftp_server is not None:
+            sftp_server.close()
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
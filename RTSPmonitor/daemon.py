@@ -0,0 +1,103 @@
+import argparse
+import logging
+import signal
+import sys
+import threading
+from logging.handlers import RotatingFileHandler
+
+from include.engine import CaptureEngine
+
+from db.registry import get_registry
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="RTSP Monitor headless capture daemon")
+    parser.add_argument('--db', default='sqlite:///rtsp_data.db', help="SQLAlchemy URL of the device database")
+    parser.add_argument('--ftp-config', default='ftp_data.conf', help="FTP configuration file")
+    parser.add_argument('--metrics-config', default='metrics.conf', help="metrics endpoint, summary log and profiler settings")
+    parser.add_argument('--governor-config', default='governor.conf', help="disk, FTP and decode limits")
+    parser.add_argument('--spool-config', default='spool.conf', help="on-disk FTP upload queue settings")
+    parser.add_argument('--destinations-config', default='destinations.conf',
+                        help="additional upload destinations (FTP, FTPS, SFTP, local mirror)")
+    parser.add_argument('--processes', type=int, default=0, help="capture processes (0 - capture in this process)")
+    parser.add_argument('--all', action='store_true', help="capture all devices, not only the ones marked active")
+    parser.add_argument('--log-file', default='log/RTSPMonitor_log.txt', help="log file ('-' for stderr)")
+    return parser.parse_args()
+
+
+def setup_logging(log_file):
+    if log_file == '-':
+        handler = logging.StreamHandler()
+    else:
+        handler = RotatingFileHandler(log_file, maxBytes=20 * 1024 * 1024, backupCount=5)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[handler])
+
+
+class MonitorDaemon():
+    def __init__(self, args):
+        self.args = args
+        self.registry = get_registry(args.db)
+        self.engine = CaptureEngine(processes=args.processes, ftp_config_path=args.ftp_config, db_url=args.db,
+                                    metrics_config_path=args.metrics_config, governor_config_path=args.governor_config,
+                                    spool_config_path=args.spool_config,
+                                    destinations_config_path=args.destinations_config)
+        self.devices = {}
+        self.stop_event = threading.Event()
+        self.reload_event = threading.Event()
+
+    def load_devices(self):
+        # База могла змінитися з GUI чи вручну, тому реєстр перечитується повністю
+        devices = self.registry.reload()
+        if not self.args.all:
+            devices = [device for device in devices if device.active]
+        return {device.id: device for device in devices}
+
+    def apply_devices(self):
+        devices = self.load_devices()
+        for device_id in set(self.devices) - set(devices):
+            self.engine.stop_device(device_id)
+            logging.info(f"Monitoring stoped for device {self.devices[device_id].name}")
+        for device_id, device in devices.items():
+            old = self.devices.get(device_id)
+            if old is None or self.device_changed(old, device):
+                self.engine.start_device(device)
+        self.devices = devices
+        logging.info(f"Daemon is capturing {len(devices)} devices")
+
+    def device_changed(self, old, new):
+        return vars(old) != vars(new)
+
+    def handle_signal(self, signum, frame):
+        if hasattr(signal, 'SIGHUP') and signum == signal.SIGHUP:
+            self.reload_event.set()
+        else:
+            self.stop_event.set()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+        if hasattr(signal, 'SIGHUP'):
+            # SIGHUP перечитує список пристроїв і налаштування FTP
+            signal.signal(signal.SIGHUP, self.handle_signal)
+
+        self.engine.start()
+        self.apply_devices()
+        while not self.stop_event.is_set():
+            self.stop_event.wait(1)
+            if self.reload_event.is_set():
+                self.reload_event.clear()
+                logging.info("Reloading devices and FTP configuration")
+                self.engine.reload_ftp_config()
+                self.engine.reload_retention_config()
+                self.engine.reload_governor_config()
+                self.apply_devices()
+
+        logging.info("Stopping RTSP Monitor daemon")
+        self.engine.stop()
+        return 0
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    setup_logging(args.log_file)
+    sys.exit(MonitorDaemon(args).run())
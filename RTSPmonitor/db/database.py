@@ -1,18 +1,63 @@
-from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy import Column, String, Integer, Boolean
-from sqlalchemy import create_engine
+import threading
 
+from sqlalchemy.orm import declarative_base, sessionmaker, scoped_session
+from sqlalchemy import Column, String, Integer, Boolean, Float, DateTime, ForeignKey, Index
+from sqlalchemy import create_engine, event, inspect, text
+
+
+# Один engine і одна фабрика сесій на URL для всього процесу
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL дозволяє читати під час запису, busy_timeout чекає замість "database is locked"
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=5000')
+    cursor.close()
 
 
 class DataBase():
     Base = declarative_base()
-    def __init__(self):
+    def __init__(self, url='sqlite:///rtsp_data.db'):
         super().__init__()
 
-        self.engine = create_engine('sqlite:///rtsp_data.db')
-        self.Base.metadata.create_all(self.engine)
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+        # Усі DataBase() з однаковим URL ділять engine, схема оновлюється один раз.
+        # session - scoped_session: кожен потік отримує власну сесію
+        with _shared_lock:
+            if url not in _shared:
+                engine = create_engine(url)
+                if engine.dialect.name == 'sqlite':
+                    event.listen(engine, 'connect', _sqlite_pragmas)
+                self.engine = engine
+                self.Base.metadata.create_all(engine)
+                self.upgrade_schema()
+                _shared[url] = (engine, scoped_session(sessionmaker(bind=engine)))
+            self.engine, self.session = _shared[url]
+        self.url = url
+
+    def upgrade_schema(self):
+        # create_all не додає нові колонки до вже існуючих таблиць,
+        # тому дописуємо їх через ALTER TABLE зі значенням за замовчуванням
+        inspector = inspect(self.engine)
+        with self.engine.begin() as connection:
+            for table in self.Base.metadata.sorted_tables:
+                existing = {column['name'] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    column_type = column.type.compile(dialect=self.engine.dialect)
+                    ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                    if column.default is not None and column.default.is_scalar:
+                        default = column.default.arg
+                        if isinstance(default, str):
+                            default = "'" + default.replace("'", "''") + "'"
+                        elif isinstance(default, bool):
+                            default = int(default)
+                        ddl += f' DEFAULT {default}'
+                    connection.execute(text(ddl))
 
 class Device(DataBase.Base):
     __tablename__ = 'devices'
@@ -20,5 +65,87 @@ class Device(DataBase.Base):
     name = Column(String(50), nullable=False)
     rtsp_url = Column(String(200), nullable=False)
     save_path = Column(String(200), nullable=False)
-    interval = Column(Integer, nullable=False, default=60)
-    active = Column(Boolean, nullable=False, default=False)
\ No newline at end of file
+    interval = Column(Float, nullable=False, default=60)
+    active = Column(Boolean, nullable=False, default=False)
+    capture_mode = Column(String(20), nullable=False, default='grab')
+    jpeg_quality = Column(Integer, nullable=False, default=90)
+    align_snapshots = Column(Boolean, nullable=False, default=False)
+    burst_count = Column(Integer, nullable=False, default=1)
+    burst_spacing = Column(Float, nullable=False, default=0.0)
+    change_detection = Column(String(10), nullable=False, default='off')
+    change_threshold = Column(Float, nullable=True)
+    motion_snapshots = Column(Boolean, nullable=False, default=False)
+    # Відключатися від камери між знімками (для камер з обмеженням кількості сесій)
+    reconnect_per_snapshot = Column(Boolean, nullable=False, default=False)
+    # Розкладка файлів у save_path і на FTP, див. include/layout.py
+    layout = Column(String(20), nullable=False, default='flat')
+    # Профіль захоплення FFmpeg (include/capture_profile.py), None - типові налаштування OpenCV
+    rtsp_transport = Column(String(20), nullable=False, default='tcp')
+    decoder_threads = Column(Integer, nullable=True)
+    buffer_size = Column(Integer, nullable=True)
+    probe_size = Column(Integer, nullable=True)
+    analyze_duration = Column(Float, nullable=True)
+    downscale_width = Column(Integer, nullable=True)
+    # Додатковий потік камери з меншою роздільністю для попереднього перегляду
+    substream_url = Column(String(200), nullable=True)
+    # Зберігання: None - діє глобальна політика з retention.conf
+    retention_days = Column(Float, nullable=True)
+    retention_gb = Column(Float, nullable=True)
+    thin_after_days = Column(Float, nullable=True)
+    thin_keep_every = Column(Integer, nullable=True)
+    # Відеосегменти з кадрів знімків (include/timelapse.py): off - лише JPEG,
+    # both - JPEG і відео, video - лише відео
+    video_mode = Column(String(10), nullable=False, default='off')
+    video_codec = Column(String(10), nullable=False, default='mp4v')
+    segment_minutes = Column(Float, nullable=True)
+    segment_mb = Column(Float, nullable=True)
+    # Пріоритет при перевантаженні (include/governor.py) і бюджет декодування, кадрів за секунду
+    priority = Column(String(10), nullable=False, default='normal')
+    decode_fps = Column(Float, nullable=True)
+    # Напрямки відправки через кому (ftp - ftp_data.conf, решта - destinations.conf), порожньо - всі
+    destinations = Column(String(200), nullable=True)
+
+
+# pending - чекає відправки (зокрема поки FTP не налаштовано), uploaded - відправлено,
+# failed - відправка не вдалася після всіх спроб
+UPLOAD_STATUSES = ('pending', 'uploaded', 'failed')
+
+
+class Snapshot(DataBase.Base):
+    __tablename__ = 'snapshots'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    device_id = Column(Integer, ForeignKey('devices.id'), nullable=False)
+    captured_at = Column(DateTime, nullable=False)
+    # Відносне ім'я з підтеками розкладки, таке саме на FTP
+    name = Column(String(200), nullable=False)
+    # None - знімок закодовано лише в пам'яті для FTP
+    path = Column(String(500), nullable=True)
+    size = Column(Integer, nullable=False, default=0)
+    sha1 = Column(String(40), nullable=True)
+    upload_status = Column(String(10), nullable=False, default='pending')
+    uploaded_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('ix_snapshots_device_time', 'device_id', 'captured_at'),
+        Index('ix_snapshots_upload_status', 'upload_status', 'device_id'),
+        Index('ix_snapshots_name', 'name'),
+        Index('ix_snapshots_path', 'path'),
+    )
+
+
+class VideoSegment(DataBase.Base):
+    __tablename__ = 'video_segments'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    device_id = Column(Integer, ForeignKey('devices.id'), nullable=False)
+    # Відносне ім'я (як на FTP) і повний локальний шлях
+    name = Column(String(200), nullable=False)
+    path = Column(String(500), nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    # None - сегмент ще пишеться (або запис перервався аварійно)
+    ended_at = Column(DateTime, nullable=True)
+    frames = Column(Integer, nullable=False, default=0)
+    size = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index('ix_video_segments_device_time', 'device_id', 'started_at'),
+    )
@@ -0,0 +1,226 @@
+import logging
+import threading
+from types import SimpleNamespace
+
+from sqlalchemy import or_
+
+from db.database import DataBase, Device
+
+
+# Старі збірки SQLite обмежують кількість параметрів запиту до 999
+MAX_KEYS_PER_QUERY = 400
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(url='sqlite:///rtsp_data.db'):
+    # Один реєстр на URL: GUI, Utils і вікна бачать ті самі дані
+    with _registries_lock:
+        if url not in _registries:
+            _registries[url] = DeviceRegistry(DataBase(url))
+        return _registries[url]
+
+
+def device_record(device):
+    # Від'єднана копія рядка: потоки захоплення читають її без звернень до ORM
+    return SimpleNamespace(**{column.name: getattr(device, column.name) for column in Device.__table__.columns})
+
+
+class DeviceRegistry():
+    # Пристрої в пам'яті з індексами за назвою та URL.
+    # Записи незмінні: зміна створює новий запис, тому потоки захоплення
+    # завжди бачать цілісний стан пристрою.
+    # Слухачі subscribe(callback) отримують (подія, запис) після коміту,
+    # подія - 'added', 'updated' або 'deleted'; для 'imported' замість запису - список записів
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.RLock()
+        self.devices = {}
+        self.by_name = {}
+        self.by_url = {}
+        self.listeners = []
+        self.reload()
+
+    def reload(self):
+        # Повне перечитування - лише при старті і коли базу змінили ззовні
+        session = self.db.session
+        try:
+            records = [device_record(device) for device in session.query(Device).all()]
+        finally:
+            # Завершуємо транзакцію читання, щоб не тримати знімок WAL
+            session.rollback()
+        with self.lock:
+            self.devices = {}
+            self.by_name = {}
+            self.by_url = {}
+            for record in records:
+                self._index(record)
+        return self.all()
+
+    def subscribe(self, callback):
+        self.listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def all(self):
+        with self.lock:
+            return [self.devices[device_id] for device_id in sorted(self.devices)]
+
+    def active(self):
+        return [record for record in self.all() if record.active]
+
+    def has_active(self):
+        with self.lock:
+            return any(record.active for record in self.devices.values())
+
+    def get(self, device_id):
+        return self.devices.get(device_id)
+
+    def __len__(self):
+        return len(self.devices)
+
+    def is_duplicate(self, rtsp_url, name, exclude_id=None):
+        with self.lock:
+            for device_id in (self.by_url.get(rtsp_url), self.by_name.get(name)):
+                if device_id is not None and device_id != exclude_id:
+                    return self.devices[device_id]
+        return None
+
+    def add(self, **fields):
+        session = self.db.session
+        try:
+            device = Device(**fields)
+            session.add(device)
+            session.flush()
+            record = device_record(device)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        self._store(record, 'added')
+        return record
+
+    def add_many(self, rows):
+        # Масове додавання однією транзакцією. Дублікати за назвою чи URL - і в базі,
+        # і всередині rows - шукаються одним запитом на пачку і пропускаються.
+        # Повертає (додані записи, [(рядок, причина)])
+        skipped = []
+        accepted = []
+        names = set()
+        urls = set()
+        for row in rows:
+            if row['name'] in names:
+                skipped.append((row, 'duplicate name in import'))
+            elif row['rtsp_url'] in urls:
+                skipped.append((row, 'duplicate RTSP URL in import'))
+            else:
+                names.add(row['name'])
+                urls.add(row['rtsp_url'])
+                accepted.append(row)
+
+        session = self.db.session
+        try:
+            existing_names = set()
+            existing_urls = set()
+            for start in range(0, len(accepted), MAX_KEYS_PER_QUERY):
+                chunk = accepted[start:start + MAX_KEYS_PER_QUERY]
+                query = session.query(Device.name, Device.rtsp_url).filter(or_(
+                    Device.name.in_([row['name'] for row in chunk]),
+                    Device.rtsp_url.in_([row['rtsp_url'] for row in chunk])))
+                for name, rtsp_url in query:
+                    existing_names.add(name)
+                    existing_urls.add(rtsp_url)
+            new_rows = []
+            for row in accepted:
+                if row['name'] in existing_names:
+                    skipped.append((row, 'device with this name already exists'))
+                elif row['rtsp_url'] in existing_urls:
+                    skipped.append((row, 'device with this RTSP URL already exists'))
+                else:
+                    new_rows.append(row)
+            devices = [Device(**row) for row in new_rows]
+            session.add_all(devices)
+            session.flush()
+            records = [device_record(device) for device in devices]
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        with self.lock:
+            for record in records:
+                self._index(record)
+        if records:
+            # Одне сповіщення на весь імпорт - таблиця в GUI оновлюється один раз
+            self._notify('imported', records)
+        return records, skipped
+
+    def update(self, device_id, **fields):
+        return self.update_many([device_id], **fields)[0] if device_id in self.devices else None
+
+    def update_many(self, device_ids, **fields):
+        # Одна транзакція на будь-яку кількість пристроїв
+        device_ids = [device_id for device_id in device_ids if device_id in self.devices]
+        if not device_ids:
+            return []
+        session = self.db.session
+        try:
+            session.query(Device).filter(Device.id.in_(device_ids)).update(fields, synchronize_session=False)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        records = []
+        for device_id in device_ids:
+            values = dict(vars(self.devices[device_id]))
+            values.update(fields)
+            records.append(SimpleNamespace(**values))
+        for record in records:
+            self._store(record, 'updated')
+        return records
+
+    def set_active(self, device_id, active):
+        return self.update(device_id, active=active)
+
+    def delete(self, device_id):
+        session = self.db.session
+        try:
+            session.query(Device).filter(Device.id == device_id).delete(synchronize_session=False)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        with self.lock:
+            record = self._unindex(device_id)
+        if record is not None:
+            self._notify('deleted', record)
+        return record
+
+    def _store(self, record, event):
+        with self.lock:
+            self._unindex(record.id)
+            self._index(record)
+        self._notify(event, record)
+
+    def _index(self, record):
+        self.devices[record.id] = record
+        self.by_name[record.name] = record.id
+        self.by_url[record.rtsp_url] = record.id
+
+    def _unindex(self, device_id):
+        record = self.devices.pop(device_id, None)
+        if record is not None:
+            if self.by_name.get(record.name) == device_id:
+                del self.by_name[record.name]
+            if self.by_url.get(record.rtsp_url) == device_id:
+                del self.by_url[record.rtsp_url]
+        return record
+
+    def _notify(self, event, record):
+        for callback in list(self.listeners):
+            try:
+                callback(event, record)
+            except Exception as e:
+                logging.error(f"Error in device registry listener: {e}")
@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+from db.database import DataBase, VideoSegment
+
+
+class SegmentIndex():
+    # Облік відеосегментів: рядок створюється при відкритті сегмента і
+    # оновлюється при закритті. Сегменти рідкісні (раз на годину), тому без черги
+    def __init__(self, db=None):
+        self.db = db if db is not None else DataBase()
+
+    def opened(self, device_id, name, path, started_at):
+        session = self.db.session
+        try:
+            segment = VideoSegment(device_id=device_id, name=name, path=path, started_at=started_at)
+            session.add(segment)
+            session.commit()
+            return segment.id
+        except Exception:
+            session.rollback()
+            raise
+
+    def closed(self, segment_id, ended_at, frames, size):
+        session = self.db.session
+        try:
+            session.query(VideoSegment).filter(VideoSegment.id == segment_id).update(
+                {'ended_at': ended_at, 'frames': frames, 'size': size})
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+    def overlapping(self, device_id, start=None, end=None):
+        # Сегменти, що перетинаються з проміжком, від найстаріших.
+        # Незакритий сегмент (ended_at None) вважається таким, що триває досі
+        query = self.db.session.query(*VideoSegment.__table__.columns).filter(VideoSegment.device_id == device_id)
+        if start is not None:
+            query = query.filter((VideoSegment.ended_at.is_(None)) | (VideoSegment.ended_at >= start))
+        if end is not None:
+            query = query.filter(VideoSegment.started_at <= end)
+        rows = [SimpleNamespace(**row._asdict()) for row in query.order_by(VideoSegment.started_at)]
+        self.db.session.rollback()
+        return rows
@@ -0,0 +1,218 @@
+import logging
+import os
+import queue
+import threading
+from datetime import datetime as dt
+from types import SimpleNamespace
+
+from sqlalchemy import insert, update
+
+from db.database import DataBase, Snapshot
+from include.layout import parse_snapshot_name, safe_device_name
+
+
+# Старі збірки SQLite обмежують кількість параметрів запиту до 999
+MAX_KEYS_PER_QUERY = 400
+# Ключ обліку знімка, закодованого лише в пам'яті: імена унікальні тільки в межах пристрою
+MEMORY_KEY_PREFIX = 'memory:'
+
+
+def memory_key(device_id, name):
+    return f'{MEMORY_KEY_PREFIX}{device_id}:{name}'
+
+
+def split_keys(keys):
+    # Ключі обліку -> (локальні шляхи, {device_id: [імена знімків з пам'яті]})
+    paths = []
+    names = {}
+    for key in keys:
+        if key.startswith(MEMORY_KEY_PREFIX):
+            device_id, name = key[len(MEMORY_KEY_PREFIX):].split(':', 1)
+            names.setdefault(int(device_id), []).append(name)
+        else:
+            paths.append(key)
+    return paths, names
+
+
+class SnapshotIndex():
+    # Облік знімків у таблиці snapshots замість os.listdir і ftp.nlst.
+    # Запис іде з одного потоку пачками: потоки SnapshotWriter і FTP лише
+    # ставлять операції в чергу, тож порядок "додано -> відправлено" зберігається.
+    # Має той самий інтерфейс, що й UploadLedger (in, add_many), тому UploadPool
+    # може використовувати його як облік відправлених файлів
+    def __init__(self, db=None, batch_size=200, flush_interval=0.5, queue_size=10000):
+        self.db = db if db is not None else DataBase()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        if self.running:
+            return
+        self.thread = threading.Thread(target=self._run, name='snapshot-index', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        if not self.running:
+            return
+        self.queue.put(None)
+        self.thread.join(timeout)
+        self.thread = None
+
+    def record(self, device_id, captured_at, name, path=None, size=0, sha1=None, upload_status='pending'):
+        self._put(('insert', {
+            'device_id': device_id, 'captured_at': captured_at, 'name': name, 'path': path,
+            'size': size, 'sha1': sha1, 'upload_status': upload_status,
+        }))
+
+    def add_many(self, keys):
+        # keys - локальні шляхи або memory_key знімків, відправлених на FTP
+        keys = list(keys)
+        if keys:
+            self._put(('uploaded', keys))
+
+    def mark_failed(self, key):
+        self._put(('failed', [key]))
+
+    def __contains__(self, path):
+        found = self.db.session.query(Snapshot.id).filter(
+            Snapshot.path == path, Snapshot.upload_status == 'uploaded').first() is not None
+        self.db.session.rollback()
+        return found
+
+    def pending(self, device_id, limit=None):
+        # (шлях, відносне ім'я) знімків на диску, що ще не відправлені, від найстаріших
+        query = self.db.session.query(Snapshot.path, Snapshot.name).filter(
+            Snapshot.upload_status == 'pending', Snapshot.device_id == device_id,
+            Snapshot.path.isnot(None)).order_by(Snapshot.captured_at)
+        if limit:
+            query = query.limit(limit)
+        rows = [(row.path, row.name) for row in query]
+        self.db.session.rollback()
+        return rows
+
+    def has_device(self, device_id):
+        found = self.db.session.query(Snapshot.id).filter(Snapshot.device_id == device_id).first() is not None
+        self.db.session.rollback()
+        return found
+
+    def latest(self, device_id, limit=50):
+        # Останні знімки пристрою для перегляду, індекс (device_id, captured_at)
+        query = self.db.session.query(*Snapshot.__table__.columns).filter(
+            Snapshot.device_id == device_id).order_by(Snapshot.captured_at.desc()).limit(limit)
+        rows = [SimpleNamespace(**row._asdict()) for row in query]
+        self.db.session.rollback()
+        return rows
+
+    def between(self, device_id, start=None, end=None):
+        # (час, шлях) знімків на диску за проміжок, від найстаріших - для експорту відео
+        query = self.db.session.query(Snapshot.captured_at, Snapshot.path).filter(
+            Snapshot.device_id == device_id, Snapshot.path.isnot(None))
+        if start is not None:
+            query = query.filter(Snapshot.captured_at >= start)
+        if end is not None:
+            query = query.filter(Snapshot.captured_at <= end)
+        rows = [(row.captured_at, row.path) for row in query.order_by(Snapshot.captured_at)]
+        self.db.session.rollback()
+        return rows
+
+    def backfill(self, device_id, device_name, save_path, ledger=None):
+        # Разове сканування теки для знімків, зроблених до появи таблиці snapshots.
+        # Після цього пристрій більше ніколи не сканується
+        if not save_path or not os.path.isdir(save_path) or self.has_device(device_id):
+            return 0
+        rows = []
+        file_device = safe_device_name(device_name)
+        # Знімки можуть лежати в підтеках розкладки, ім'я - відносний шлях з '/'.
+        # Лише імена знімків саме цього пристрою: "cam" не бере "cam_2_..." чи "cam_notes.txt"
+        for root, dirs, files in os.walk(save_path):
+            for file_name in files:
+                parsed = parse_snapshot_name(file_name)
+                if parsed is None or parsed[0] != file_device:
+                    continue
+                path = os.path.join(root, file_name)
+                stat = os.stat(path)
+                uploaded = ledger is not None and path in ledger
+                rows.append({
+                    'device_id': device_id,
+                    'captured_at': parsed[1],
+                    'name': os.path.relpath(path, save_path).replace(os.sep, '/'),
+                    'path': path, 'size': stat.st_size, 'sha1': None,
+                    'upload_status': 'uploaded' if uploaded else 'pending',
+                })
+        if rows:
+            session = self.db.session
+            try:
+                session.execute(insert(Snapshot), rows)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+        logging.info(f"Indexed {len(rows)} existing snapshots of {device_name} from {save_path}")
+        return len(rows)
+
+    def _put(self, operation):
+        try:
+            self.queue.put_nowait(operation)
+        except queue.Full:
+            self.dropped += 1
+            logging.warning("Snapshot index queue is full, operation dropped")
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                operations = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(operations) < self.batch_size:
+                try:
+                    operations.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in operations:
+                stopping = True
+                operations = [operation for operation in operations if operation is not None]
+            try:
+                self._flush(operations)
+            except Exception as e:
+                logging.error(f"Error while writing snapshot index: {e}")
+        self.db.session.remove()
+
+    def _flush(self, operations):
+        # Одна транзакція на пачку; суміжні операції одного типу об'єднуються
+        session = self.db.session
+        try:
+            index = 0
+            while index < len(operations):
+                kind = operations[index][0]
+                group = []
+                while index < len(operations) and operations[index][0] == kind:
+                    group.append(operations[index][1])
+                    index += 1
+                if kind == 'insert':
+                    session.execute(insert(Snapshot), group)
+                else:
+                    paths, names = split_keys(key for keys in group for key in keys)
+                    values = {'upload_status': kind}
+                    if kind == 'uploaded':
+                        values['uploaded_at'] = dt.now()
+                    for start in range(0, len(paths), MAX_KEYS_PER_QUERY):
+                        chunk = paths[start:start + MAX_KEYS_PER_QUERY]
+                        session.execute(update(Snapshot).where(Snapshot.path.in_(chunk)).values(**values))
+                    for device_id, device_names in names.items():
+                        for start in range(0, len(device_names), MAX_KEYS_PER_QUERY):
+                            chunk = device_names[start:start + MAX_KEYS_PER_QUERY]
+                            session.execute(update(Snapshot).where(
+                                Snapshot.device_id == device_id, Snapshot.path.is_(None),
+                                Snapshot.name.in_(chunk)).values(**values))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
@@ -0,0 +1,72 @@
+import argparse
+import logging
+import sys
+from datetime import datetime as dt
+
+from include.timelapse import SEGMENT_FPS, build_timelapse, segment_frames, snapshot_frames
+
+from db.database import DataBase
+from db.registry import get_registry
+from db.segments import SegmentIndex
+from db.snapshots import SnapshotIndex
+
+
+SOURCES = ('auto', 'segments', 'snapshots')
+
+
+def parse_time(text):
+    # 2024-01-31, 2024-01-31 10:00 або 2024-01-31T10:00:00
+    return dt.fromisoformat(text)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build a time-lapse video of an RTSP Monitor device")
+    parser.add_argument('device', help="device name")
+    parser.add_argument('output', help="output file (.mp4 or .avi)")
+    parser.add_argument('--db', default='sqlite:///rtsp_data.db', help="SQLAlchemy URL of the device database")
+    parser.add_argument('--start', type=parse_time, help="first capture time, e.g. '2024-01-31 06:00'")
+    parser.add_argument('--end', type=parse_time, help="last capture time")
+    parser.add_argument('--every', type=float, default=0.0, help="minimal seconds between exported frames")
+    parser.add_argument('--fps', type=float, default=SEGMENT_FPS, help="playback frame rate")
+    parser.add_argument('--width', type=int, help="downscale to width (pixels)")
+    parser.add_argument('--source', choices=SOURCES, default='auto',
+                        help="video segments, JPEG snapshots or auto (segments when there are any in the range)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    registry = get_registry(args.db)
+    device = next((device for device in registry.all() if device.name == args.device), None)
+    if device is None:
+        logging.error(f"Unknown device: {args.device}")
+        return 1
+
+    db = DataBase(args.db)
+    segments = SegmentIndex(db).overlapping(device.id, args.start, args.end) if args.source != 'snapshots' else []
+    if segments:
+        logging.info(f"Reading {len(segments)} video segments of {device.name}")
+        frames = segment_frames(segments, args.start, args.end, args.every)
+    elif args.source == 'segments':
+        logging.error(f"No video segments of {device.name} in the range")
+        return 1
+    else:
+        rows = SnapshotIndex(db).between(device.id, args.start, args.end)
+        logging.info(f"Reading {len(rows)} snapshots of {device.name}")
+        frames = snapshot_frames(rows, args.every)
+
+    try:
+        count = build_timelapse(frames, args.output, args.fps, args.width)
+    except ValueError as e:
+        logging.error(str(e))
+        return 1
+    if not count:
+        logging.error("No frames in the range, nothing exported")
+        return 1
+    logging.info(f"Exported {count} frames to {args.output} ({count / args.fps:.1f} s at {args.fps:g} fps)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,24 @@
-from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLabel, QLineEdit, QPushButton, QFileDialog, QMessageBox
-import cv2
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLabel, QLineEdit, QPushButton, QFileDialog, QMessageBox, QComboBox, QCheckBox
+from PyQt5.QtCore import QTimer
 import os
+from types import SimpleNamespace
 
 from include.utils import Utils
-from db.database import Device, DataBase
+from include.capture import CAPTURE_MODES, DEFAULT_CAPTURE_MODE
+from include.capture_profile import TRANSPORTS, DEFAULT_TRANSPORT
+from include.change_detect import CHANGE_METHODS, parse_threshold
+from include.layout import LAYOUTS, DEFAULT_LAYOUT
+from include.probe import PROBE_TIMEOUT, StreamProber
+from include.governor import PRIORITIES, DEFAULT_PRIORITY
+from include.destinations import parse_destinations
+from include.timelapse import VIDEO_MODES, DEFAULT_VIDEO_MODE, VIDEO_CODECS, DEFAULT_VIDEO_CODEC
+from include.timing import parse_interval
 
 
 class AddDeviceWindow(QDialog):
     def __init__(self, device_list):
         super().__init__()
         
-        self.db = DataBase()
         self.utils = Utils(device_list)
 
         self.setWindowTitle("Add Device")
@@ -34,9 +42,112 @@ class AddDeviceWindow(QDialog):
         self.interval_input = QLineEdit()
         self.interval_input.setText("60")  # Значення за замовчуванням
 
+        self.align_snapshots_input = QCheckBox("Align snapshots to the clock (e.g. start of the minute)")
+
+        self.burst_count_label = QLabel("Frames per snapshot (burst):")
+        self.burst_count_input = QLineEdit()
+        self.burst_count_input.setText("1")
+
+        self.burst_spacing_label = QLabel("Burst spacing (seconds, 0 - consecutive frames):")
+        self.burst_spacing_input = QLineEdit()
+        self.burst_spacing_input.setText("0")
+
+        self.jpeg_quality_label = QLabel("JPEG quality (1-100):")
+        self.jpeg_quality_input = QLineEdit()
+        self.jpeg_quality_input.setText("90")
+
+        self.capture_mode_label = QLabel("Capture mode:")
+        self.capture_mode_input = QComboBox()
+        self.capture_mode_input.addItems(CAPTURE_MODES)
+        self.capture_mode_input.setCurrentText(DEFAULT_CAPTURE_MODE)
+
+        self.transport_label = QLabel("RTSP transport:")
+        self.transport_input = QComboBox()
+        self.transport_input.addItems(TRANSPORTS)
+        self.transport_input.setCurrentText(DEFAULT_TRANSPORT)
+
+        self.substream_label = QLabel("Substream URL for preview (optional):")
+        self.substream_input = QLineEdit()
+
+        self.decoder_threads_label = QLabel("Decoder threads (empty - auto):")
+        self.decoder_threads_input = QLineEdit()
+
+        self.buffer_size_label = QLabel("Capture buffer size (frames, empty - default):")
+        self.buffer_size_input = QLineEdit()
+
+        self.probe_size_label = QLabel("Probe size on open (bytes, empty - default):")
+        self.probe_size_input = QLineEdit()
+
+        self.analyze_duration_label = QLabel("Analyze duration on open (seconds, empty - default):")
+        self.analyze_duration_input = QLineEdit()
+
+        self.downscale_width_label = QLabel("Downscale snapshots to width (pixels, empty - original):")
+        self.downscale_width_input = QLineEdit()
+
+        self.layout_label = QLabel("Folder layout:")
+        self.layout_input = QComboBox()
+        self.layout_input.addItems(LAYOUTS)
+        self.layout_input.setCurrentText(DEFAULT_LAYOUT)
+
+        self.change_detection_label = QLabel("Skip unchanged snapshots:")
+        self.change_detection_input = QComboBox()
+        self.change_detection_input.addItems(CHANGE_METHODS)
+
+        self.change_threshold_label = QLabel("Change threshold (diff - % of pixels, hash - bits, empty - default):")
+        self.change_threshold_input = QLineEdit()
+
+        self.motion_snapshots_input = QCheckBox("Extra snapshot on motion between intervals")
+
+        self.reconnect_per_snapshot_input = QCheckBox("Disconnect between snapshots (reconnect before each one)")
+
+        self.retention_days_label = QLabel("Keep snapshots (days, empty - global policy):")
+        self.retention_days_input = QLineEdit()
+
+        self.retention_gb_label = QLabel("Max snapshot size on disk (GB, empty - global policy):")
+        self.retention_gb_input = QLineEdit()
+
+        self.video_mode_label = QLabel("Video segments (off - JPEG only, both - JPEG and video, video - video only):")
+        self.video_mode_input = QComboBox()
+        self.video_mode_input.addItems(VIDEO_MODES)
+        self.video_mode_input.setCurrentText(DEFAULT_VIDEO_MODE)
+
+        self.video_codec_label = QLabel("Video codec:")
+        self.video_codec_input = QComboBox()
+        self.video_codec_input.addItems(VIDEO_CODECS)
+        self.video_codec_input.setCurrentText(DEFAULT_VIDEO_CODEC)
+
+        self.segment_minutes_label = QLabel("Segment length (minutes, empty - 60):")
+        self.segment_minutes_input = QLineEdit()
+
+        self.segment_mb_label = QLabel("Max segment size (MB, empty - no limit):")
+        self.segment_mb_input = QLineEdit()
+
+        self.priority_label = QLabel("Priority (lower priority degrades first when overloaded):")
+        self.priority_input = QComboBox()
+        self.priority_input.addItems(PRIORITIES)
+        self.priority_input.setCurrentText(DEFAULT_PRIORITY)
+
+        self.decode_fps_label = QLabel("Decode budget (frames per second, empty - global limit):")
+        self.decode_fps_input = QLineEdit()
+        self.destinations_label = QLabel("Upload destinations (comma separated, empty - all):")
+        self.destinations_input = QLineEdit()
+
+        self.probe_timeout_label = QLabel("Stream check timeout (seconds):")
+        self.probe_timeout_input = QLineEdit()
+        self.probe_timeout_input.setText(str(PROBE_TIMEOUT))
+
+        self.check_button = QPushButton("Check stream")
+        self.check_button.clicked.connect(self.check_stream)
+        self.probe_status_label = QLabel("")
+
         self.add_button = QPushButton("Add")
         self.add_button.clicked.connect(self.add_device)
 
+        # Перевірка потоку йде у фоновому пулі, таймер забирає результати в потік GUI
+        self.prober = StreamProber()
+        self.probe_timer = QTimer(self)
+        self.probe_timer.timeout.connect(self.check_probe_results)
+
         self.layout.addWidget(self.rtsp_label)
         self.layout.addWidget(self.rtsp_input)
         self.layout.addWidget(self.name_label)
@@ -46,6 +157,59 @@ class AddDeviceWindow(QDialog):
         self.layout.addWidget(self.select_folder_button)
         self.layout.addWidget(self.interval_label)
         self.layout.addWidget(self.interval_input)
+        self.layout.addWidget(self.align_snapshots_input)
+        self.layout.addWidget(self.burst_count_label)
+        self.layout.addWidget(self.burst_count_input)
+        self.layout.addWidget(self.burst_spacing_label)
+        self.layout.addWidget(self.burst_spacing_input)
+        self.layout.addWidget(self.jpeg_quality_label)
+        self.layout.addWidget(self.jpeg_quality_input)
+        self.layout.addWidget(self.capture_mode_label)
+        self.layout.addWidget(self.capture_mode_input)
+        self.layout.addWidget(self.transport_label)
+        self.layout.addWidget(self.transport_input)
+        self.layout.addWidget(self.substream_label)
+        self.layout.addWidget(self.substream_input)
+        self.layout.addWidget(self.decoder_threads_label)
+        self.layout.addWidget(self.decoder_threads_input)
+        self.layout.addWidget(self.buffer_size_label)
+        self.layout.addWidget(self.buffer_size_input)
+        self.layout.addWidget(self.probe_size_label)
+        self.layout.addWidget(self.probe_size_input)
+        self.layout.addWidget(self.analyze_duration_label)
+        self.layout.addWidget(self.analyze_duration_input)
+        self.layout.addWidget(self.downscale_width_label)
+        self.layout.addWidget(self.downscale_width_input)
+        self.layout.addWidget(self.layout_label)
+        self.layout.addWidget(self.layout_input)
+        self.layout.addWidget(self.change_detection_label)
+        self.layout.addWidget(self.change_detection_input)
+        self.layout.addWidget(self.change_threshold_label)
+        self.layout.addWidget(self.change_threshold_input)
+        self.layout.addWidget(self.motion_snapshots_input)
+        self.layout.addWidget(self.reconnect_per_snapshot_input)
+        self.layout.addWidget(self.retention_days_label)
+        self.layout.addWidget(self.retention_days_input)
+        self.layout.addWidget(self.retention_gb_label)
+        self.layout.addWidget(self.retention_gb_input)
+        self.layout.addWidget(self.video_mode_label)
+        self.layout.addWidget(self.video_mode_input)
+        self.layout.addWidget(self.video_codec_label)
+        self.layout.addWidget(self.video_codec_input)
+        self.layout.addWidget(self.segment_minutes_label)
+        self.layout.addWidget(self.segment_minutes_input)
+        self.layout.addWidget(self.segment_mb_label)
+        self.layout.addWidget(self.segment_mb_input)
+        self.layout.addWidget(self.priority_label)
+        self.layout.addWidget(self.priority_input)
+        self.layout.addWidget(self.decode_fps_label)
+        self.layout.addWidget(self.decode_fps_input)
+        self.layout.addWidget(self.destinations_label)
+        self.layout.addWidget(self.destinations_input)
+        self.layout.addWidget(self.probe_timeout_label)
+        self.layout.addWidget(self.probe_timeout_input)
+        self.layout.addWidget(self.check_button)
+        self.layout.addWidget(self.probe_status_label)
         self.layout.addWidget(self.add_button)
 
         self.setLayout(self.layout)
@@ -72,40 +236,101 @@ class AddDeviceWindow(QDialog):
         else:
             print(f"Немає доступу до виконання файлів у каталозі {save_path}")
 
+    def read_profile(self):
+        # Профіль захоплення: порожні поля - типові налаштування FFmpeg
+        return {
+            'rtsp_transport': self.transport_input.currentText(),
+            'substream_url': self.substream_input.text().strip() or None,
+            'decoder_threads': int(self.decoder_threads_input.text()) if self.decoder_threads_input.text().isdigit() else None,
+            'buffer_size': int(self.buffer_size_input.text()) if self.buffer_size_input.text().isdigit() else None,
+            'probe_size': int(self.probe_size_input.text()) if self.probe_size_input.text().isdigit() else None,
+            'analyze_duration': parse_interval(self.analyze_duration_input.text(), default=None),
+            'downscale_width': int(self.downscale_width_input.text()) if self.downscale_width_input.text().isdigit() else None,
+        }
+
+    def start_probe(self, key, rtsp_url):
+        # Перевірка з тим самим профілем, з яким пристрій захоплюватиметься
+        timeout = parse_interval(self.probe_timeout_input.text(), default=PROBE_TIMEOUT)
+        self.prober.submit(key, SimpleNamespace(rtsp_url=rtsp_url, **self.read_profile()), timeout)
+        self.probe_status_label.setText(f"Checking {rtsp_url}...")
+        self.probe_timer.start(100)
+
+    def check_stream(self):
+        rtsp_url = self.rtsp_input.text()
+        if not rtsp_url:
+            QMessageBox.warning(self, "Warning", "RTSP URL is required.")
+            return
+        self.start_probe(('check', None), rtsp_url)
+
+    def check_probe_results(self):
+        for key, result in self.prober.take_results():
+            self.probe_status_label.setText(f"{result.url}: {result}")
+            if key[0] != 'add':
+                continue
+            self.add_button.setEnabled(True)
+            if result.ok:
+                self.save_device(key[1])
+            else:
+                QMessageBox.warning(self, "Error", f"Failed to open RTSP stream: {result.error}")
+        if not self.prober.busy():
+            self.probe_timer.stop()
+
     def add_device(self):
         rtsp_url = self.rtsp_input.text()
         name = self.name_input.text()
         save_path = self.save_path_input.text()
-        interval = int(self.interval_input.text()) if self.interval_input.text().isdigit() else 60
+        interval = parse_interval(self.interval_input.text())
+        align_snapshots = self.align_snapshots_input.isChecked()
+        burst_count = int(self.burst_count_input.text()) if self.burst_count_input.text().isdigit() else 1
+        burst_spacing = parse_interval(self.burst_spacing_input.text(), default=0.0)
+        capture_mode = self.capture_mode_input.currentText()
+        jpeg_quality = int(self.jpeg_quality_input.text()) if self.jpeg_quality_input.text().isdigit() else 90
+        jpeg_quality = min(max(jpeg_quality, 1), 100)
+        change_detection = self.change_detection_input.currentText()
+        layout = self.layout_input.currentText()
+        change_threshold = parse_threshold(self.change_threshold_input.text())
+        motion_snapshots = self.motion_snapshots_input.isChecked()
+        reconnect_per_snapshot = self.reconnect_per_snapshot_input.isChecked()
+        retention_days = parse_interval(self.retention_days_input.text(), default=None)
+        retention_gb = parse_interval(self.retention_gb_input.text(), default=None)
+        video_mode = self.video_mode_input.currentText()
+        video_codec = self.video_codec_input.currentText()
+        segment_minutes = parse_interval(self.segment_minutes_input.text(), default=None)
+        segment_mb = parse_interval(self.segment_mb_input.text(), default=None)
+        priority = self.priority_input.currentText()
+        decode_fps = parse_interval(self.decode_fps_input.text(), default=None)
+        destinations = ', '.join(parse_destinations(self.destinations_input.text())) or None
+
+        # Порожній Save Path - знімки кодуються в пам'яті і йдуть лише на FTP
+        if not rtsp_url or not name:
+            QMessageBox.warning(self, "Warning", "RTSP URL and Name are required fields.")
+            return
 
-        if not rtsp_url or not name or not save_path:
-            QMessageBox.warning(self, "Warning", "RTSP URL, Name, and Save Path are required fields.")
+        if video_mode != 'off' and not save_path:
+            QMessageBox.warning(self, "Warning", "Video segments require a Save Path.")
             return
 
         if self.utils.is_duplicate_device(rtsp_url, name):
             QMessageBox.warning(self, "Error", "A device with the same RTSP URL or name already exists.")
             return
 
-        try:
-            cap = cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG)
-            if not cap.isOpened():
-                QMessageBox.warning(self, "Error", "Failed to open RTSP stream.")
-                return
-            cap.release()
-        except Exception as e:
-            QMessageBox.warning(self, "Error", f"Error while accessing RTSP stream: {e}")
+        fields = dict(name=name, rtsp_url=rtsp_url, save_path=save_path, interval=interval, align_snapshots=align_snapshots, burst_count=max(burst_count, 1), burst_spacing=burst_spacing, capture_mode=capture_mode, jpeg_quality=jpeg_quality, change_detection=change_detection, change_threshold=change_threshold, motion_snapshots=motion_snapshots, reconnect_per_snapshot=reconnect_per_snapshot, retention_days=retention_days, retention_gb=retention_gb, layout=layout, video_mode=video_mode, video_codec=video_codec, segment_minutes=segment_minutes, segment_mb=segment_mb, priority=priority, decode_fps=decode_fps, destinations=destinations, active=False, **self.read_profile())
+        # Пристрій зберігається, коли фонова перевірка підтвердить потік
+        self.add_button.setEnabled(False)
+        self.start_probe(('add', fields), rtsp_url)
+
+    def save_device(self, fields):
+        # За час перевірки такий пристрій міг з'явитися з іншого вікна
+        if self.utils.is_duplicate_device(fields['rtsp_url'], fields['name']):
+            QMessageBox.warning(self, "Error", "A device with the same RTSP URL or name already exists.")
             return
 
         try:
-            new_device = Device(name=name, rtsp_url=rtsp_url, save_path=save_path, interval=interval, active=False)
-            self.db.session.add(new_device)
-            self.db.session.commit()
-            #self.utils.load_device_list()
+            # Таблиця головного вікна додасть рядок за подією реєстру
+            self.utils.registry.add(**fields)
         except Exception as e:
             QMessageBox.warning(self, "Error", f"Error while saving device data: {e}")
 
-        self.utils.load_device_list()
-
 
         # Тут ви можете передати отримані дані, де потрібно
         # Наприклад, до вашої основної програми чи окремому класу для обробки
@@ -0,0 +1,117 @@
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QPlainTextEdit,
+                             QTableWidget, QTableWidgetItem)
+from PyQt5.QtGui import QColor
+from PyQt5.QtCore import QTimer
+
+from include.probe import PROBE_TIMEOUT, PROBE_WORKERS, StreamProber
+from include.timing import parse_interval
+
+
+COLUMNS = ["RTSP URL", "Status", "Codec", "Resolution", "FPS", "Time (s)"]
+
+
+class BulkProbeWindow(QDialog):
+    # Перевірка списку камер перед додаванням: до PROBE_WORKERS потоків одночасно,
+    # кожен обмежений таймаутом, GUI не блокується
+    def __init__(self, registry):
+        super().__init__()
+        self.registry = registry
+        self.prober = StreamProber(PROBE_WORKERS)
+        self.devices = {}  # URL -> запис пристрою, щоб перевірити з його профілем
+        self.checked = 0
+        self.succeeded = 0
+        self.total = 0
+
+        self.setWindowTitle("Check streams")
+        self.setGeometry(150, 150, 900, 600)
+
+        self.layout = QVBoxLayout()
+
+        self.urls_label = QLabel("RTSP URLs (one per line):")
+        self.urls_input = QPlainTextEdit()
+
+        self.load_button = QPushButton("Load registered devices")
+        self.load_button.clicked.connect(self.load_devices)
+
+        self.timeout_label = QLabel("Timeout (seconds):")
+        self.timeout_input = QLineEdit()
+        self.timeout_input.setText(str(PROBE_TIMEOUT))
+
+        self.check_button = QPushButton("Check all")
+        self.check_button.clicked.connect(self.check_all)
+
+        self.summary_label = QLabel("")
+
+        self.results_table = QTableWidget()
+        self.results_table.setColumnCount(len(COLUMNS))
+        self.results_table.setHorizontalHeaderLabels(COLUMNS)
+        self.results_table.horizontalHeader().setStretchLastSection(True)
+
+        controls = QHBoxLayout()
+        controls.addWidget(self.load_button)
+        controls.addWidget(self.timeout_label)
+        controls.addWidget(self.timeout_input)
+        controls.addWidget(self.check_button)
+
+        self.layout.addWidget(self.urls_label)
+        self.layout.addWidget(self.urls_input)
+        self.layout.addLayout(controls)
+        self.layout.addWidget(self.summary_label)
+        self.layout.addWidget(self.results_table)
+        self.setLayout(self.layout)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.collect_results)
+
+    def load_devices(self):
+        self.devices = {device.rtsp_url: device for device in self.registry.all()}
+        self.urls_input.setPlainText('\n'.join(self.devices))
+
+    def check_all(self):
+        urls = []
+        for line in self.urls_input.toPlainText().splitlines():
+            url = line.strip()
+            if url and url not in urls:
+                urls.append(url)
+        if not urls:
+            return
+        timeout = parse_interval(self.timeout_input.text(), default=PROBE_TIMEOUT)
+
+        self.checked = 0
+        self.succeeded = 0
+        self.total = len(urls)
+        self.results_table.setRowCount(len(urls))
+        for row, url in enumerate(urls):
+            self.results_table.setItem(row, 0, QTableWidgetItem(url))
+            self.results_table.setItem(row, 1, QTableWidgetItem("Checking..."))
+            for column in range(2, len(COLUMNS)):
+                self.results_table.setItem(row, column, QTableWidgetItem(""))
+        # Ключ - рядок таблиці; зареєстровані пристрої перевіряються з їхнім профілем
+        self.prober.submit_many(((row, self.devices.get(url, url)) for row, url in enumerate(urls)), timeout)
+        self.check_button.setEnabled(False)
+        self.update_summary()
+        self.timer.start(200)
+
+    def collect_results(self):
+        for row, result in self.prober.take_results():
+            self.checked += 1
+            if result.ok:
+                self.succeeded += 1
+                status = QTableWidgetItem("OK")
+                status.setBackground(QColor(0, 255, 0))
+            else:
+                status = QTableWidgetItem(result.error)
+                status.setBackground(QColor(255, 0, 0))
+            self.results_table.setItem(row, 1, status)
+            self.results_table.setItem(row, 2, QTableWidgetItem(result.codec or ""))
+            self.results_table.setItem(row, 3, QTableWidgetItem(result.resolution))
+            self.results_table.setItem(row, 4, QTableWidgetItem(f"{result.fps:.1f}" if result.fps else ""))
+            self.results_table.setItem(row, 5, QTableWidgetItem(f"{result.elapsed:.1f}"))
+        self.update_summary()
+        if not self.prober.busy():
+            self.timer.stop()
+            self.check_button.setEnabled(True)
+
+    def update_summary(self):
+        self.summary_label.setText(f"Checked {self.checked} of {self.total}, {self.succeeded} OK, "
+                                   f"{self.checked - self.succeeded} failed")
@@ -0,0 +1,127 @@
+import logging
+import time
+import cv2
+
+from include.capture_profile import downscale
+from include.metrics import LAG_BUCKETS, Histogram
+
+
+# read     - повне декодування кожного кадру (стара поведінка)
+# grab     - лише grab() між знімками, retrieve() тільки коли настав інтервал
+# keyframe - як grab, але знімок береться з найближчого ключового кадру
+CAPTURE_MODES = ('read', 'grab', 'keyframe')
+DEFAULT_CAPTURE_MODE = 'grab'
+
+# Скільки кадрів максимально чекати на ключовий кадр (~10 с при 25 fps)
+MAX_KEYFRAME_WAIT = 250
+
+
+class CaptureStats():
+    def __init__(self):
+        self.frames_grabbed = 0
+        # Кадри, отримані через retrieve()/read(). Бекенд FFmpeg декодує вже в grab(),
+        # тож це не вся робота декодера, а лише кадри, перетворені в зображення
+        self.frames_retrieved = 0
+        self.cpu_time = 0.0
+        self.started = time.monotonic()
+        self._cpu_mark = None
+        # Час retrieve()/read() кадру і запізнення знімка відносно розкладу
+        self.decode_time = Histogram()
+        self.lag = Histogram(LAG_BUCKETS)
+
+    def begin(self):
+        # thread_time рахує лише поточний потік, тому begin/sample_cpu
+        # мають викликатися з того самого потоку захоплення
+        self._cpu_mark = time.thread_time()
+
+    def sample_cpu(self):
+        if self._cpu_mark is not None:
+            now = time.thread_time()
+            self.cpu_time += now - self._cpu_mark
+            self._cpu_mark = now
+
+    def cpu_percent(self):
+        elapsed = time.monotonic() - self.started
+        return 100.0 * self.cpu_time / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self):
+        return {
+            'frames_grabbed': self.frames_grabbed,
+            'frames_retrieved': self.frames_retrieved,
+            'cpu_time': round(self.cpu_time, 3),
+            'cpu_percent': round(self.cpu_percent(), 1),
+            'decode_seconds': self.decode_time.as_dict(),
+            'lag_seconds': self.lag.as_dict(),
+        }
+
+    def __str__(self):
+        return (f"grabbed={self.frames_grabbed} retrieved={self.frames_retrieved} "
+                f"cpu={self.cpu_time:.2f}s ({self.cpu_percent():.1f}%)")
+
+
+class FrameGrabber():
+    def __init__(self, cap, mode=DEFAULT_CAPTURE_MODE, stats=None, max_width=None):
+        if mode not in CAPTURE_MODES:
+            logging.warning(f"Unknown capture mode '{mode}', using '{DEFAULT_CAPTURE_MODE}'")
+            mode = DEFAULT_CAPTURE_MODE
+
+        self.keyframe_prop = getattr(cv2, 'CAP_PROP_LRF_HAS_KEY_FRAME', None)
+        if mode == 'keyframe' and self.keyframe_prop is None:
+            logging.warning("OpenCV build has no CAP_PROP_LRF_HAS_KEY_FRAME, falling back to 'grab' mode")
+            mode = 'grab'
+
+        self.cap = cap
+        self.mode = mode
+        self.stats = stats if stats is not None else CaptureStats()
+        # Ширина, до якої зменшуються знімки (None - без зменшення)
+        self.max_width = max_width
+
+    def skip(self):
+        # Кадр, який не зберігаємо: у режимах grab/keyframe тільки демультиплексуємо
+        if self.mode == 'read':
+            started = time.perf_counter()
+            ret, _ = self.cap.read()
+            if ret:
+                self.stats.decode_time.observe(time.perf_counter() - started)
+                self.stats.frames_grabbed += 1
+                self.stats.frames_retrieved += 1
+            return ret
+
+        ret = self.cap.grab()
+        if ret:
+            self.stats.frames_grabbed += 1
+        return ret
+
+    def snapshot(self):
+        if self.mode == 'read':
+            started = time.perf_counter()
+            ret, frame = self.cap.read()
+            if ret:
+                self.stats.decode_time.observe(time.perf_counter() - started)
+                self.stats.frames_grabbed += 1
+                self.stats.frames_retrieved += 1
+                frame = downscale(frame, self.max_width)
+            return ret, frame
+
+        if not self.cap.grab():
+            return False, None
+        self.stats.frames_grabbed += 1
+
+        if self.mode == 'keyframe':
+            waited = 0
+            while not self.is_keyframe() and waited < MAX_KEYFRAME_WAIT:
+                if not self.cap.grab():
+                    return False, None
+                self.stats.frames_grabbed += 1
+                waited += 1
+
+        started = time.perf_counter()
+        ret, frame = self.cap.retrieve()
+        if ret:
+            self.stats.decode_time.observe(time.perf_counter() - started)
+            self.stats.frames_retrieved += 1
+            frame = downscale(frame, self.max_width)
+        return ret, frame
+
+    def is_keyframe(self):
+        return bool(self.cap.get(self.keyframe_prop))
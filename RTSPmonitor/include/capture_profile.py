@@ -0,0 +1,96 @@
+import os
+import threading
+from contextlib import contextmanager
+
+import cv2
+
+
+# Транспорт RTSP; OpenCV без OPENCV_FFMPEG_CAPTURE_OPTIONS сам ставить tcp
+TRANSPORTS = ('tcp', 'udp', 'udp_multicast', 'http')
+DEFAULT_TRANSPORT = 'tcp'
+
+OPTIONS_VARIABLE = 'OPENCV_FFMPEG_CAPTURE_OPTIONS'
+
+
+def ffmpeg_options(device):
+    # Рядок "ключ;значення|ключ;значення" для OPENCV_FFMPEG_CAPTURE_OPTIONS.
+    # None - профіль не заданий, VideoCapture відкривається як раніше
+    options = []
+    transport = getattr(device, 'rtsp_transport', None) or DEFAULT_TRANSPORT
+    probe_size = getattr(device, 'probe_size', None)
+    analyze_duration = getattr(device, 'analyze_duration', None)
+    threads = getattr(device, 'decoder_threads', None)
+    if probe_size:
+        # Менше байтів на аналіз потоку - швидше відкриття
+        options.append(f'probesize;{int(probe_size)}')
+    if analyze_duration:
+        options.append(f'analyzeduration;{int(analyze_duration * 1000000)}')
+    if threads and not hasattr(cv2, 'CAP_PROP_N_THREADS'):
+        # Старі збірки OpenCV без параметра N_THREADS
+        options.append(f'threads;{int(threads)}')
+    if not options and transport == DEFAULT_TRANSPORT:
+        return None
+    # Змінна замінює типові налаштування OpenCV, тож транспорт задаємо явно
+    return '|'.join([f'rtsp_transport;{transport}'] + options)
+
+
+def capture_params(device, open_timeout, read_timeout):
+    # Параметри конструктора VideoCapture (OpenCV 4.5.2+)
+    params = []
+    if hasattr(cv2, 'CAP_PROP_OPEN_TIMEOUT_MSEC'):
+        params += [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, open_timeout, cv2.CAP_PROP_READ_TIMEOUT_MSEC, read_timeout]
+    threads = getattr(device, 'decoder_threads', None)
+    if threads and hasattr(cv2, 'CAP_PROP_N_THREADS'):
+        params += [cv2.CAP_PROP_N_THREADS, int(threads)]
+    return params
+
+
+class FFmpegOptionsGate():
+    # OpenCV читає OPENCV_FFMPEG_CAPTURE_OPTIONS з оточення процесу під час
+    # відкриття потоку. Пристрої з однаковим профілем відкриваються паралельно,
+    # а з іншим чекають, доки ці відкриття завершаться. Значення, задане до запуску,
+    # діє для пристроїв без профілю і повертається, коли відкриттів немає
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.original = os.environ.get(OPTIONS_VARIABLE)
+        self.current = None
+        self.users = 0
+
+    def _set(self, options):
+        value = options if options is not None else self.original
+        if value is None:
+            os.environ.pop(OPTIONS_VARIABLE, None)
+        else:
+            os.environ[OPTIONS_VARIABLE] = value
+        self.current = options
+
+    @contextmanager
+    def use(self, options):
+        with self.condition:
+            while self.users and self.current != options:
+                self.condition.wait()
+            if self.current != options:
+                self._set(options)
+            self.users += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.users -= 1
+                if not self.users and self.current is not None:
+                    self._set(None)
+                self.condition.notify_all()
+
+
+options_gate = FFmpegOptionsGate()
+
+
+def downscale(frame, max_width):
+    # Зменшення після декодування: менше роботи для JPEG, детектора змін і FTP
+    if not max_width:
+        return frame
+    height, width = frame.shape[:2]
+    if width <= max_width:
+        return frame
+    size = (int(max_width), max(int(height * max_width / width), 1))
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
@@ -0,0 +1,77 @@
+import math
+
+import cv2
+import numpy as np
+
+
+# off  - зберігати кожен знімок
+# diff - частка змінених пікселів мініатюри, поріг у відсотках
+# hash - перцептивний dHash 64 біти, поріг у кількості різних бітів
+CHANGE_METHODS = ('off', 'diff', 'hash')
+DEFAULT_THRESHOLDS = {'diff': 1.0, 'hash': 6}
+
+# Розмір сірої мініатюри для порівняння і різниця яскравості,
+# нижче якої піксель вважається незмінним (шум сенсора і стиснення)
+THUMBNAIL_SIZE = (64, 36)
+PIXEL_THRESHOLD = 25
+
+
+def parse_threshold(text):
+    # 0 - дозволене значення (будь-яка зміна), порожньо чи неправильно - типовий поріг методу
+    try:
+        threshold = float(text)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(threshold) or threshold < 0:
+        return None
+    return threshold
+
+
+def thumbnail(frame, size=THUMBNAIL_SIZE):
+    # Спочатку зменшення (INTER_AREA усереднює шум), потім сірий - так дешевше
+    small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    return small
+
+
+def dhash(frame):
+    small = thumbnail(frame, (9, 8))
+    bits = (small[:, 1:] > small[:, :-1]).reshape(-1)
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class ChangeDetector():
+    # Порівнює кадр з останнім збереженим, а не з попереднім,
+    # щоб повільні зміни (світанок, тінь) теж колись потрапили на знімок
+    def __init__(self, method='diff', threshold=None):
+        if method not in CHANGE_METHODS or method == 'off':
+            raise ValueError(f"Unknown change detection method: {method}")
+        self.method = method
+        self.threshold = threshold if threshold is not None else DEFAULT_THRESHOLDS[method]
+        self.reference = None
+        self.last_score = None
+
+    def signature(self, frame):
+        if self.method == 'hash':
+            return dhash(frame)
+        return thumbnail(frame)
+
+    def score(self, signature):
+        if self.method == 'hash':
+            return bin(signature ^ self.reference).count('1')
+        if signature.shape != self.reference.shape:
+            return 100.0
+        changed = cv2.absdiff(signature, self.reference) > PIXEL_THRESHOLD
+        return 100.0 * np.count_nonzero(changed) / changed.size
+
+    def check(self, frame):
+        # Повертає (змінився, підпис); підпис передається в accept після збереження
+        signature = self.signature(frame)
+        if self.reference is None:
+            return True, signature
+        self.last_score = self.score(signature)
+        return self.last_score >= self.threshold, signature
+
+    def accept(self, signature):
+        self.reference = signature
@@ -0,0 +1,278 @@
+import errno
+import logging
+import os
+from configparser import ConfigParser
+from ftplib import FTP, FTP_TLS, error_perm, error_temp
+
+
+# Розмір блоку відправки; обмеження швидкості перевіряється після кожного блоку
+UPLOAD_BLOCK_SIZE = 64 * 1024
+# Шматок копіювання в ядрі для локального дзеркала
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+DESTINATION_TYPES = ('ftp', 'ftps', 'sftp', 'local')
+DEFAULT_PORTS = {'ftp': 21, 'ftps': 21, 'sftp': 22}
+DEFAULT_WORKERS = 3
+# Розширення тимчасового файлу, поки копія в дзеркалі чи на SFTP не завершена
+PARTIAL_SUFFIX = '.part'
+# Помилки дзеркала, що стосуються всієї теки, а не окремого файлу (частини немає у Windows)
+MIRROR_UNAVAILABLE_ERRORS = tuple(getattr(errno, name) for name in ('ENOSPC', 'EDQUOT', 'EIO', 'ESTALE', 'ENOTCONN', 'ETIMEDOUT')
+                                  if hasattr(errno, name))
+
+
+def load_destinations(path='destinations.conf'):
+    # Додаткові напрямки відправки, секція - назва напрямку:
+    # [mirror] type = local, path = /mnt/nfs/cams; [backup] type = sftp, host = ...
+    config = ConfigParser()
+    config.read(path)
+    destinations = {}
+    for name in config.sections():
+        section = config[name]
+        kind = section.get('type', 'ftp')
+        if kind not in DESTINATION_TYPES:
+            logging.error(f"Unknown upload destination type '{kind}' in {path} [{name}], skipped")
+            continue
+        destination = {
+            'name': name,
+            'type': kind,
+            'workers': section.getint('workers', fallback=DEFAULT_WORKERS),
+        }
+        if kind == 'local':
+            destination['path'] = section.get('path')
+        else:
+            destination.update({
+                'host': section.get('host'),
+                'port': section.getint('port', fallback=DEFAULT_PORTS[kind]),
+                'username': section.get('username', fallback=''),
+                'password': section.get('password', fallback=''),
+                'key_file': section.get('key_file', fallback=None),
+                'remote_path': section.get('remote_path', fallback='/' if kind != 'sftp' else '.'),
+            })
+        destinations[name] = destination
+    return destinations
+
+
+def parse_destinations(text):
+    # Колонка devices.destinations: назви через кому, порожньо - всі напрямки
+    return tuple(name.strip() for name in (text or '').split(',') if name.strip())
+
+
+def make_backend(config):
+    return BACKENDS[config.get('type') or 'ftp'](config)
+
+
+class FTPBackend():
+    # Бекенд відправки: connect() повертає з'єднання, решта методів працює з ним.
+    # Помилки з connection_errors означають обрив чи тимчасову недоступність - пул
+    # перепідключається, а файл лишається в черзі. 4xx (421, 452 - немає місця) теж тимчасові
+    connection_errors = (OSError, EOFError, error_temp)
+
+    def __init__(self, config):
+        self.config = config
+
+    def describe(self):
+        return f"{self.config.get('type') or 'ftp'}://{self.config['host']}:{self.config.get('port', 21)}"
+
+    def _client(self):
+        return FTP(timeout=30, encoding='utf-8')
+
+    def connect(self):
+        config = self.config
+        ftp = self._client()
+        ftp.connect(config['host'], config.get('port') or 21)
+        ftp.login(config['username'], config['password'])
+        self._secure(ftp)
+        ftp.cwd(config.get('remote_path') or '/')
+        return ftp
+
+    def _secure(self, ftp):
+        pass
+
+    def make_dir(self, ftp, path):
+        try:
+            ftp.mkd(path)
+        except error_perm:
+            pass  # 550 - тека вже існує
+
+    def store(self, ftp, remote_name, source, progress=None):
+        ftp.storbinary(f"STOR {remote_name}", source, UPLOAD_BLOCK_SIZE,
+                       (lambda block: progress(len(block))) if progress is not None else None)
+
+    def noop(self, ftp):
+        ftp.voidcmd('NOOP')
+
+    def close(self, ftp):
+        try:
+            ftp.quit()
+        except Exception:
+            ftp.close()
+
+
+class FTPSBackend(FTPBackend):
+    # Явний TLS (AUTH TLS), канал даних теж шифрується (PROT P)
+    def _client(self):
+        return FTP_TLS(timeout=30, encoding='utf-8')
+
+    def _secure(self, ftp):
+        ftp.prot_p()
+
+
+class SFTPBackend():
+    # SSH через paramiko (необов'язкова залежність): пароль або ключ key_file.
+    # Файл пишеться як .part і перейменовується, тож на сервері не буває недописаних знімків
+    def __init__(self, config):
+        self.config = config
+        try:
+            import paramiko
+        except ImportError:
+            paramiko = None
+        self.paramiko = paramiko
+        # IOError від SFTP (немає доступу, немає теки) стосується окремого файлу
+        self.connection_errors = (EOFError, ConnectionError, TimeoutError) + ((paramiko.SSHException,) if paramiko else ())
+
+    def describe(self):
+        return f"sftp://{self.config['host']}:{self.config.get('port', 22)}"
+
+    def connect(self):
+        if self.paramiko is None:
+            raise RuntimeError("SFTP uploads need paramiko (pip install paramiko)")
+        config = self.config
+        transport = self.paramiko.Transport((config['host'], config.get('port') or 22))
+        try:
+            key = self._load_key(config['key_file']) if config.get('key_file') else None
+            transport.connect(username=config['username'], password=config.get('password') or None, pkey=key)
+            sftp = self.paramiko.SFTPClient.from_transport(transport)
+            sftp.chdir(config.get('remote_path') or '.')
+        except Exception:
+            transport.close()
+            raise
+        return sftp
+
+    def _load_key(self, path):
+        # Кожен клас ключа paramiko читає лише свій тип, тож пробуємо всі (DSSKey - у старих версіях)
+        for name in ('Ed25519Key', 'ECDSAKey', 'RSAKey', 'DSSKey'):
+            key_class = getattr(self.paramiko, name, None)
+            if key_class is None:
+                continue
+            try:
+                return key_class.from_private_key_file(path)
+            except self.paramiko.PasswordRequiredException:
+                raise
+            except self.paramiko.SSHException:
+                continue
+        raise self.paramiko.SSHException(f"Unsupported or invalid private key {path}")
+
+    def make_dir(self, sftp, path):
+        try:
+            sftp.mkdir(path)
+        except IOError:
+            pass  # тека вже існує
+
+    def store(self, sftp, remote_name, source, progress=None):
+        partial_name = remote_name + PARTIAL_SUFFIX
+        with sftp.open(partial_name, 'wb') as target:
+            # Без очікування підтвердження кожного блоку
+            target.set_pipelined(True)
+            while True:
+                block = source.read(UPLOAD_BLOCK_SIZE)
+                if not block:
+                    break
+                target.write(block)
+                if progress is not None:
+                    progress(len(block))
+        sftp.posix_rename(partial_name, remote_name)
+
+    def noop(self, sftp):
+        sftp.stat('.')
+
+    def close(self, sftp):
+        transport = sftp.get_channel().get_transport()
+        sftp.close()
+        transport.close()
+
+
+class LocalBackend():
+    # Дзеркало в локальну теку або змонтований NFS/SMB замість окремого rsync.
+    # Файли копіюються в ядрі (copy_file_range, sendfile), без читання в пам'ять Python
+    connection_errors = (ConnectionError,)
+
+    def __init__(self, config):
+        self.config = config
+        self.root = config['path']
+
+    def describe(self):
+        return self.root
+
+    def connect(self):
+        os.makedirs(self.root, exist_ok=True)
+        return self.root
+
+    def make_dir(self, root, path):
+        os.makedirs(os.path.join(root, *path.split('/')), exist_ok=True)
+
+    def store(self, root, remote_name, source, progress=None):
+        target_path = os.path.join(root, *remote_name.split('/'))
+        partial_path = target_path + PARTIAL_SUFFIX
+        try:
+            with open(partial_path, 'wb') as target:
+                copy_file(source, target, progress)
+            os.replace(partial_path, target_path)
+        except OSError as e:
+            if e.errno in MIRROR_UNAVAILABLE_ERRORS or not os.path.isdir(root):
+                # Відмонтований NFS чи повний диск - як обрив з'єднання
+                raise ConnectionError(e.errno, f"Mirror {root} is not available: {e.strerror}") from e
+            raise
+
+    def noop(self, root):
+        if not os.path.isdir(root):
+            raise FileNotFoundError(errno.ENOENT, "Mirror folder is not available", root)
+
+    def close(self, root):
+        pass
+
+
+def copy_file(source, target, progress=None):
+    # copy_file_range (Linux 4.5+) копіює без виходу в простір користувача, а на NFS 4.2
+    # і на тій самій файловій системі - взагалі без передачі даних через клієнт.
+    # sendfile - для старих ядер і різних файлових систем, блоками - для кадрів з пам'яті та Windows
+    try:
+        source_fd = source.fileno()
+    except (AttributeError, OSError, ValueError):
+        source_fd = None
+    if source_fd is not None:
+        target_fd = target.fileno()
+        size = os.fstat(source_fd).st_size
+        offset = 0
+        for copy in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+            if copy is None:
+                continue
+            try:
+                while offset < size:
+                    if copy is os.sendfile:
+                        sent = copy(target_fd, source_fd, offset, min(COPY_CHUNK_SIZE, size - offset))
+                    else:
+                        sent = copy(source_fd, target_fd, min(COPY_CHUNK_SIZE, size - offset), offset)
+                    if not sent:
+                        break
+                    offset += sent
+                    if progress is not None:
+                        progress(sent)
+                return offset
+            except OSError as e:
+                # Файлова система чи ядро не підтримують виклик - пробуємо наступний спосіб
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP):
+                    raise
+        source.seek(offset)
+    copied = 0
+    while True:
+        block = source.read(UPLOAD_BLOCK_SIZE)
+        if not block:
+            break
+        target.write(block)
+        copied += len(block)
+        if progress is not None:
+            progress(len(block))
+    return copied
+
+
+BACKENDS = {'ftp': FTPBackend, 'ftps': FTPSBackend, 'sftp': SFTPBackend, 'local': LocalBackend}
@@ -0,0 +1,136 @@
+from types import SimpleNamespace
+
+from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton, QCheckBox,
+                             QTableWidget, QTableWidgetItem, QMessageBox)
+from PyQt5.QtGui import QColor
+from PyQt5.QtCore import QTimer
+
+from include.device_io import read_devices
+from include.probe import PROBE_TIMEOUT, StreamProber
+from include.timing import parse_interval
+
+
+COLUMNS = ["Name", "RTSP URL", "Result"]
+
+
+class DeviceImportWindow(QDialog):
+    # Імпорт пристроїв з CSV/JSON: необов'язкова паралельна перевірка потоків,
+    # потім одна транзакція registry.add_many і одне оновлення таблиці
+    def __init__(self, registry):
+        super().__init__()
+        self.registry = registry
+        self.prober = StreamProber()
+        self.rows = []
+        self.failed = {}  # номер рядка -> помилка перевірки
+        self.checked = 0
+
+        self.setWindowTitle("Import devices")
+        self.setGeometry(150, 150, 800, 500)
+
+        self.layout = QVBoxLayout()
+        self.file_label = QLabel("")
+
+        self.probe_input = QCheckBox("Check streams before import (only reachable devices are added)")
+        self.timeout_label = QLabel("Timeout (seconds):")
+        self.timeout_input = QLineEdit()
+        self.timeout_input.setText(str(PROBE_TIMEOUT))
+
+        self.import_button = QPushButton("Import")
+        self.import_button.clicked.connect(self.start_import)
+        self.summary_label = QLabel("")
+
+        self.rows_table = QTableWidget()
+        self.rows_table.setColumnCount(len(COLUMNS))
+        self.rows_table.setHorizontalHeaderLabels(COLUMNS)
+        self.rows_table.horizontalHeader().setStretchLastSection(True)
+
+        controls = QHBoxLayout()
+        controls.addWidget(self.probe_input)
+        controls.addWidget(self.timeout_label)
+        controls.addWidget(self.timeout_input)
+        controls.addWidget(self.import_button)
+
+        self.layout.addWidget(self.file_label)
+        self.layout.addLayout(controls)
+        self.layout.addWidget(self.summary_label)
+        self.layout.addWidget(self.rows_table)
+        self.setLayout(self.layout)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.collect_probes)
+
+    def load(self, path):
+        try:
+            self.rows, errors = read_devices(path)
+        except Exception as e:
+            QMessageBox.warning(self, "Error", f"Failed to read {path}: {e}")
+            return False
+        self.failed = {}
+        self.file_label.setText(f"{path}: {len(self.rows)} devices")
+        self.rows_table.setRowCount(len(self.rows))
+        for index, row in enumerate(self.rows):
+            self.rows_table.setItem(index, 0, QTableWidgetItem(row['name']))
+            self.rows_table.setItem(index, 1, QTableWidgetItem(row['rtsp_url']))
+            self.rows_table.setItem(index, 2, QTableWidgetItem(""))
+        self.import_button.setEnabled(bool(self.rows))
+        self.summary_label.setText("")
+        if errors:
+            QMessageBox.warning(self, "Warning", "Skipped invalid rows:\n" +
+                                '\n'.join(f"row {number}: {error}" for number, error in errors[:20]))
+        return True
+
+    def start_import(self):
+        if not self.rows:
+            return
+        self.import_button.setEnabled(False)
+        if not self.probe_input.isChecked():
+            self.finish_import()
+            return
+        # Перевірка з профілем захоплення з файлу, паралельно в процесах перевірки
+        timeout = parse_interval(self.timeout_input.text(), default=PROBE_TIMEOUT)
+        self.failed = {}
+        self.checked = 0
+        for index in range(len(self.rows)):
+            self.set_result(index, "Checking...")
+        self.prober.submit_many(((index, SimpleNamespace(**row)) for index, row in enumerate(self.rows)), timeout)
+        self.timer.start(200)
+
+    def collect_probes(self):
+        for index, result in self.prober.take_results():
+            self.checked += 1
+            if result.ok:
+                self.set_result(index, f"OK, {result}")
+            else:
+                self.failed[index] = result.error
+                self.set_result(index, f"Stream check failed: {result.error}", QColor(255, 0, 0))
+        self.summary_label.setText(f"Checked {self.checked} of {len(self.rows)}, {len(self.failed)} failed")
+        if not self.prober.busy():
+            self.timer.stop()
+            self.finish_import()
+
+    def finish_import(self):
+        rows = [row for index, row in enumerate(self.rows) if index not in self.failed]
+        try:
+            added, skipped = self.registry.add_many(rows)
+        except Exception as e:
+            QMessageBox.warning(self, "Error", f"Error while saving device data: {e}")
+            self.import_button.setEnabled(True)
+            return
+        # add_many повертає пропущені рядки тими самими об'єктами
+        reasons = {id(row): reason for row, reason in skipped}
+        for index, row in enumerate(self.rows):
+            if index in self.failed:
+                continue
+            if id(row) in reasons:
+                self.set_result(index, f"Skipped: {reasons[id(row)]}", QColor(255, 200, 0))
+            else:
+                self.set_result(index, "Added", QColor(0, 255, 0))
+        self.summary_label.setText(f"Added {len(added)}, skipped {len(skipped)} duplicates, "
+                                   f"{len(self.failed)} failed stream check")
+        self.rows = []
+
+    def set_result(self, index, text, color=None):
+        item = QTableWidgetItem(text)
+        if color is not None:
+            item.setBackground(color)
+        self.rows_table.setItem(index, 2, item)
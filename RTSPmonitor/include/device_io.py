@@ -0,0 +1,101 @@
+import csv
+import json
+import logging
+import os
+
+from db.database import Device
+
+
+# Усі налаштування пристрою, крім id; порядок - як у таблиці devices
+EXPORT_FIELDS = [column.name for column in Device.__table__.columns if column.name != 'id']
+REQUIRED_FIELDS = ('name', 'rtsp_url')
+FORMATS = ('csv', 'json')
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 'on')
+
+
+def file_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension not in FORMATS:
+        raise ValueError(f"Unsupported file type '{extension}', use .csv or .json")
+    return extension
+
+
+def export_devices(devices, path):
+    rows = [{field: getattr(device, field, None) for field in EXPORT_FIELDS} for device in devices]
+    if file_format(path) == 'json':
+        with open(path, 'w', encoding='utf-8') as export_file:
+            json.dump(rows, export_file, ensure_ascii=False, indent=2)
+    else:
+        with open(path, 'w', encoding='utf-8', newline='') as export_file:
+            writer = csv.DictWriter(export_file, fieldnames=EXPORT_FIELDS)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({field: '' if value is None else value for field, value in row.items()})
+    logging.info(f"Exported {len(rows)} devices to {path}")
+    return len(rows)
+
+
+def read_devices(path):
+    # Повертає (рядки для Device, [(номер рядка, помилка)]).
+    # Порожні клітинки CSV - типові значення колонок
+    if file_format(path) == 'json':
+        with open(path, encoding='utf-8') as import_file:
+            raw_rows = json.load(import_file)
+        if not isinstance(raw_rows, list):
+            raise ValueError("JSON file must contain a list of devices")
+    else:
+        with open(path, encoding='utf-8-sig', newline='') as import_file:
+            raw_rows = list(csv.DictReader(import_file))
+
+    rows = []
+    errors = []
+    unknown = set()
+    for number, raw in enumerate(raw_rows, start=1):
+        try:
+            if not isinstance(raw, dict):
+                raise ValueError("device must be an object")
+            unknown.update(key for key in raw if key not in EXPORT_FIELDS and key != 'id')
+            rows.append(device_row(raw))
+        except ValueError as e:
+            errors.append((number, str(e)))
+    if unknown:
+        logging.warning(f"Ignored unknown device fields in {path}: {', '.join(sorted(unknown))}")
+    return rows, errors
+
+
+def device_row(raw):
+    row = {}
+    for column in Device.__table__.columns:
+        if column.name == 'id' or column.name not in raw:
+            continue
+        value = raw[column.name]
+        if isinstance(value, str):
+            value = value.strip()
+            if value == '':
+                value = None
+        if value is None:
+            if not column.nullable and column.default is None:
+                # save_path - порожній рядок означає "лише FTP"
+                value = ''
+            else:
+                continue
+        row[column.name] = convert(column, value)
+    for field in REQUIRED_FIELDS:
+        if not row.get(field):
+            raise ValueError(f"'{field}' is required")
+    return row
+
+
+def convert(column, value):
+    python_type = column.type.python_type
+    try:
+        if python_type is bool:
+            return value if isinstance(value, bool) else str(value).lower() in TRUE_VALUES
+        if python_type is int:
+            return int(float(value))
+        if python_type is float:
+            return float(value)
+        return str(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid value for '{column.name}': {value!r}")
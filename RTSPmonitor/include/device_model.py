@@ -0,0 +1,144 @@
+from bisect import bisect_left
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+from PyQt5.QtGui import QColor
+
+
+COLUMNS = ("Name", "RTSP URL", "Save Path", "Status", "Last snapshot")
+NAME_COLUMN, URL_COLUMN, SAVE_PATH_COLUMN, STATUS_COLUMN, SNAPSHOT_COLUMN = range(len(COLUMNS))
+
+# Кольори колонки Status для станів потоку з планувальника
+STATE_COLORS = {
+    'streaming': QColor(0, 255, 0),
+    'stalled': QColor(255, 200, 0),
+    'backoff': QColor(255, 165, 0),
+    'failed': QColor(255, 0, 0),
+}
+ACTIVE_COLOR = QColor(0, 255, 0)
+INACTIVE_COLOR = QColor(255, 255, 255)
+
+
+class DeviceTableModel(QAbstractTableModel):
+    # Таблиця пристроїв поверх кешу реєстру. Події реєстру змінюють лише свої рядки
+    # (вставка, видалення, dataChanged) без повторного читання бази і перебудови таблиці.
+    # Стан потоків читається з планувальника refresh_states() з таймера GUI,
+    # і dataChanged надсилається тільки для рядків, де стан справді змінився
+    def __init__(self, registry, engine=None):
+        super().__init__()
+        self.registry = registry
+        self.engine = engine
+        self.devices = registry.all()  # за зростанням id, як registry.all()
+        self.ids = [device.id for device in self.devices]
+        self.statuses = {}  # id -> (стан, помилка, перепідключення, останній знімок)
+        registry.subscribe(self.device_changed)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.devices)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return COLUMNS[section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        device = self.devices[index.row()]
+        column = index.column()
+        status = self.statuses.get(device.id)
+        if role == Qt.DisplayRole:
+            if column == NAME_COLUMN:
+                return device.name
+            if column == URL_COLUMN:
+                return device.rtsp_url
+            if column == SAVE_PATH_COLUMN:
+                return device.save_path
+            if column == STATUS_COLUMN:
+                if status is not None:
+                    return status[0].capitalize()
+                return "Active" if device.active else "Inactive"
+            if column == SNAPSHOT_COLUMN and status is not None and status[3] is not None:
+                return status[3].strftime('%Y-%m-%d %H:%M:%S')
+        elif role == Qt.BackgroundRole and column == STATUS_COLUMN:
+            if status is not None and status[0] in STATE_COLORS:
+                return STATE_COLORS[status[0]]
+            return ACTIVE_COLOR if device.active else INACTIVE_COLOR
+        elif role == Qt.ToolTipRole and column == STATUS_COLUMN and status is not None and status[1]:
+            return f"{status[1]}, reconnects: {status[2]}"
+        return None
+
+    def device(self, row):
+        if 0 <= row < len(self.devices):
+            return self.devices[row]
+        return None
+
+    def row_of(self, device_id):
+        row = bisect_left(self.ids, device_id)
+        if row < len(self.ids) and self.ids[row] == device_id:
+            return row
+        return None
+
+    def device_changed(self, event, record):
+        if event == 'imported':
+            self.insert_devices(record)
+        elif event == 'added':
+            self.insert_devices([record])
+        elif event == 'updated':
+            row = self.row_of(record.id)
+            if row is None:
+                self.insert_devices([record])
+                return
+            self.devices[row] = record
+            self.dataChanged.emit(self.index(row, 0), self.index(row, len(COLUMNS) - 1))
+        elif event == 'deleted':
+            row = self.row_of(record.id)
+            if row is None:
+                return
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.devices[row]
+            del self.ids[row]
+            self.statuses.pop(record.id, None)
+            self.endRemoveRows()
+
+    def insert_devices(self, records):
+        records = sorted((record for record in records if self.row_of(record.id) is None), key=lambda item: item.id)
+        if not records:
+            return
+        if not self.ids or records[0].id > self.ids[-1]:
+            # Нові id завжди більші - імпорт дописується в кінець одним сигналом
+            first = len(self.devices)
+            self.beginInsertRows(QModelIndex(), first, first + len(records) - 1)
+            self.devices.extend(records)
+            self.ids.extend(record.id for record in records)
+            self.endInsertRows()
+            return
+        for record in records:
+            row = bisect_left(self.ids, record.id)
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.devices.insert(row, record)
+            self.ids.insert(row, record.id)
+            self.endInsertRows()
+
+    def refresh_states(self):
+        if self.engine is None:
+            return
+        states = self.engine.get_states()
+        for device_id in list(self.statuses):
+            if device_id not in states:
+                self._set_status(device_id, None)
+        for device_id, state in states.items():
+            self._set_status(device_id, (state.state, state.error, state.reconnects, state.last_snapshot))
+
+    def _set_status(self, device_id, status):
+        if self.statuses.get(device_id) == status:
+            return
+        if status is None:
+            self.statuses.pop(device_id, None)
+        else:
+            self.statuses[device_id] = status
+        row = self.row_of(device_id)
+        if row is not None:
+            self.dataChanged.emit(self.index(row, STATUS_COLUMN), self.index(row, SNAPSHOT_COLUMN))
@@ -0,0 +1,308 @@
+import hashlib
+import logging
+import os
+import threading
+from datetime import datetime as dt
+
+from include.destinations import load_destinations, parse_destinations
+from include.frame_buffer import FrameRingBuffer
+from include.governor import ResourceGovernor, load_governor_config
+from include.layout import SnapshotNamer
+from include.metrics import MetricsServer, load_metrics_config
+from include.retention import RetentionEngine, load_retention_config
+from include.scheduler import CaptureScheduler, open_capture
+from include.sharding import ShardCoordinator
+from include.spool import UploadSpool, load_spool_config
+from include.timelapse import SegmentSink
+from include.uploader import NullLedger, UploadJob, UploadLedger, UploadPool, load_ftp_config
+from include.writer import SnapshotWriter, WriteJob
+
+from db.database import DataBase
+from db.registry import get_registry
+from db.segments import SegmentIndex
+from db.snapshots import SnapshotIndex, memory_key
+
+
+# Назва напрямку відправки з ftp_data.conf; його облік веде таблиця snapshots
+PRIMARY_DESTINATION = 'ftp'
+
+
+class CaptureEngine():
+    # Захоплення, збереження і відправка на FTP без залежності від PyQt5.
+    # Використовується і GUI (main.py), і headless-демоном (daemon.py)
+    def __init__(self, processes=0, ftp_config_path='ftp_data.conf', ledger_path='ftp_uploaded.txt',
+                 capture_factory=open_capture, db_url='sqlite:///rtsp_data.db', retention_config_path='retention.conf',
+                 metrics_config_path='metrics.conf', governor_config_path='governor.conf', spool_config_path='spool.conf',
+                 destinations_config_path='destinations.conf'):
+        # processes > 0 розподіляє пристрої між процесами
+        if processes > 0:
+            self.scheduler = ShardCoordinator(self.save_frames, processes=processes, on_preview=self.preview_frame)
+        else:
+            self.scheduler = CaptureScheduler(self.save_frames, on_preview=self.preview_frame,
+                                              capture_factory=capture_factory)
+        # Останній кадр попереднього перегляду кожного пристрою, GUI забирає його таймером
+        self.previews = {}
+        self.preview_devices = set()
+        self.preview_lock = threading.Lock()
+        self.ftp_config_path = ftp_config_path
+        # Обмеження диска, FTP і декодування та деградація пристроїв з нижчим пріоритетом
+        self.governor_config_path = governor_config_path
+        self.governor = ResourceGovernor(load_governor_config(governor_config_path), load=self.load_levels,
+                                         on_throttle=self.scheduler.set_throttle)
+        self.dropped = 0
+        self.frame_buffer = FrameRingBuffer()
+        # Таблиця snapshots - облік знімків і відправок; старий файловий облік
+        # читається лише при першому індексуванні теки пристрою
+        self.snapshots = SnapshotIndex(DataBase(db_url))
+        self.ledger_path = ledger_path
+        # Черга відправки на диску: знімки не губляться, поки FTP недоступний або програма закрита
+        self.spool_settings = load_spool_config(spool_config_path)
+        self.spool = UploadSpool.from_settings(self.spool_settings) if self.spool_settings['enabled'] else None
+        self.uploader = UploadPool(load_ftp_config(ftp_config_path), ledger=self.snapshots,
+                                   memory_buffer=self.frame_buffer, file_bucket=self.governor.upload_files,
+                                   byte_bucket=self.governor.upload_bytes, spool=self.spool, name=PRIMARY_DESTINATION)
+        # Основний FTP і додаткові напрямки з destinations.conf, кожен зі своїм пулом з'єднань і чергою.
+        # Словник замінюється цілком при перечитуванні, потоки запису бачать або старий, або новий
+        self.destinations_config_path = destinations_config_path
+        self.pools = {PRIMARY_DESTINATION: self.uploader}
+        self.device_destinations = {}
+        self.reload_destinations()
+        self.writer = SnapshotWriter(disk_bucket=self.governor.disk_bytes)
+        # Відеосегменти для пристроїв з video_mode both/video
+        self.segments = SegmentSink(SegmentIndex(self.snapshots.db), on_closed=self.segment_closed,
+                                    disk_bucket=self.governor.disk_bytes)
+        self.namer = SnapshotNamer()
+        # Політики зберігання застосовуються до всіх пристроїв бази, не лише активних
+        self.retention_config_path = retention_config_path
+        self.retention = RetentionEngine(self.snapshots.db, get_registry(db_url).all,
+                                         load_retention_config(retention_config_path), uploads=self.uploads_snapshots)
+        # HTTP /metrics, підсумок у лог і профайлер - за налаштуваннями metrics.conf
+        self.metrics_server = MetricsServer(self.get_metrics, load_metrics_config(metrics_config_path))
+        if not self.uploader.config:
+            logging.warning("FTP is not configured, uploads are disabled")
+
+    def start(self):
+        self.snapshots.start()
+        self.retention.start()
+        self.writer.start()
+        self.segments.start()
+        self.scheduler.start()
+        self.governor.start()
+        self.metrics_server.start()
+        for pool in self.pools.values():
+            if pool.config and not pool.running:
+                pool.start()
+
+    def stop(self):
+        # Порядок важливий: спочатку захоплення, потім запис, потім відправка
+        self.governor.stop()
+        self.scheduler.stop()
+        self.writer.stop()
+        self.segments.stop()
+        for pool in self.pools.values():
+            pool.stop()
+        self.retention.stop()
+        self.snapshots.stop()
+        self.metrics_server.stop()
+        for pool in self.pools.values():
+            if pool.spool is not None:
+                pool.spool.close()
+
+    def reload_ftp_config(self):
+        self.uploader.configure(load_ftp_config(self.ftp_config_path))
+        self.reload_destinations()
+
+    def reload_destinations(self):
+        configs = load_destinations(self.destinations_config_path)
+        pools = dict(self.pools)
+        for name in list(pools):
+            if name != PRIMARY_DESTINATION and name not in configs:
+                removed = pools.pop(name)
+                removed.stop()
+                if removed.spool is not None:
+                    removed.spool.close()
+                logging.info(f"Upload destination {name} removed")
+        for name, config in configs.items():
+            if name == PRIMARY_DESTINATION:
+                logging.error(f"Upload destination name '{name}' is reserved for ftp_data.conf, skipped")
+            elif name in pools:
+                pools[name].configure(config)
+            else:
+                pools[name] = self.destination_pool(config)
+                if self.has_devices():
+                    pools[name].start()
+        self.pools = pools
+
+    def destination_pool(self, config):
+        # Дзеркало на диск чи NFS обмежується лімітом диска, мережеві напрямки - лімітами відправки
+        spool = None
+        if self.spool_settings['enabled']:
+            spool_path = os.path.join(self.spool_settings['path'], 'destinations', config['name'])
+            spool = UploadSpool.from_settings(dict(self.spool_settings, path=spool_path))
+        if config['type'] == 'local':
+            file_bucket, byte_bucket = None, self.governor.disk_bytes
+        else:
+            file_bucket, byte_bucket = self.governor.upload_files, self.governor.upload_bytes
+        return UploadPool(config, workers=config['workers'], ledger=NullLedger(), memory_buffer=FrameRingBuffer(),
+                          file_bucket=file_bucket, byte_bucket=byte_bucket, spool=spool, name=config['name'])
+
+    def targets(self, device_id):
+        # Порожній список напрямків пристрою - відправка в усі
+        names = self.device_destinations.get(device_id)
+        return [pool for name, pool in self.pools.items() if not names or name in names]
+
+    def uploads_snapshots(self, device):
+        # Таблиця snapshots веде облік лише основного FTP: без нього знімки пристрою нічого не чекають.
+        # Налаштування з бази, а не device_destinations - зберігання стосується і неактивних пристроїв
+        if not self.uploader.config:
+            return False
+        names = parse_destinations(getattr(device, 'destinations', None))
+        return not names or PRIMARY_DESTINATION in names
+
+    def reload_retention_config(self):
+        self.retention.configure(load_retention_config(self.retention_config_path))
+
+    def reload_governor_config(self):
+        self.governor.configure(load_governor_config(self.governor_config_path))
+
+    def start_device(self, device):
+        names = parse_destinations(getattr(device, 'destinations', None))
+        unknown = [name for name in names if name not in self.pools]
+        if unknown:
+            logging.warning(f"Unknown upload destinations of device {device.name}: {', '.join(unknown)}")
+        self.device_destinations[device.id] = names
+        self.start()
+        self.sync_device(device)
+        self.scheduler.add_device(device)
+        self.governor.add_device(device)
+        logging.info(f"Monitoring started for device {device.name}")
+
+    def sync_device(self, device):
+        # Догрузка невідправлених знімків за індексом, без сканування теки.
+        # Таблиця snapshots веде облік лише основного FTP
+        if not self.snapshots.has_device(device.id) and device.save_path and os.path.isdir(device.save_path):
+            self.snapshots.backfill(device.id, device.name, device.save_path, UploadLedger(self.ledger_path))
+        if self.uploader not in self.targets(device.id) or (not self.uploader.running and self.spool is None):
+            return 0
+        count = 0
+        for path, name in self.snapshots.pending(device.id, limit=self.uploader.capacity):
+            if self.uploader.submit(UploadJob(name, local_path=path)):
+                count += 1
+            elif self.spool is None:
+                break
+        if count:
+            logging.info(f"Queued {count} pending snapshots of {device.name} for FTP upload")
+        return count
+
+    def stop_device(self, device_id):
+        self.scheduler.remove_device(device_id)
+        self.governor.remove_device(device_id)
+        # device_destinations лишається: кадри з черги запису ще йдуть на ті самі напрямки
+        self.segments.close_device(device_id)
+        if not self.scheduler.has_devices():
+            for pool in self.pools.values():
+                pool.stop()
+
+    def has_devices(self):
+        return self.scheduler.has_devices()
+
+    def get_states(self):
+        return self.scheduler.get_states()
+
+    def set_preview(self, device_id, fps=None):
+        with self.preview_lock:
+            if fps:
+                self.preview_devices.add(device_id)
+            else:
+                self.preview_devices.discard(device_id)
+                self.previews.pop(device_id, None)
+        self.scheduler.set_preview(device_id, fps)
+
+    def preview_frame(self, device, frame):
+        # Викликається з потоку захоплення; старий кадр просто замінюється
+        with self.preview_lock:
+            if device.id in self.preview_devices:
+                self.previews[device.id] = frame
+
+    def take_preview(self, device_id):
+        with self.preview_lock:
+            return self.previews.pop(device_id, None)
+
+    def get_metrics(self):
+        stats = self.scheduler.get_stats()
+        devices = {}
+        for device_id, state in self.scheduler.get_states().items():
+            devices[device_id] = dict(state.as_dict(), **stats.get(device_id, {}))
+        return {
+            'devices': devices,
+            'writer': self.writer.get_stats(),
+            'video': self.segments.get_stats(),
+            'upload': self.uploader.get_metrics(),
+            'destinations': {name: pool.get_metrics() for name, pool in self.pools.items()
+                             if name != PRIMARY_DESTINATION},
+            'retention': self.retention.get_stats(),
+            'governor': self.governor.get_stats(),
+        }
+
+    def load_levels(self):
+        # Заповненість черг (0..1) для ResourceGovernor; відкинуті кадри з минулої перевірки -
+        # ознака перевантаження незалежно від черг
+        levels = {
+            'writer': self.writer.queue.qsize() / self.writer.queue.maxsize,
+            'video': self.segments.get_stats()['queue_depth'] / sum(jobs.maxsize for jobs in self.segments.queues),
+        }
+        pools = list(self.pools.values())
+        running = [pool.fill_ratio() for pool in pools if pool.running]
+        if running:
+            levels['ftp'] = max(running)
+        # Процеси захоплення (ShardCoordinator) теж відкидають знімки, коли кадри не встигають забирати
+        dropped = (self.writer.stats.dropped + self.segments.stats.dropped +
+                   sum(pool.metrics.dropped for pool in pools) +
+                   sum(stats.get('dropped', 0) for stats in self.scheduler.get_stats().values()))
+        if dropped > self.dropped:
+            levels['dropped'] = 1.0
+        self.dropped = dropped
+        return levels
+
+    async def save_frames(self, device, frame):
+        try:
+            await self.async_save_frame(frame, device.name, device.save_path, device)
+        except Exception as e:
+            logging.error(f"Error while saving frame for device {device.name}: {e}")
+
+    async def async_save_frame(self, frame, device_name, save_path, device):
+        try:
+            now = dt.now()
+            video_mode = getattr(device, 'video_mode', 'off')
+            if video_mode != 'off':
+                # Кадр дописується у відкритий відеосегмент пристрою
+                self.segments.submit(device, frame, now)
+                if video_mode == 'video':
+                    return
+            # Ім'я з мілісекундами і підтеками розкладки пристрою, однакове локально і на FTP
+            image_name = self.namer.name(device, now)
+            # Кодування і запис виконує пул SnapshotWriter, тут лише ставимо кадр у чергу
+            # При перевантаженні пристрої з нижчим пріоритетом пишуться з меншою якістю
+            self.writer.submit(WriteJob(device.id, frame, image_name, save_path, self.governor.jpeg_quality(device),
+                                        self.frame_written, captured_at=now))
+        except Exception as e:
+            logging.error(f"Error in device {device_name}: {e}")
+
+    def frame_written(self, job, encoded, image_path):
+        # Викликається з потоку SnapshotWriter
+        self.snapshots.record(job.device_id, job.captured_at or dt.now(), job.image_name, image_path, len(encoded),
+                              hashlib.sha1(encoded).hexdigest())
+        for pool in self.targets(job.device_id):
+            if image_path:
+                # Новий файл ще не відправлявся, тому без перевірки обліку
+                pool.submit(UploadJob(job.image_name, local_path=image_path))
+            else:
+                # Кадр чекає в буфері пам'яті пулу, у чергу на диску - лише коли не вміщається
+                pool.submit(UploadJob(job.image_name, data=encoded, ledger_key=memory_key(job.device_id, job.image_name)))
+
+    def segment_closed(self, segment):
+        # Викликається з потоку SegmentSink: закритий сегмент відправляється
+        # тими самими пулами, що й знімки, з тим самим відносним ім'ям
+        for pool in self.targets(segment.device_id):
+            if pool.running or pool.spool is not None:
+                pool.submit(UploadJob(segment.name, local_path=segment.path))
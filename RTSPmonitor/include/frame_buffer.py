@@ -0,0 +1,103 @@
+import logging
+import threading
+from collections import deque
+
+
+# drop_oldest - витісняємо найстаріші кадри, щоб прийняти новий
+# drop_newest - відкидаємо новий кадр, поки буфер заповнений
+EVICTION_POLICIES = ('drop_oldest', 'drop_newest')
+
+
+class MemoryReader():
+    # Файлоподібний об'єкт для storbinary, що читає зрізи memoryview без копіювання
+    def __init__(self, data):
+        self.view = memoryview(data).cast('B')
+        self.offset = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.view) - self.offset
+        chunk = self.view[self.offset:self.offset + size]
+        self.offset += len(chunk)
+        return chunk
+
+    def close(self):
+        self.view.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FrameRingBuffer():
+    # Закодовані JPEG у пам'яті для пристроїв без save_path.
+    # key - ключ обліку відправлених (див. db.snapshots.memory_key).
+    # on_evict(name, data, key) отримує витіснені й відкинуті кадри (наприклад, у чергу на диску),
+    # без нього вони губляться
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_items=500, policy='drop_oldest', on_evict=None):
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.policy = policy
+        self.on_evict = on_evict
+        self.lock = threading.Lock()
+        self.entries = deque()
+        self.bytes = 0
+        self.evicted = 0
+        self.rejected = 0
+
+    def put(self, name, data, key=None):
+        size = len(data)
+        accepted = True
+        dropped = []
+        with self.lock:
+            if size > self.max_bytes:
+                self.rejected += 1
+                accepted = False
+                logging.warning(f"Frame {name} ({size} bytes) exceeds buffer memory cap")
+            while accepted and self.entries and (self.bytes + size > self.max_bytes or len(self.entries) >= self.max_items):
+                if self.policy == 'drop_newest':
+                    self.rejected += 1
+                    accepted = False
+                    break
+                old_entry = self.entries.popleft()
+                self.bytes -= len(old_entry[1])
+                self.evicted += 1
+                dropped.append(old_entry)
+            if accepted:
+                self.entries.append((name, data, key))
+                self.bytes += size
+            else:
+                dropped.append((name, data, key))
+        # Поза блокуванням: запис на диск не затримує інші кадри
+        for dropped_name, dropped_data, dropped_key in dropped:
+            if self.on_evict is not None:
+                self.on_evict(dropped_name, dropped_data, dropped_key)
+            else:
+                logging.warning(f"Dropped {dropped_name} from frame buffer")
+        return accepted
+
+    def take(self, count):
+        taken = []
+        with self.lock:
+            while self.entries and len(taken) < count:
+                entry = self.entries.popleft()
+                self.bytes -= len(entry[1])
+                taken.append(entry)
+        return taken
+
+    def __len__(self):
+        return len(self.entries)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'items': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'evicted': self.evicted,
+                'rejected': self.rejected,
+            }
@@ -1,35 +1,28 @@
 import logging
 from logging.handlers import RotatingFileHandler
 from PyQt5.QtWidgets import (
-    QApplication, QMainWindow, QVBoxLayout, QWidget, QLabel,
+    QMainWindow, QVBoxLayout, QWidget, QLabel,
     QLineEdit, QPushButton, QMessageBox
 )
-from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
-import os
-from ftplib import FTP
-from io import BytesIO
-from PIL import Image
+
+from include.destinations import make_backend
+from include.uploader import load_ftp_config
 
 
 class FTPConfigWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, engine=None):
 
         super().__init__()
         self.init_ui()
                 
-        self.thread_pool = ThreadPoolExecutor(max_workers=2)
-        self.ftp = None
-        self.remote_path = '/'
+        # CaptureEngine, якому передаємо нові налаштування після збереження
+        self.engine = engine
         # Максимальний розмір файлу в байтах (20 МБ)
         max_log_size = 20 * 1024 * 1024  
 
         # Створюємо об'єкт RotatingFileHandler
         handler_FTP = RotatingFileHandler('log/ftp_log.txt', maxBytes=max_log_size, backupCount=5)
-        
-        # Максимальна кількість фото у буфері
-        self.max_buffer_size = 5
-        self.buffer = []
 
         # Конфігуруємо рівень логування та обробник
         logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[handler_FTP])
@@ -75,22 +68,29 @@ class FTPConfigWindow(QMainWindow):
         host = self.host_input.text()
         username = self.username_input.text()
         password = self.password_input.text()
-        port = self.port_input.text()
+        port = self.port_input.text() or '21'
 
         try:
-            ftp = FTP(host)
-            ftp.login(username, password)
-            ftp.quit()
+            # Тип (ftp/ftps) і віддалена тека з попередніх налаштувань зберігаються
+            previous = load_ftp_config() or {}
+            settings = {'type': previous.get('type', 'ftp'), 'host': host, 'username': username,
+                        'password': password, 'port': int(port), 'remote_path': previous.get('remote_path', '/')}
+            backend = make_backend(settings)
+            backend.close(backend.connect())
 
             config = ConfigParser()
             config.add_section('FTP')
+            config.set('FTP', 'type', settings['type'])
             config.set('FTP', 'host', host)
             config.set('FTP', 'username', username)
             config.set('FTP', 'password', password)
             config.set('FTP', 'port', port)
+            config.set('FTP', 'remote_path', settings['remote_path'])
 
             with open('ftp_data.conf', 'w') as config_file:
                 config.write(config_file)
+            if self.engine:
+                self.engine.reload_ftp_config()
 
             QMessageBox.information(self, "Configuration Saved", "FTP configuration has been saved.")
         except Exception as e:
@@ -98,104 +98,18 @@ class FTPConfigWindow(QMainWindow):
             
     def connect_to_ftp(self):
         try:
-            config = ConfigParser()
-            config.read('ftp_data.conf')
-            
-            host = config.get('FTP', 'host')
-            username = config.get('FTP', 'username')
-            password = config.get('FTP', 'password')
-
-            ftp = FTP(host, username, password, acct='', timeout=None, source_address=None, encoding='utf-8')
-            ftp.login(username, password)
-            
-            QMessageBox.information(self, "Success", "Connected to FTP successfully!")  # Виводимо спливаюче повідомлення
-            return ftp
+            # Той самий бекенд і порт, що й у пулі відправки
+            settings = load_ftp_config()
+            if settings is None:
+                raise ValueError("FTP is not configured")
+            backend = make_backend(settings)
+            connection = backend.connect()
+            try:
+                backend.noop(connection)
+            finally:
+                # З'єднання потрібне лише для перевірки: QUIT, а якщо сервер не відповідає - close
+                backend.close(connection)
         except Exception as e:
             QMessageBox.warning(self, "Error", f"Failed to connect to FTP: {e}")  # Виводимо спливаюче повідомлення з помилкою
-            return None
-    
-    def disconnect_from_ftp(self, ftp):
-        try:
-            if ftp:
-                ftp.quit()
-                logging.info("Disconnected from FTP successfully!")
-        except Exception as e:
-            logging.error(f"Error while disconnecting from FTP: {e}")
-
-
-    def send_photo_from_path(self, ftp, device):
-        try:
-            self.thread_pool.submit(self.send_photo_to_ftp, ftp, device)
-        except Exception as e:
-            logging.error('Error:', e)
-            
-    def send_photo_to_ftp(self, ftp, device):
-        pass
-        try:
-            if not ftp:
-                logging.warning("Not connected to FTP")
-                return
-            # Отримуємо список всіх файлів у директорії save_path
-            local_files = os.listdir(device.save_path)
-            
-            # Отримуємо список файлів, які були відправлені раніше
-            remote_files = self.get_remote_files_list(ftp)
-            
-            # Визначаємо нові файли, які потрібно відправити
-            new_files = [file for file in local_files if file not in remote_files]
-            
-            # Відправляємо нові файли на FTP
-            for file in new_files:
-                local_file_path = os.path.join(device.save_path, file)
-                remote_file_name = os.path.join(self.remote_path, file)
-                with open(local_file_path, "rb") as local_file:
-                    ftp.storbinary(f"STOR {remote_file_name}", local_file)
-                logging.info(f"File {file} sent to FTP")
-        except Exception as e:
-            logging.error("Error sending new files:", e)
-
-    def get_remote_files_list(self, ftp):
-        try:
-            # Отримуємо список файлів на FTP
-            remote_files = ftp.nlst(self.remote_path)
-            return remote_files
-        except Exception as e:
-            logging.error("Error getting remote files list:", e)
-            return []
-        
-    
-    def send_photo_from_buffer(self, ftp, frame, image_name):
-        print(f'Added data to buffer: {len(self.buffer)} items')
-        print('here')
-        # Зберегти фото в буфер
-        image_bytes = BytesIO()
-        frame.save(image_bytes, format="JPEG")
-        self.buffer.append((image_bytes.getvalue(), image_name))
-
-        print(self.buffer)
-        # Перевірити розмір буфера
-        if len(self.buffer) >= self.max_buffer_size:
-            print('here0')
-            self.process_buffer(ftp)
-    
-    def process_buffer(self, ftp):
-        print('here1')
-        while self.buffer:
-            image_bytes, image_name = self.buffer.pop(0)
-            self.upload_to_ftp(ftp,image_bytes, image_name)
-            
-    def upload_to_ftp(self, ftp, image_bytes, image_name):
-        print('here2')
-        if not ftp:
-            logging.warning("Not connected to FTP")
             return
-        try:
-            ftp.cwd(self.remote_path)
-            with BytesIO(image_bytes) as img_buffer:
-                ftp.storbinary("STOR " + image_name, img_buffer)
-            logging.info(f"Uploaded {image_name} to FTP")
-        except Exception as e:
-            logging.error(f"Error uploading {image_name} to FTP: {e}")
-            
-            
-    
\ No newline at end of file
+        QMessageBox.information(self, "Success", "Connected to FTP successfully!")  # Виводимо спливаюче повідомлення
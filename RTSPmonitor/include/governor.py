@@ -0,0 +1,244 @@
+import logging
+import os
+import threading
+import time
+from configparser import ConfigParser
+
+
+MB = 1024 * 1024
+
+# Пріоритети пристроїв: high ніколи не деградує, low - першим
+PRIORITIES = ('low', 'normal', 'high')
+DEFAULT_PRIORITY = 'normal'
+
+# Рівень перевантаження -> пріоритет -> (множник інтервалу, найбільша якість JPEG)
+DEGRADATION = {
+    1: {'low': (2.0, 70)},
+    2: {'low': (4.0, 50), 'normal': (2.0, 70)},
+}
+MAX_LEVEL = max(DEGRADATION)
+
+# 0 - без обмеження
+GOVERNOR_DEFAULTS = {'upload_rate': 0, 'upload_mbit': 0, 'disk_mb': 0, 'decode_fps': 0,
+                     'check_interval': 5, 'overload': 0.8, 'recover': 0.3, 'recover_checks': 3}
+
+
+def load_governor_config(path='governor.conf'):
+    # Секція [GOVERNOR], усі поля необов'язкові
+    config = ConfigParser()
+    config.read(path)
+    settings = dict(GOVERNOR_DEFAULTS)
+    if not config.has_section('GOVERNOR'):
+        return settings
+    for name in GOVERNOR_DEFAULTS:
+        settings[name] = config.getfloat('GOVERNOR', name, fallback=settings[name])
+    settings['recover_checks'] = int(settings['recover_checks'])
+    return settings
+
+
+class TokenBucket():
+    # rate - одиниць за секунду (None або 0 - без обмеження), burst - скільки можна взяти одразу.
+    # reserve/wait беруть у борг: файл більший за burst проходить, а наступні чекають,
+    # тож середня швидкість не перевищує rate
+    def __init__(self, rate=None, burst=None):
+        self.lock = threading.Lock()
+        self.taken = 0
+        self.waited = 0.0
+        self.configure(rate, burst)
+
+    def configure(self, rate, burst=None):
+        with self.lock:
+            self.rate = float(rate) if rate else None
+            self.burst = float(burst) if burst else max(self.rate or 0.0, 1.0)
+            self.tokens = self.burst
+            self.updated = time.monotonic()
+
+    @property
+    def limited(self):
+        return self.rate is not None
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, amount=1):
+        # Без боргу: False, якщо зараз токенів недостатньо
+        with self.lock:
+            if self.rate is None:
+                return True
+            self._refill(time.monotonic())
+            if self.tokens < amount:
+                return False
+            self.tokens -= amount
+            self.taken += amount
+            return True
+
+    def reserve(self, amount=1):
+        # Повертає, скільки секунд треба зачекати перед використанням
+        with self.lock:
+            if self.rate is None:
+                return 0.0
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            self.taken += amount
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited += delay
+            return delay
+
+    def wait(self, amount=1, stop_event=None):
+        delay = self.reserve(amount)
+        if delay > 0:
+            if stop_event is not None:
+                stop_event.wait(delay)
+            else:
+                time.sleep(delay)
+        return delay
+
+    def as_dict(self):
+        with self.lock:
+            return {'rate': self.rate, 'taken': self.taken, 'waited': round(self.waited, 3)}
+
+
+class ResourceGovernor():
+    # Спільні обмеження для всіх пристроїв: відправок і байтів на FTP за секунду,
+    # байтів на диск за секунду, декодованих кадрів на пристрій.
+    # Фоновий потік оцінює завантаження (черги запису й відправки, відкинуті кадри,
+    # load average) і при перевантаженні поступово подовжує інтервал і знижує якість
+    # JPEG пристроїв з нижчим пріоритетом; on_throttle(device_id, factor, decode_fps)
+    # передає нові налаштування планувальнику
+    def __init__(self, settings=None, load=None, on_throttle=None):
+        self.settings = dict(GOVERNOR_DEFAULTS)
+        # load() -> {назва: частка 0..1}, найбільша визначає тиск
+        self.load = load
+        self.on_throttle = on_throttle
+        self.upload_files = TokenBucket()
+        self.upload_bytes = TokenBucket()
+        self.disk_bytes = TokenBucket()
+        self.devices = {}
+        self.lock = threading.Lock()
+        self.level = 0
+        self.pressure = 0.0
+        self.sources = {}
+        self.calm_checks = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.configure(settings or {})
+
+    def configure(self, settings):
+        self.settings = dict(GOVERNOR_DEFAULTS, **settings)
+        upload_bytes = self.settings['upload_mbit'] * 1000 * 1000 / 8
+        disk_bytes = self.settings['disk_mb'] * MB
+        # Запас на одну секунду, але не менше 1 МБ, щоб один знімок не чекав
+        self.upload_files.configure(self.settings['upload_rate'])
+        self.upload_bytes.configure(upload_bytes, max(upload_bytes, MB))
+        self.disk_bytes.configure(disk_bytes, max(disk_bytes, MB))
+        with self.lock:
+            device_ids = list(self.devices)
+        for device_id in device_ids:
+            self._apply(device_id)
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        if self.running:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='resource-governor', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        if not self.running:
+            return
+        self.stop_event.set()
+        self.thread.join(timeout)
+        self.thread = None
+
+    def add_device(self, device):
+        with self.lock:
+            self.devices[device.id] = device
+        self._apply(device.id)
+
+    def remove_device(self, device_id):
+        with self.lock:
+            self.devices.pop(device_id, None)
+
+    def degradation(self, device):
+        priority = getattr(device, 'priority', None) or DEFAULT_PRIORITY
+        return DEGRADATION.get(self.level, {}).get(priority, (1.0, None))
+
+    def decode_fps(self, device):
+        return getattr(device, 'decode_fps', None) or self.settings['decode_fps'] or None
+
+    def jpeg_quality(self, device):
+        _, max_quality = self.degradation(device)
+        quality = getattr(device, 'jpeg_quality', 90) or 90
+        return min(quality, max_quality) if max_quality else quality
+
+    def get_stats(self):
+        with self.lock:
+            degraded = sum(1 for device in self.devices.values() if self.degradation(device)[0] > 1.0)
+        return {
+            'level': self.level,
+            'pressure': round(self.pressure, 3),
+            'sources': dict(self.sources),
+            'degraded_devices': degraded,
+            'upload_files': self.upload_files.as_dict(),
+            'upload_bytes': self.upload_bytes.as_dict(),
+            'disk_bytes': self.disk_bytes.as_dict(),
+        }
+
+    def _run(self):
+        while not self.stop_event.wait(self.settings['check_interval']):
+            try:
+                self.check()
+            except Exception as e:
+                logging.error(f"Error in resource governor: {e}")
+
+    def check(self):
+        sources = dict(self.load()) if self.load is not None else {}
+        if hasattr(os, 'getloadavg'):
+            sources['cpu'] = os.getloadavg()[0] / (os.cpu_count() or 1)
+        self.sources = {name: round(value, 3) for name, value in sources.items()}
+        self.pressure = max(sources.values(), default=0.0)
+
+        # Гістерезис: вгору - одразу на рівень, вниз - після кількох спокійних перевірок
+        level = self.level
+        if self.pressure >= self.settings['overload']:
+            self.calm_checks = 0
+            level = min(level + 1, MAX_LEVEL)
+        elif self.pressure < self.settings['recover']:
+            self.calm_checks += 1
+            if self.calm_checks >= self.settings['recover_checks']:
+                self.calm_checks = 0
+                level = max(level - 1, 0)
+        else:
+            self.calm_checks = 0
+        if level != self.level:
+            self.set_level(level)
+        return self.level
+
+    def set_level(self, level):
+        old_level, self.level = self.level, level
+        busiest = max(self.sources, key=self.sources.get, default='none')
+        if level > old_level:
+            logging.warning(f"Overload level {level} (pressure {self.pressure:.2f}, {busiest}), "
+                            f"degrading lower priority devices")
+        else:
+            logging.info(f"Overload level {level} (pressure {self.pressure:.2f}), restoring devices")
+        with self.lock:
+            device_ids = list(self.devices)
+        for device_id in device_ids:
+            self._apply(device_id)
+
+    def _apply(self, device_id):
+        with self.lock:
+            device = self.devices.get(device_id)
+        if device is None or self.on_throttle is None:
+            return
+        factor, _ = self.degradation(device)
+        try:
+            self.on_throttle(device_id, factor, self.decode_fps(device))
+        except Exception as e:
+            logging.error(f"Error while throttling device {device.name}: {e}")
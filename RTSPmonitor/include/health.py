@@ -0,0 +1,73 @@
+import random
+import time
+
+
+# Стани потоку: connecting -> streaming -> stalled -> backoff -> connecting ... -> failed
+HEALTH_STATES = ('connecting', 'streaming', 'stalled', 'backoff', 'failed')
+
+# Таймаути FFmpeg (мілісекунди) для відкриття потоку і очікування кадру.
+# OpenCV тримає глобальний м'ютекс FFmpeg на час відкриття, тож недоступна камера
+# блокує відкриття всіх інших пристроїв процесу на весь таймаут відкриття
+OPEN_TIMEOUT = 5000
+READ_TIMEOUT = 10000
+# Повторні спроби після невдалого відкриття - з коротшим таймаутом
+RETRY_OPEN_TIMEOUT = 2000
+
+
+class StreamHealth():
+    # Лічильник невдач і затримка перепідключення для одного пристрою.
+    # Затримка подвоюється після кожної невдачі до max_delay,
+    # після max_failures невдач поспіль пристрій позначається failed,
+    # але спроби тривають з максимальною затримкою
+    def __init__(self, base_delay=1, max_delay=60, max_failures=10, stable_time=10, jitter=0.1):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_failures = max_failures
+        # Скільки секунд потік має працювати, щоб невдачі забулися
+        self.stable_time = stable_time
+        self.jitter = jitter
+        self.state = 'connecting'
+        self.streaming_since = None
+        self.failures = 0
+        self.reconnects = 0
+        self.last_error = None
+
+    def connecting(self):
+        if self.failures:
+            self.reconnects += 1
+        self.state = 'connecting'
+
+    def streaming(self):
+        if self.state != 'streaming':
+            self.streaming_since = time.monotonic()
+        self.last_error = None
+        self.state = 'streaming'
+
+    def failure(self, error, stalled=False):
+        # Повертає затримку до наступної спроби підключення.
+        # Лічильник скидається лише якщо потік стабільно працював stable_time:
+        # камера, що віддає кілька кадрів і обриває з'єднання, теж іде в backoff
+        if self.state == 'streaming' and time.monotonic() - self.streaming_since >= self.stable_time:
+            self.failures = 0
+        self.failures += 1
+        self.last_error = error
+        if stalled and self.failures == 1:
+            # Потік обірвався під час роботи - одразу пробуємо перепідключитися
+            self.state = 'stalled'
+            return 0
+        delay = min(self.base_delay * 2 ** (self.failures - 1), self.max_delay)
+        delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        self.state = 'failed' if self.failures >= self.max_failures else 'backoff'
+        return delay
+
+    def retrying(self):
+        # Наступне відкриття - повторна спроба після невдачі, а не перше підключення чи обрив
+        return self.state in ('backoff', 'failed')
+
+    def as_dict(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'reconnects': self.reconnects,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,65 @@
+import os
+import re
+import threading
+from datetime import datetime as dt
+
+
+# Розкладка файлів у save_path і на FTP: шаблон strftime для підтек, {device} - назва пристрою.
+# flat - усі файли в корені, як раніше
+LAYOUTS = {
+    'flat': '',
+    'day': '%Y/%m/%d',
+    'hour': '%Y/%m/%d/%H',
+    'device_day': '{device}/%Y/%m/%d',
+    'device_hour': '{device}/%Y/%m/%d/%H',
+}
+DEFAULT_LAYOUT = 'flat'
+
+# Назва файлу: device_YYYY-mm-dd_HH-MM-SS-mmm.jpg (старі файли - без мілісекунд)
+NAME_PATTERN = re.compile(r'^(?P<device>.+)_(?P<stamp>\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})(?:-(?P<ms>\d{3}))?(?:_\d+)?\.jpg$')
+
+
+def safe_device_name(device_name):
+    # Назва пристрою в імені файлу і теці не повинна виходити за межі save_path
+    return re.sub(r'[\\/:*?"<>|]+', '_', device_name).strip('. ') or 'device'
+
+
+def layout_dir(layout, device_name, captured_at):
+    pattern = LAYOUTS.get(layout or DEFAULT_LAYOUT, '')
+    if not pattern:
+        return ''
+    return captured_at.strftime(pattern.replace('{device}', safe_device_name(device_name).replace('%', '%%')))
+
+
+def parse_snapshot_name(file_name):
+    # Повертає (назва пристрою, час знімка) або None для чужих файлів
+    match = NAME_PATTERN.match(file_name)
+    if match is None:
+        return None
+    captured_at = dt.strptime(match.group('stamp'), '%Y-%m-%d_%H-%M-%S')
+    if match.group('ms'):
+        captured_at = captured_at.replace(microsecond=int(match.group('ms')) * 1000)
+    return match.group('device'), captured_at
+
+
+def local_path(save_path, relative_name):
+    # Відносні імена завжди з '/', як на FTP
+    return os.path.join(save_path, *relative_name.split('/'))
+
+
+class SnapshotNamer():
+    # Імена з мілісекундами; якщо два знімки пристрою потрапили в одну мілісекунду
+    # (серія, знімок руху), до другого додається лічильник _1, _2...
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last = {}  # device_id -> (мітка часу, лічильник)
+
+    def name(self, device, captured_at):
+        stamp = captured_at.strftime('%Y-%m-%d_%H-%M-%S') + f'-{captured_at.microsecond // 1000:03d}'
+        with self.lock:
+            last_stamp, counter = self.last.get(device.id, (None, 0))
+            counter = counter + 1 if stamp == last_stamp else 0
+            self.last[device.id] = (stamp, counter)
+        file_name = f"{safe_device_name(device.name)}_{stamp}{f'_{counter}' if counter else ''}.jpg"
+        subdir = layout_dir(getattr(device, 'layout', DEFAULT_LAYOUT), device.name, captured_at)
+        return f"{subdir}/{file_name}" if subdir else file_name
@@ -0,0 +1,385 @@
+import json
+import logging
+import os
+import sys
+import threading
+from bisect import bisect_left
+from collections import Counter
+from configparser import ConfigParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+# Межі кошиків гістограм у секундах
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+
+# Потоки гарячих циклів, які вибирає профайлер
+PROFILED_THREADS = ('capture-', 'snapshot-writer-', 'segment-writer-', 'upload-')
+# Вибірки, де потік стоїть в очікуванні (Condition.wait, queue.get, select)
+IDLE_FILES = ('threading.py', 'queue.py', 'selectors.py')
+
+METRICS_DEFAULTS = {'host': '127.0.0.1', 'port': 0, 'summary_interval': 60,
+                    'profile': False, 'profile_interval': 0.01}
+
+
+class Histogram():
+    # Гістограма в стилі Prometheus; as_dict - простий словник, який можна
+    # передати з процесу захоплення і скласти з іншими
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {'buckets': list(self.buckets), 'counts': list(self.counts),
+                    'sum': round(self.sum, 6), 'count': self.count}
+
+
+def load_metrics_config(path='metrics.conf'):
+    # Секція [METRICS]; port = 0 вимикає HTTP, summary_interval = 0 вимикає підсумок у лозі
+    config = ConfigParser()
+    config.read(path)
+    settings = dict(METRICS_DEFAULTS)
+    if not config.has_section('METRICS'):
+        return settings
+    settings['host'] = config.get('METRICS', 'host', fallback=settings['host'])
+    settings['port'] = config.getint('METRICS', 'port', fallback=settings['port'])
+    settings['summary_interval'] = config.getfloat('METRICS', 'summary_interval', fallback=settings['summary_interval'])
+    settings['profile'] = config.getboolean('METRICS', 'profile', fallback=settings['profile'])
+    settings['profile_interval'] = config.getfloat('METRICS', 'profile_interval', fallback=settings['profile_interval'])
+    return settings
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class PrometheusText():
+    # Формат тексту Prometheus вимагає, щоб усі вибірки метрики йшли одним блоком
+    # під одними # HELP/# TYPE, тож рядки збираються по метриках і виводяться в render
+    def __init__(self):
+        self.families = {}  # назва -> (заголовки, рядки вибірок), у порядку першого додавання
+
+    def _family(self, name, kind, help_text):
+        if name not in self.families:
+            header = [f'# HELP {name} {help_text}'] if help_text else []
+            header.append(f'# TYPE {name} {kind}')
+            self.families[name] = (header, [])
+        return self.families[name][1]
+
+    def add(self, name, value, labels=None, kind='gauge', help_text=None):
+        if value is None:
+            return
+        name = f'rtsp_{name}'
+        self._family(name, kind, help_text).append(f'{name}{self._labels(labels)} {value}')
+
+    def histogram(self, name, histogram, labels=None, help_text=None):
+        if not histogram:
+            return
+        name = f'rtsp_{name}'
+        lines = self._family(name, 'histogram', help_text)
+        labels = dict(labels or {})
+        total = 0
+        for bound, count in zip(list(histogram['buckets']) + ['+Inf'], histogram['counts']):
+            total += count
+            lines.append(f'{name}_bucket{self._labels(dict(labels, le=bound))} {total}')
+        lines.append(f'{name}_sum{self._labels(labels)} {histogram["sum"]}')
+        lines.append(f'{name}_count{self._labels(labels)} {histogram["count"]}')
+
+    def _labels(self, labels):
+        if not labels:
+            return ''
+        escaped = (f'{key}="{escape_label(value)}"' for key, value in labels.items())
+        return '{' + ','.join(escaped) + '}'
+
+    def render(self):
+        lines = []
+        for header, samples in self.families.values():
+            lines.extend(header)
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+def render_prometheus(metrics):
+    # metrics - словник CaptureEngine.get_metrics()
+    text = PrometheusText()
+    for device_id, device in sorted(metrics.get('devices', {}).items()):
+        labels = {'device_id': device_id, 'device': device.get('name', '')}
+        text.add('device_streaming', int(device.get('state') == 'streaming'), labels, help_text="1 while the stream delivers frames")
+        text.add('device_frames_grabbed_total', device.get('frames_grabbed'), labels, 'counter', "Frames demuxed")
+        text.add('device_frames_retrieved_total', device.get('frames_retrieved'), labels, 'counter',
+                 "Frames converted to images by retrieve/read (FFmpeg also decodes every grabbed frame)")
+        text.add('device_snapshots_total', device.get('snapshots'), labels, 'counter', "Snapshots dispatched")
+        text.add('device_unchanged_total', device.get('unchanged'), labels, 'counter', "Snapshots skipped as unchanged")
+        text.add('device_reconnects_total', device.get('reconnects'), labels, 'counter', "Stream reconnects")
+        text.add('device_dropped_total', device.get('dropped'), labels, 'counter',
+                 "Snapshots dropped by capture processes without a free shared memory slot")
+        text.add('device_snapshot_lag_seconds', device.get('lag'), labels, help_text="Lag of the last snapshot against its deadline")
+        text.add('device_cpu_seconds_total', device.get('cpu_time'), labels, 'counter', "CPU time of capture workers")
+        text.histogram('device_decode_seconds', device.get('decode_seconds'), labels, "Time of retrieve/read per frame")
+        text.histogram('device_lag_seconds', device.get('lag_seconds'), labels, "Snapshot lag against the scheduled interval")
+
+    writer = metrics.get('writer', {})
+    text.add('writer_queue_depth', writer.get('queue_depth'), help_text="Frames waiting for JPEG encoding")
+    text.add('writer_written_total', writer.get('written'), kind='counter')
+    text.add('writer_failed_total', writer.get('failed'), kind='counter')
+    text.add('writer_dropped_total', writer.get('dropped'), kind='counter')
+    text.histogram('writer_encode_seconds', writer.get('encode_seconds'), help_text="JPEG encode time")
+    text.histogram('writer_write_seconds', writer.get('write_seconds'), help_text="Snapshot file write time")
+
+    video = metrics.get('video', {})
+    text.add('video_queue_depth', video.get('queue_depth'), help_text="Frames waiting for video segment encoding")
+    text.add('video_open_segments', video.get('open_segments'))
+    text.add('video_frames_total', video.get('frames'), kind='counter')
+    text.add('video_segments_total', video.get('segments'), kind='counter', help_text="Closed video segments")
+    text.add('video_failed_total', video.get('failed'), kind='counter')
+    text.add('video_dropped_total', video.get('dropped'), kind='counter')
+    text.histogram('video_write_seconds', video.get('write_seconds'), help_text="Video segment frame encode and write time")
+
+    upload = metrics.get('upload', {})
+    text.add('ftp_queue_depth', upload.get('queue_depth'), help_text="Snapshots waiting for FTP upload")
+    text.add('ftp_uploaded_total', upload.get('uploaded'), kind='counter')
+    text.add('ftp_failed_total', upload.get('failed'), kind='counter')
+    text.add('ftp_dropped_total', upload.get('dropped'), kind='counter')
+    text.add('ftp_reconnects_total', upload.get('reconnects'), kind='counter')
+    text.add('ftp_bytes_sent_total', upload.get('bytes_sent'), kind='counter')
+    text.histogram('ftp_upload_seconds', upload.get('latency_seconds'), help_text="Time from queueing to stored on FTP")
+    spool = upload.get('spool', {})
+    text.add('ftp_spool_pending', spool.get('pending'), help_text="Uploads waiting in the on-disk spool")
+    text.add('ftp_spool_bytes', spool.get('bytes'))
+    text.add('ftp_spool_evicted_total', spool.get('evicted'), kind='counter',
+             help_text="Oldest uploads dropped because the spool was full")
+
+    for name, destination in metrics.get('destinations', {}).items():
+        labels = {'destination': name}
+        text.add('destination_queue_depth', destination.get('queue_depth'), labels,
+                 help_text="Uploads waiting for an additional destination")
+        text.add('destination_uploaded_total', destination.get('uploaded'), labels, 'counter')
+        text.add('destination_failed_total', destination.get('failed'), labels, 'counter')
+        text.add('destination_dropped_total', destination.get('dropped'), labels, 'counter')
+        text.add('destination_reconnects_total', destination.get('reconnects'), labels, 'counter')
+        text.add('destination_bytes_sent_total', destination.get('bytes_sent'), labels, 'counter')
+
+    retention = metrics.get('retention', {})
+    text.add('retention_deleted_files_total', retention.get('deleted_files'), kind='counter')
+    text.add('retention_deleted_bytes_total', retention.get('deleted_bytes'), kind='counter')
+
+    governor = metrics.get('governor', {})
+    text.add('governor_level', governor.get('level'), help_text="Overload level, 0 - no degradation")
+    text.add('governor_pressure', governor.get('pressure'), help_text="Highest queue fill or CPU load ratio")
+    text.add('governor_degraded_devices', governor.get('degraded_devices'))
+    for bucket in ('upload_files', 'upload_bytes', 'disk_bytes'):
+        text.add('governor_throttled_seconds_total', governor.get(bucket, {}).get('waited'), {'bucket': bucket},
+                 'counter', "Time spent waiting for rate limits")
+    return text.render()
+
+
+def summary_line(metrics):
+    devices = metrics.get('devices', {}).values()
+    streaming = sum(1 for device in devices if device.get('state') == 'streaming')
+    lags = [device.get('lag') or 0 for device in devices]
+    writer = metrics.get('writer', {})
+    upload = metrics.get('upload', {})
+    return (f"devices={len(devices)} streaming={streaming} "
+            f"snapshots={sum(device.get('snapshots', 0) for device in devices)} "
+            f"reconnects={sum(device.get('reconnects', 0) for device in devices)} "
+            f"capture_dropped={sum(device.get('dropped', 0) for device in devices)} "
+            f"lag_max={max(lags, default=0):.3f}s "
+            f"writer_queue={writer.get('queue_depth', 0)} encode_avg={writer.get('encode_avg', 0)}s "
+            f"write_avg={writer.get('write_avg', 0)}s dropped={writer.get('dropped', 0)} "
+            f"ftp_queue={upload.get('queue_depth', 0)} ftp_rate={upload.get('bytes_per_sec', 0)}B/s "
+            f"ftp_failed={upload.get('failed', 0)} "
+            f"overload_level={metrics.get('governor', {}).get('level', 0)}")
+
+
+class SamplingProfiler():
+    # Вибірковий профайлер: раз на interval знімає стеки потоків захоплення,
+    # запису і FTP через sys._current_frames. Результат - згорнуті стеки
+    # (формат flamegraph.pl / speedscope). Накладні витрати - один обхід
+    # стеків на вибірку, тому вмикається лише явно
+    def __init__(self, interval=0.01, thread_prefixes=PROFILED_THREADS, max_depth=40):
+        self.interval = interval
+        self.thread_prefixes = thread_prefixes
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        if self.running:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self.thread.start()
+        logging.info(f"Sampling profiler started, interval {self.interval} s")
+
+    def stop(self):
+        if not self.running:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def reset(self):
+        with self.lock:
+            self.stacks.clear()
+            self.samples = 0
+
+    def collapsed(self):
+        with self.lock:
+            return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+    def top(self, limit=10):
+        # Функції, що найчастіше на вершині стека (власний час), у % від вибірок роботи
+        leaves = Counter()
+        with self.lock:
+            for stack, count in self.stacks.items():
+                leaves[stack.rsplit(';', 1)[-1]] += count
+            samples = self.samples or 1
+        return [(name, round(100.0 * count / samples, 1)) for name, count in leaves.most_common(limit)]
+
+    def _run(self):
+        names = {}
+        while not self.stop_event.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            sampled = []
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, '')
+                if not name.startswith(self.thread_prefixes):
+                    continue
+                if frame.f_code.co_filename.endswith(IDLE_FILES):
+                    # Потік чекає на роботу - не гарячий цикл
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)})')
+                    frame = frame.f_back
+                # Потоки пулу групуються за типом, без номера
+                sampled.append(';'.join([name.rstrip('0123456789')] + stack[::-1]))
+            with self.lock:
+                for stack in sampled:
+                    self.stacks[stack] += 1
+                self.samples += len(sampled)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            if url.path == '/metrics':
+                self._send(render_prometheus(self.server.metrics()), 'text/plain; version=0.0.4')
+            elif url.path == '/metrics.json':
+                self._send(json.dumps(self.server.metrics(), default=str), 'application/json')
+            elif url.path == '/profile':
+                self._profile(parse_qs(url.query))
+            else:
+                self.send_error(404)
+        except Exception as e:
+            logging.error(f"Error in metrics endpoint {url.path}: {e}")
+            self.send_error(500)
+
+    def _profile(self, query):
+        profiler = self.server.profiler
+        if profiler is None:
+            self.send_error(404, "Profiler is disabled (metrics.conf: profile = yes)")
+            return
+        if query.get('reset'):
+            profiler.reset()
+        self._send(profiler.collapsed(), 'text/plain')
+
+    def _send(self, body, content_type):
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Запити Prometheus кожні 15 с не потрібні в лозі
+        pass
+
+
+class MetricsServer():
+    # HTTP на локальній адресі: /metrics (Prometheus), /metrics.json,
+    # /profile (згорнуті стеки, ?reset=1 очищає). Плюс підсумок у лог
+    # кожні summary_interval секунд
+    def __init__(self, metrics, settings=None):
+        # metrics() повертає словник CaptureEngine.get_metrics()
+        self.metrics = metrics
+        self.settings = settings or dict(METRICS_DEFAULTS)
+        self.profiler = SamplingProfiler(self.settings['profile_interval']) if self.settings['profile'] else None
+        self.server = None
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    @property
+    def running(self):
+        return bool(self.threads)
+
+    @property
+    def port(self):
+        return self.server.server_address[1] if self.server is not None else None
+
+    def start(self):
+        if self.running:
+            return
+        self.stop_event.clear()
+        if self.settings['port']:
+            try:
+                self.server = ThreadingHTTPServer((self.settings['host'], self.settings['port']), MetricsHandler)
+            except OSError as e:
+                logging.error(f"Failed to start metrics endpoint on {self.settings['host']}:{self.settings['port']}: {e}")
+            else:
+                self.server.daemon_threads = True
+                self.server.metrics = self.metrics
+                self.server.profiler = self.profiler
+                self.threads.append(threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True))
+                logging.info(f"Metrics endpoint on http://{self.settings['host']}:{self.port}/metrics")
+        if self.settings['summary_interval']:
+            self.threads.append(threading.Thread(target=self._log_summary, name='metrics-summary', daemon=True))
+        for thread in self.threads:
+            thread.start()
+        if self.profiler is not None:
+            self.profiler.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    def _log_summary(self):
+        while not self.stop_event.wait(self.settings['summary_interval']):
+            try:
+                logging.info(f"Metrics: {summary_line(self.metrics())}")
+                if self.profiler is not None:
+                    top = ', '.join(f'{name} {percent}%' for name, percent in self.profiler.top(5))
+                    logging.info(f"Profile top: {top}")
+            except Exception as e:
+                logging.error(f"Error while logging metrics summary: {e}")
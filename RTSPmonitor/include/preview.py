@@ -0,0 +1,116 @@
+from PyQt5.QtWidgets import QWidget, QGridLayout, QScrollArea, QVBoxLayout
+from PyQt5.QtGui import QImage, QPainter, QColor
+from PyQt5.QtCore import QTimer, QRect, Qt
+
+
+# Частота кадрів попереднього перегляду і кількість колонок сітки
+PREVIEW_FPS = 2
+PREVIEW_COLUMNS = 4
+
+
+class PreviewTile(QWidget):
+    def __init__(self, device):
+        super().__init__()
+        self.device_id = device.id
+        self.name = device.name
+        self.frame = None
+        self.image = None
+        self.setMinimumSize(160, 90)
+
+    def set_frame(self, frame):
+        # QImage використовує буфер NumPy без копіювання,
+        # тому масив тримаємо в self.frame, поки на нього посилається зображення
+        height, width = frame.shape[:2]
+        self.frame = frame
+        self.image = QImage(frame.data, width, height, frame.strides[0], QImage.Format_RGB888)
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(0, 0, 0))
+        if self.image is not None:
+            # Масштабування під розмір плитки зі збереженням пропорцій
+            scale = min(self.width() / self.image.width(), self.height() / self.image.height())
+            width, height = int(self.image.width() * scale), int(self.image.height() * scale)
+            target = QRect((self.width() - width) // 2, (self.height() - height) // 2, width, height)
+            painter.drawImage(target, self.image)
+        painter.setPen(QColor(255, 255, 255))
+        painter.drawText(self.rect().adjusted(4, 4, -4, -4), Qt.AlignLeft | Qt.AlignTop, self.name)
+
+
+class PreviewWindow(QWidget):
+    # Сітка попереднього перегляду. Кадри приходять лише для плиток,
+    # які зараз видно: прокручені за межі, згорнуті чи закриті відписуються
+    def __init__(self, engine, fps=PREVIEW_FPS, columns=PREVIEW_COLUMNS):
+        super().__init__()
+        self.engine = engine
+        self.fps = fps
+        self.columns = columns
+        self.tiles = {}
+        self.subscribed = set()
+
+        self.setWindowTitle("Preview")
+        self.setGeometry(150, 150, 1000, 600)
+
+        self.grid_widget = QWidget()
+        self.grid_layout = QGridLayout(self.grid_widget)
+        self.scroll_area = QScrollArea()
+        self.scroll_area.setWidgetResizable(True)
+        self.scroll_area.setWidget(self.grid_widget)
+
+        self.layout = QVBoxLayout()
+        self.layout.addWidget(self.scroll_area)
+        self.setLayout(self.layout)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+
+    def set_devices(self, devices):
+        for tile in self.tiles.values():
+            self.grid_layout.removeWidget(tile)
+            tile.deleteLater()
+        self.tiles = {}
+        for index, device in enumerate(devices):
+            tile = PreviewTile(device)
+            tile.setMinimumHeight(180)
+            self.grid_layout.addWidget(tile, index // self.columns, index % self.columns)
+            self.tiles[device.id] = tile
+        self.refresh()
+
+    def visible_devices(self):
+        if not self.isVisible() or self.isMinimized():
+            return set()
+        return {device_id for device_id, tile in self.tiles.items() if not tile.visibleRegion().isEmpty()}
+
+    def refresh(self):
+        visible = self.visible_devices()
+        for device_id in visible - self.subscribed:
+            self.engine.set_preview(device_id, self.fps)
+        for device_id in self.subscribed - visible:
+            self.engine.set_preview(device_id, None)
+        self.subscribed = visible
+
+        for device_id in visible:
+            frame = self.engine.take_preview(device_id)
+            if frame is not None:
+                self.tiles[device_id].set_frame(frame)
+
+    def unsubscribe_all(self):
+        for device_id in self.subscribed:
+            self.engine.set_preview(device_id, None)
+        self.subscribed = set()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.timer.start(int(1000 / self.fps))
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        self.unsubscribe_all()
+        super().hideEvent(event)
+
+    def changeEvent(self, event):
+        # Згорнуте вікно не отримує кадрів; відновлене підпишеться на наступному тіку
+        if self.isMinimized():
+            self.unsubscribe_all()
+        super().changeEvent(event)
@@ -0,0 +1,145 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+import cv2
+
+from include.scheduler import open_capture
+
+
+# Таймаут перевірки (секунди) і кількість одночасних перевірок (процесів)
+PROBE_TIMEOUT = 5
+PROBE_WORKERS = 8
+
+
+class ProbeResult():
+    def __init__(self, url, ok=False, error=None, codec=None, width=None, height=None, fps=None, elapsed=0.0):
+        self.url = url
+        self.ok = ok
+        self.error = error
+        self.codec = codec
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.elapsed = elapsed
+
+    @property
+    def resolution(self):
+        return f"{self.width}x{self.height}" if self.width else ''
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __str__(self):
+        if not self.ok:
+            return f"{self.error} ({self.elapsed:.1f} s)"
+        fps = f"{self.fps:.1f} fps" if self.fps else "unknown fps"
+        return f"{self.codec or 'unknown codec'} {self.resolution} {fps} ({self.elapsed:.1f} s)"
+
+
+def fourcc_name(value):
+    value = int(value or 0)
+    if not value:
+        return None
+    name = ''.join(chr((value >> shift) & 0xFF) for shift in (0, 8, 16, 24))
+    return name.strip('\x00 ') or None
+
+
+def probe_stream(device, timeout=PROBE_TIMEOUT):
+    # device - запис пристрою або SimpleNamespace(rtsp_url=..., поля профілю).
+    # Відкриття і перший кадр обмежені timeout, тож недоступна камера
+    # займає потік перевірки не довше кількох секунд
+    if isinstance(device, str):
+        device = SimpleNamespace(rtsp_url=device)
+    started = time.monotonic()
+    milliseconds = int(timeout * 1000)
+    cap = None
+    try:
+        cap = open_capture(device, milliseconds, milliseconds)
+        if not cap.isOpened():
+            return ProbeResult(device.rtsp_url, error="Failed to open stream", elapsed=time.monotonic() - started)
+        ret, frame = cap.read()
+        if not ret or frame is None:
+            return ProbeResult(device.rtsp_url, error="Stream opened but no frames received",
+                               elapsed=time.monotonic() - started)
+        height, width = frame.shape[:2]
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        return ProbeResult(device.rtsp_url, True, codec=fourcc_name(cap.get(cv2.CAP_PROP_FOURCC)),
+                           width=width, height=height, fps=fps if 0 < fps < 1000 else None,
+                           elapsed=time.monotonic() - started)
+    except Exception as e:
+        return ProbeResult(device.rtsp_url, error=str(e), elapsed=time.monotonic() - started)
+    finally:
+        if cap is not None:
+            cap.release()
+
+
+class StreamProber():
+    # Перевірка багатьох потоків одночасно поза потоком GUI.
+    # OpenCV тримає глобальний м'ютекс на час VideoCapture.open, тому в одному
+    # процесі перевірки йдуть по черзі - паралельність дають лише окремі процеси.
+    # Пул запускається з першою перевіркою і зупиняється, коли черга спорожніє.
+    # Результати складаються в чергу (ключ, ProbeResult), вікно забирає їх таймером
+    def __init__(self, max_workers=PROBE_WORKERS, timeout=PROBE_TIMEOUT, probe=probe_stream):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.probe = probe
+        self.executor = None
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = 0
+
+    def submit(self, key, device, timeout=None):
+        url = getattr(device, 'rtsp_url', device)
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            self.pending += 1
+            future = self.executor.submit(self.probe, device, timeout or self.timeout)
+        future.add_done_callback(lambda done: self._done(key, url, done))
+
+    def submit_many(self, items, timeout=None):
+        # items - пари (ключ, пристрій або URL)
+        for key, device in items:
+            self.submit(key, device, timeout)
+
+    def take_results(self):
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def busy(self):
+        return self.pending > 0
+
+    def shutdown(self):
+        # Перевірки, що вже йдуть, завершаться самі не пізніше ніж через timeout
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _done(self, key, url, future):
+        if future.cancelled():
+            result = ProbeResult(url, error="Cancelled")
+        else:
+            try:
+                result = future.result()
+            except Exception as e:
+                result = ProbeResult(url, error=str(e))
+            logging.info(f"Probe {result.url}: {result}")
+        idle_executor = None
+        with self.lock:
+            self.pending -= 1
+            if self.pending == 0:
+                # Процеси перевірки не тримають пам'ять, поки нічого перевіряти
+                idle_executor, self.executor = self.executor, None
+        self.results.put((key, result))
+        if idle_executor is not None:
+            idle_executor.shutdown(wait=False)
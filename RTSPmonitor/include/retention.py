@@ -0,0 +1,294 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from configparser import ConfigParser
+from datetime import datetime as dt, timedelta
+
+from sqlalchemy import delete, func, or_
+
+from db.database import Snapshot
+
+
+GB = 1024 ** 3
+DAY = 24 * 3600
+
+# Старі збірки SQLite обмежують кількість параметрів запиту до 999
+MAX_IDS_PER_QUERY = 400
+
+# Знімки, які не чекають відправки. Невідправлені (pending, failed) не видаляє жоден прохід -
+# ні вік, ні квоти, ні проріджування, ні вільне місце, - якщо не задано delete_pending
+# або пристрій узагалі не відправляє знімки на FTP
+DELETABLE_STATUSES = ('uploaded',)
+
+RETENTION_DEFAULTS = {'min_free_bytes': None, 'delete_pending': False, 'check_interval': 300, 'batch_size': 500,
+                      'deletes_per_second': 200}
+
+
+class RetentionPolicy():
+    # max_age і thin_after у секундах, max_bytes у байтах, None - без обмеження.
+    # Проріджування: знімки, старші за thin_after, залишаються по одному
+    # на кожні keep_every інтервалів пристрою
+    def __init__(self, max_age=None, max_bytes=None, thin_after=None, keep_every=None):
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.thin_after = thin_after
+        self.keep_every = keep_every
+
+    def merged(self, fallback):
+        # Налаштування пристрою мають пріоритет над глобальними
+        return RetentionPolicy(
+            self.max_age if self.max_age is not None else fallback.max_age,
+            self.max_bytes if self.max_bytes is not None else fallback.max_bytes,
+            self.thin_after if self.thin_after is not None else fallback.thin_after,
+            self.keep_every if self.keep_every is not None else fallback.keep_every,
+        )
+
+
+def device_policy(device):
+    def scaled(name, factor):
+        value = getattr(device, name, None)
+        return value * factor if value else None
+    keep_every = getattr(device, 'thin_keep_every', None)
+    return RetentionPolicy(scaled('retention_days', DAY), scaled('retention_gb', GB),
+                           scaled('thin_after_days', DAY), keep_every if keep_every and keep_every > 1 else None)
+
+
+def load_retention_config(path='retention.conf'):
+    # Глобальна політика для всіх пристроїв; секція [RETENTION], усі поля необов'язкові
+    config = ConfigParser()
+    config.read(path)
+    settings = dict(RETENTION_DEFAULTS, policy=RetentionPolicy())
+    if not config.has_section('RETENTION'):
+        return settings
+
+    def number(name, factor=1):
+        value = config.getfloat('RETENTION', name, fallback=None)
+        return value * factor if value else None
+
+    keep_every = config.getint('RETENTION', 'keep_every', fallback=None)
+    settings['policy'] = RetentionPolicy(number('max_age_days', DAY), number('max_gb', GB),
+                                         number('thin_after_days', DAY), keep_every)
+    # max_gb тут - загальний ліміт для всіх пристроїв разом
+    settings['min_free_bytes'] = number('min_free_gb', GB)
+    # Чи можуть вік, квоти і вільне місце видаляти знімки, які ще не відправлені
+    settings['delete_pending'] = config.getboolean('RETENTION', 'delete_pending', fallback=False)
+    settings['check_interval'] = config.getfloat('RETENTION', 'check_interval', fallback=300)
+    settings['batch_size'] = config.getint('RETENTION', 'batch_size', fallback=500)
+    settings['deletes_per_second'] = config.getfloat('RETENTION', 'deletes_per_second', fallback=200)
+    return settings
+
+
+class RetentionEngine():
+    # Фонове видалення старих знімків за таблицею snapshots, без обходу тек.
+    # Видаляє пачками по batch_size і не швидше deletes_per_second,
+    # щоб не заважати записам захоплення
+    def __init__(self, db, devices, settings=None, uploads=None):
+        # devices() повертає поточний список пристроїв (записи реєстру);
+        # uploads(device) - чи відправляються знімки пристрою на FTP, без нього вважається, що так
+        self.db = db
+        self.devices = devices
+        self.uploads = uploads
+        # Пристрої, знімки яких нікуди не відправляються: їхні pending нічого не чекають
+        self.local_devices = set()
+        self.configure(settings or dict(RETENTION_DEFAULTS, policy=RetentionPolicy()))
+        self.stop_event = threading.Event()
+        self.thread = None
+        # device_id -> (час останнього переглянутого знімка, його проміжок) для проріджування
+        self.thinned_until = {}
+        self.deleted_files = 0
+        self.deleted_bytes = 0
+
+    def configure(self, settings):
+        self.policy = settings['policy']
+        self.min_free_bytes = settings['min_free_bytes']
+        self.delete_pending = settings['delete_pending']
+        self.check_interval = settings['check_interval']
+        self.batch_size = settings['batch_size']
+        self.deletes_per_second = settings['deletes_per_second']
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        if self.running:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name='retention', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        if not self.running:
+            return
+        self.stop_event.set()
+        self.thread.join(timeout)
+        self.thread = None
+
+    def get_stats(self):
+        return {'deleted_files': self.deleted_files, 'deleted_bytes': self.deleted_bytes}
+
+    def _run(self):
+        while not self.stop_event.wait(self.check_interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error(f"Error in retention pass: {e}")
+            finally:
+                self.db.session.remove()
+
+    def run_once(self):
+        now = dt.now()
+        devices = self.devices()
+        self.local_devices = {device.id for device in devices if self.uploads is not None and not self.uploads(device)}
+        for device in devices:
+            if self.stop_event.is_set():
+                return
+            own = device_policy(device)
+            policy = own.merged(self.policy)
+            if policy.max_age is not None:
+                self._delete_older(device.id, now - timedelta(seconds=policy.max_age))
+            if policy.thin_after is not None and policy.keep_every:
+                self._thin(device, now - timedelta(seconds=policy.thin_after), policy.keep_every)
+            # Глобальний max_gb - спільний ліміт, тому на пристрій діє лише власний
+            if own.max_bytes is not None:
+                self._enforce_bytes(own.max_bytes, device.id)
+        # Глобальний ліміт і вільне місце - по всіх пристроях, від найстаріших знімків
+        if self.policy.max_bytes is not None:
+            self._enforce_bytes(self.policy.max_bytes)
+        if self.min_free_bytes is not None:
+            self._enforce_free_space()
+
+    def _deletable(self, query):
+        if self.delete_pending:
+            return query
+        if self.local_devices:
+            return query.filter(or_(Snapshot.upload_status.in_(DELETABLE_STATUSES),
+                                    Snapshot.device_id.in_(self.local_devices)))
+        return query.filter(Snapshot.upload_status.in_(DELETABLE_STATUSES))
+
+    def _rows(self, query):
+        rows = [(row.id, row.path, row.size) for row in query.limit(self.batch_size)]
+        self.db.session.rollback()
+        return rows
+
+    def _delete_older(self, device_id, cutoff):
+        while not self.stop_event.is_set():
+            rows = self._rows(self._deletable(self.db.session.query(Snapshot.id, Snapshot.path, Snapshot.size).filter(
+                Snapshot.device_id == device_id, Snapshot.captured_at < cutoff)).order_by(Snapshot.captured_at))
+            if not rows or not self._delete(rows):
+                return
+
+    def _thin(self, device, cutoff, keep_every):
+        # Залишаємо перший знімок у кожному проміжку keep_every * interval.
+        # Межі проміжків фіксовані, тому повторний прохід не проріджує вже проріджене
+        bucket = max(device.interval, 1) * keep_every
+        last_seen, last_bucket = self.thinned_until.get(device.id, (dt.min, None))
+        while not self.stop_event.is_set():
+            rows = self.db.session.query(Snapshot.id, Snapshot.path, Snapshot.size, Snapshot.captured_at,
+                                         Snapshot.upload_status).filter(
+                Snapshot.device_id == device.id, Snapshot.captured_at > last_seen,
+                Snapshot.captured_at < cutoff).order_by(Snapshot.captured_at).limit(self.batch_size).all()
+            self.db.session.rollback()
+            if not rows:
+                break
+            doomed = []
+            for row in rows:
+                current = int(row.captured_at.timestamp() // bucket)
+                # Невідправлений зайвий знімок просто лишається, проміжки від нього не зсуваються
+                if current == last_bucket and (self.delete_pending or device.id in self.local_devices
+                                               or row.upload_status in DELETABLE_STATUSES):
+                    doomed.append((row.id, row.path, row.size))
+                last_bucket = current
+            last_seen = rows[-1].captured_at
+            if doomed:
+                self._delete(doomed)
+        self.thinned_until[device.id] = (last_seen, last_bucket)
+
+    def _enforce_bytes(self, max_bytes, device_id=None):
+        query = self.db.session.query(func.coalesce(func.sum(Snapshot.size), 0)).filter(Snapshot.path.isnot(None))
+        if device_id is not None:
+            query = query.filter(Snapshot.device_id == device_id)
+        excess = query.scalar() - max_bytes
+        self.db.session.rollback()
+        while excess > 0 and not self.stop_event.is_set():
+            query = self._deletable(self.db.session.query(Snapshot.id, Snapshot.path, Snapshot.size).filter(
+                Snapshot.path.isnot(None)))
+            if device_id is not None:
+                query = query.filter(Snapshot.device_id == device_id)
+            rows = self._rows(query.order_by(Snapshot.captured_at))
+            if not rows:
+                self._warn_pending("Snapshots are over the size limit")
+                return
+            # Видаляємо рівно стільки найстаріших, скільки потрібно
+            chosen = []
+            for row in rows:
+                if excess <= 0:
+                    break
+                chosen.append(row)
+                excess -= row[2] or 0
+            if not self._delete(chosen):
+                return
+
+    def _enforce_free_space(self):
+        # Для кожного диска з теками пристроїв видаляємо найстаріші знімки з цього диска
+        paths = {device.save_path for device in self.devices() if device.save_path and os.path.isdir(device.save_path)}
+        for save_path in paths:
+            free = shutil.disk_usage(save_path).free
+            if free >= self.min_free_bytes:
+                continue
+            device_ids = [device.id for device in self.devices()
+                          if device.save_path and os.path.isdir(device.save_path)
+                          and os.stat(device.save_path).st_dev == os.stat(save_path).st_dev]
+            logging.warning(f"Free space on {save_path} is {free / GB:.1f} GB, deleting oldest snapshots")
+            need = self.min_free_bytes - free
+            while need > 0 and not self.stop_event.is_set():
+                rows = self._rows(self._deletable(self.db.session.query(Snapshot.id, Snapshot.path, Snapshot.size).filter(
+                    Snapshot.device_id.in_(device_ids), Snapshot.path.isnot(None))).order_by(Snapshot.captured_at))
+                if not rows:
+                    self._warn_pending(f"Free space on {save_path} is still low")
+                    break
+                # Враховуємо лише байти файлів, які справді вдалося видалити
+                deleted_bytes = self.deleted_bytes
+                if not self._delete(rows):
+                    break
+                need -= self.deleted_bytes - deleted_bytes
+
+    def _warn_pending(self, reason):
+        if not self.delete_pending:
+            logging.warning(f"{reason}, the remaining snapshots are waiting for upload "
+                            f"(delete_pending = yes in retention.conf deletes them)")
+
+    def _delete(self, rows):
+        # Спочатку файли (з паузами), потім рядки індексу однією транзакцією
+        pause = 1.0 / self.deletes_per_second if self.deletes_per_second else 0
+        deleted_ids = []
+        for snapshot_id, path, size in rows:
+            if self.stop_event.is_set():
+                break
+            if path:
+                try:
+                    os.remove(path)
+                    self.deleted_bytes += size or 0
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logging.error(f"Failed to delete {path}: {e}")
+                    continue
+                self.deleted_files += 1
+                if pause:
+                    time.sleep(pause)
+            deleted_ids.append(snapshot_id)
+
+        session = self.db.session
+        try:
+            for start in range(0, len(deleted_ids), MAX_IDS_PER_QUERY):
+                session.execute(delete(Snapshot).where(Snapshot.id.in_(deleted_ids[start:start + MAX_IDS_PER_QUERY])))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        if deleted_ids:
+            logging.info(f"Retention deleted {len(deleted_ids)} snapshots")
+        return len(deleted_ids)
@@ -0,0 +1,597 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from datetime import datetime as dt
+from types import SimpleNamespace
+
+import cv2
+
+from include.capture import CaptureStats, FrameGrabber
+from include.capture_profile import capture_params, ffmpeg_options, options_gate
+from include.change_detect import ChangeDetector
+from include.governor import TokenBucket
+from include.health import OPEN_TIMEOUT, READ_TIMEOUT, RETRY_OPEN_TIMEOUT, StreamHealth
+from include.timing import SnapshotClock
+
+
+# Найбільший розмір кадру попереднього перегляду (ширина, висота)
+PREVIEW_SIZE = (320, 180)
+
+
+class DeviceState():
+    # Стан пристрою, який читає GUI (тільки читання з іншого потоку)
+    def __init__(self, device_id, name):
+        self.device_id = device_id
+        self.name = name
+        self.state = 'waiting'
+        self.next_snapshot = None
+        self.last_snapshot = None
+        self.snapshots = 0
+        self.lag = 0.0
+        self.error = None
+        self.reconnects = 0
+        self.unchanged = 0
+        self.motion = 0
+
+    def as_dict(self):
+        return {
+            'device_id': self.device_id,
+            'name': self.name,
+            'state': self.state,
+            'last_snapshot': self.last_snapshot,
+            'snapshots': self.snapshots,
+            'lag': round(self.lag, 3),
+            'error': self.error,
+            'reconnects': self.reconnects,
+            'unchanged': self.unchanged,
+            'motion': self.motion,
+        }
+
+
+def open_capture(device, open_timeout=OPEN_TIMEOUT, read_timeout=READ_TIMEOUT):
+    # Без таймаутів FFmpeg зависає на недоступній камері назавжди.
+    # Транспорт, probesize/analyzeduration і потоки декодера - з профілю пристрою
+    params = capture_params(device, open_timeout, read_timeout)
+    with options_gate.use(ffmpeg_options(device)):
+        cap = cv2.VideoCapture(device.rtsp_url, cv2.CAP_FFMPEG, params)
+    buffer_size = getattr(device, 'buffer_size', None)
+    if buffer_size and cap.isOpened():
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+    return cap
+
+
+class OpenGate():
+    # VideoCapture.open з FFmpeg іде під глобальним м'ютексом, тож відкриття в процесі
+    # виконуються по черзі, скільки б не було робочих потоків. Перші підключення і обриви
+    # відкриваються без черги, а повторні спроби пристроїв з невдачами - по одній, з коротким
+    # таймаутом і лише коли справні пристрої не чекають. Повторна спроба не чекає в
+    # робочому потоці: якщо відкривати не можна, слот повертається в купу
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.opening = 0
+        self.retrying = False
+
+    def acquire(self, retry):
+        with self.condition:
+            if retry:
+                if self.opening or self.retrying:
+                    return False
+                self.retrying = True
+            else:
+                self.opening += 1
+            return True
+
+    def release(self, retry):
+        with self.condition:
+            if retry:
+                self.retrying = False
+            else:
+                self.opening -= 1
+
+
+def substream_device(device):
+    # Копія пристрою для попереднього перегляду з додаткового потоку камери
+    values = dict(vars(device))
+    values.update(name=f'{device.name} (substream)', rtsp_url=device.substream_url, downscale_width=None)
+    return SimpleNamespace(**values)
+
+
+class CaptureSlot():
+    # Одна реєстрація пристрою в планувальнику: відкритий потік + стан
+    def __init__(self, device, stats, health, capture_factory=open_capture, preview_only=False):
+        self.device = device
+        # preview_only - слот лише для кадрів попереднього перегляду з substream_url
+        self.preview_only = preview_only
+        self.health = health
+        self.capture_factory = capture_factory
+        self.stats = stats
+        self.state = DeviceState(device.id, device.name)
+        self.cap = None
+        self.grabber = None
+        self.clock = None
+        self.cancelled = False
+
+        # Детектор змін: gate пропускає незмінені знімки за розкладом,
+        # motion додає позапланові знімки при русі між інтервалами
+        method = getattr(device, 'change_detection', 'off') or 'off'
+        self.gate = method != 'off'
+        self.motion = bool(getattr(device, 'motion_snapshots', False))
+        self.detector = None
+        if self.gate or self.motion:
+            self.detector = ChangeDetector(method if self.gate else 'diff', getattr(device, 'change_threshold', None))
+        self.next_motion_check = 0.0
+        self.last_saved = 0.0
+        self.next_preview = 0.0
+        # Обмеження від ResourceGovernor: множник інтервалу і бюджет декодованих кадрів за секунду
+        self.interval_factor = 1.0
+        self.decode_fps = None
+        self.decode_budget = None
+        # Номер актуального запису в купі: старі записи після _wake ігноруються
+        self.generation = 0
+        self.queued = False
+
+    def open(self, retry=False):
+        if retry:
+            self.cap = self.capture_factory(self.device, RETRY_OPEN_TIMEOUT)
+        else:
+            self.cap = self.capture_factory(self.device)
+        if not self.cap.isOpened():
+            self.release()
+            return False
+        self.grabber = FrameGrabber(self.cap, self.device.capture_mode, self.stats,
+                                    getattr(self.device, 'downscale_width', None))
+        return True
+
+    def throttle(self, factor=1.0, decode_fps=None):
+        self.interval_factor = max(factor or 1.0, 1.0)
+        if decode_fps != self.decode_fps:
+            self.decode_fps = decode_fps
+            # Запас на серію знімків, щоб burst_count не впирався в бюджет
+            burst = max(decode_fps or 0, getattr(self.device, 'burst_count', 1) or 1)
+            self.decode_budget = TokenBucket(decode_fps, burst) if decode_fps else None
+
+    def interval(self):
+        # Інтервал з урахуванням деградації; бюджет декодування обмежує частоту знімків знизу
+        interval = self.device.interval * self.interval_factor
+        if self.decode_fps:
+            interval = max(interval, (getattr(self.device, 'burst_count', 1) or 1) / self.decode_fps)
+        return interval
+
+    def can_decode(self):
+        # Попередній перегляд і пошук руху - лише якщо бюджет не вичерпано знімками
+        return self.decode_budget is None or self.decode_budget.try_take()
+
+    def spend_decode(self):
+        # Знімок за розкладом декодується завжди, навіть у борг
+        if self.decode_budget is not None:
+            self.decode_budget.reserve()
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+        self.cap = None
+        self.grabber = None
+
+
+class CaptureScheduler():
+    def __init__(self, on_snapshot, max_workers=None, warmup=5,
+                 slice_time=1.0, poll_interval=0.2, catchup_time=0.02, retry_delay=1, max_retry_delay=60,
+                 max_failures=10, motion_check_interval=0.5, motion_cooldown=2.0, on_preview=None,
+                 preview_size=PREVIEW_SIZE, capture_factory=open_capture):
+        # on_snapshot - корутина (device, frame), виконується в циклі asyncio вводу/виводу
+        self.on_snapshot = on_snapshot
+        # on_preview(device, frame) викликається прямо з потоку захоплення зі зменшеним RGB-кадром
+        self.on_preview = on_preview
+        self.preview_size = preview_size
+        self.previews = {}  # device_id -> інтервал між кадрами попереднього перегляду
+        self.throttles = {}  # device_id -> (множник інтервалу, кадрів декодування за секунду)
+        # capture_factory(device) відкриває джерело; бенчмарк підставляє синтетичне
+        self.capture_factory = capture_factory
+        self.max_workers = max_workers or min(64, (os.cpu_count() or 1) * 4)
+        # Потік тримається відкритим між знімками. Лише пристрої з reconnect_per_snapshot
+        # відключаються і підключаються заново за warmup секунд до наступного знімка.
+        # OpenCV відкриває потоки в процесі по черзі, тож warmup - не гарантія:
+        # відкриття може чекати на інші пристрої
+        self.warmup = warmup
+        self.slice_time = slice_time
+        self.poll_interval = poll_interval
+        self.catchup_time = catchup_time
+        # Перепідключення з експоненційною затримкою від retry_delay до max_retry_delay
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_failures = max_failures
+        self.open_gate = OpenGate()
+        # Як часто декодувати кадр для пошуку руху і мінімальна пауза між знімками руху
+        self.motion_check_interval = motion_check_interval
+        self.motion_cooldown = motion_cooldown
+
+        self.heap = []  # (час обслуговування, порядковий номер, покоління, slot)
+        self.counter = itertools.count()
+        self.slots = {}
+        self.stats = {}
+        # device_id -> слот попереднього перегляду для пристроїв із substream_url
+        self.preview_slots = {}
+        self.condition = threading.Condition()
+        self.workers = []
+        self.running = False
+
+        self.loop = None
+        self.loop_thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self._run_loop, name='capture-io', daemon=True)
+        self.loop_thread.start()
+
+        for index in range(self.max_workers):
+            worker = threading.Thread(target=self._worker, name=f'capture-{index}', daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        logging.info(f"Capture scheduler started with {self.max_workers} workers")
+
+    def stop(self):
+        if not self.running:
+            return
+        with self.condition:
+            self.running = False
+            for slot in list(self.slots.values()) + list(self.preview_slots.values()):
+                slot.cancelled = True
+            pending = [slot for _, _, _, slot in self.heap]
+            self.slots.clear()
+            self.preview_slots.clear()
+            self.heap.clear()
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        for slot in pending:
+            slot.release()
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+        self.loop = None
+        logging.info("Capture scheduler stopped")
+
+    def add_device(self, device):
+        with self.condition:
+            old_slot = self.slots.get(device.id)
+            if old_slot is not None:
+                old_slot.cancelled = True
+            stats = self.stats.setdefault(device.id, CaptureStats())
+            health = StreamHealth(self.retry_delay, self.max_retry_delay, self.max_failures)
+            slot = CaptureSlot(device, stats, health, self.capture_factory)
+            slot.throttle(*self.throttles.get(device.id, (1.0, None)))
+            self.slots[device.id] = slot
+            self._push(slot, time.monotonic())
+            # Змінений пристрій міг отримати чи втратити substream_url
+            self._set_substream(device, device.id in self.previews)
+        logging.info(f"Device {device.name} added to capture scheduler")
+
+    def remove_device(self, device_id):
+        with self.condition:
+            slot = self.slots.pop(device_id, None)
+            if slot is None:
+                return
+            slot.cancelled = True
+            slot.state.state = 'stopped'
+            self.throttles.pop(device_id, None)
+            self._set_substream(slot.device, False)
+            self.condition.notify_all()
+        logging.info(f"Device {slot.device.name} removed from capture scheduler")
+
+    def has_devices(self):
+        return bool(self.slots)
+
+    def set_preview(self, device_id, fps=None):
+        # fps None або 0 вимикає попередній перегляд пристрою
+        with self.condition:
+            if fps:
+                self.previews[device_id] = 1.0 / fps
+            else:
+                self.previews.pop(device_id, None)
+            slot = self.slots.get(device_id)
+            if slot is not None and getattr(slot.device, 'substream_url', None):
+                # Основний потік не чіпаємо, кадри дає окремий слот
+                self._set_substream(slot.device, bool(fps))
+                return
+            if not fps:
+                return
+            if slot is not None and slot.queued and slot.state.state == 'idle':
+                # Пристрій з reconnect_per_snapshot чекає відключеним - будимо його зараз
+                self._push(slot, time.monotonic())
+
+    def set_throttle(self, device_id, factor=1.0, decode_fps=None):
+        # Діє з наступного зрізу: інтервал змінюється без перепідключення до камери
+        with self.condition:
+            self.throttles[device_id] = (factor, decode_fps)
+            slot = self.slots.get(device_id)
+            if slot is not None:
+                slot.throttle(factor, decode_fps)
+
+    def _set_substream(self, device, enabled):
+        # Викликається під self.condition
+        old_slot = self.preview_slots.pop(device.id, None)
+        if old_slot is not None:
+            old_slot.cancelled = True
+        if enabled and getattr(device, 'substream_url', None):
+            health = StreamHealth(self.retry_delay, self.max_retry_delay, self.max_failures)
+            slot = CaptureSlot(substream_device(device), CaptureStats(), health, self.capture_factory, preview_only=True)
+            self.preview_slots[device.id] = slot
+            self._push(slot, time.monotonic())
+            self.condition.notify_all()
+
+    def get_states(self):
+        with self.condition:
+            return {device_id: slot.state for device_id, slot in self.slots.items()}
+
+    def get_stats(self):
+        # Лічильники кадрів і гістограми пристроїв у вигляді словників, як і в ShardCoordinator
+        with self.condition:
+            device_ids = list(self.slots)
+        return {device_id: self.stats[device_id].as_dict() for device_id in device_ids if device_id in self.stats}
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _push(self, slot, due):
+        # Викликається під self.condition
+        slot.generation += 1
+        slot.queued = True
+        heapq.heappush(self.heap, (due, next(self.counter), slot.generation, slot))
+        self.condition.notify()
+
+    def _next_slot(self):
+        with self.condition:
+            while self.running:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                due, _, generation, slot = self.heap[0]
+                if generation != slot.generation:
+                    heapq.heappop(self.heap)
+                    continue
+                if slot.cancelled:
+                    heapq.heappop(self.heap)
+                    slot.release()
+                    continue
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                heapq.heappop(self.heap)
+                slot.queued = False
+                return slot
+            return None
+
+    def _worker(self):
+        while True:
+            slot = self._next_slot()
+            if slot is None:
+                return
+            slot.stats.begin()
+            try:
+                due = self._run_slice(slot)
+            except Exception as e:
+                due = self._capture_failed(slot, str(e), stalled=slot.cap is not None)
+            slot.stats.sample_cpu()
+
+            with self.condition:
+                if slot.cancelled or not self.running:
+                    slot.release()
+                    logging.info(f"Capture stats for {slot.device.name}: {slot.stats}")
+                    continue
+                self._push(slot, due)
+
+    def _run_slice(self, slot):
+        if slot.preview_only:
+            return self._run_preview_slice(slot)
+        device = slot.device
+        # Пристрій із substream_url отримує попередній перегляд з окремого слота
+        preview = None if getattr(device, 'substream_url', None) else self.previews.get(device.id)
+        interval = slot.interval()
+        keep_open = not getattr(device, 'reconnect_per_snapshot', False) or slot.motion or preview is not None
+        now = time.monotonic()
+        if slot.clock is None:
+            slot.clock = SnapshotClock(device.interval, getattr(device, 'align_snapshots', False),
+                                       getattr(device, 'burst_count', 1), getattr(device, 'burst_spacing', 0.0), now)
+            slot.state.next_snapshot = slot.clock.next_deadline
+            if not keep_open:
+                slot.state.state = 'idle'
+                return slot.clock.next_deadline - self.warmup
+        clock = slot.clock
+        # Новий інтервал (деградація чи її зняття) діє з наступного знімка, сітка лишається базовою
+        clock.set_step(interval)
+        if not keep_open and slot.cap is not None and not clock.in_burst() and clock.next_deadline - now > self.warmup:
+            # Попередній перегляд вимкнули - відключаємося до наступного знімка
+            slot.release()
+            slot.state.state = 'idle'
+            return clock.next_deadline - self.warmup
+
+        if slot.cap is None:
+            opened = self._open(slot)
+            if opened is None:
+                return time.monotonic() + self.poll_interval
+            if not opened:
+                return self._capture_failed(slot, 'open failed')
+
+        slice_end = now + self.slice_time
+        while not slot.cancelled:
+            now = time.monotonic()
+            if clock.is_due(now):
+                slot.spend_decode()
+                ret, frame = slot.grabber.snapshot()
+                if not ret:
+                    return self._capture_failed(slot, 'read failed', stalled=True)
+                self._streaming(slot)
+                if clock.in_burst() or self._changed(slot, frame):
+                    slot.state.lag = clock.lag(now)
+                    slot.stats.lag.observe(slot.state.lag)
+                    self._dispatch(slot, frame)
+                    slot.state.next_snapshot = clock.advance(time.monotonic())
+                else:
+                    slot.state.unchanged += 1
+                    slot.state.next_snapshot = clock.skip(time.monotonic())
+                if not keep_open and not clock.in_burst():
+                    slot.release()
+                    slot.state.state = 'idle'
+                    return clock.next_deadline - self.warmup
+                continue
+
+            if now >= slice_end:
+                return now
+
+            if preview is not None and now >= slot.next_preview:
+                slot.next_preview = now + preview
+                if not slot.can_decode():
+                    continue
+                ret, frame = slot.grabber.snapshot()
+                if not ret:
+                    return self._capture_failed(slot, 'read failed', stalled=True)
+                self._streaming(slot)
+                self._preview(slot, frame)
+                preview = self.previews.get(device.id)
+                continue
+
+            if slot.motion and now >= slot.next_motion_check:
+                slot.next_motion_check = now + self.motion_check_interval
+                if not slot.can_decode():
+                    continue
+                ret, frame = slot.grabber.snapshot()
+                if not ret:
+                    return self._capture_failed(slot, 'read failed', stalled=True)
+                self._streaming(slot)
+                if now - slot.last_saved >= self.motion_cooldown:
+                    changed, signature = slot.detector.check(frame)
+                    if changed:
+                        slot.detector.accept(signature)
+                        slot.state.motion += 1
+                        self._dispatch(slot, frame)
+                continue
+
+            ret = slot.grabber.skip()
+            if not ret:
+                return self._capture_failed(slot, 'read failed', stalled=True)
+            self._streaming(slot)
+            # grab() довго чекав на кадр - буфер вичерпано, звільняємо потік
+            if time.monotonic() - now >= self.catchup_time:
+                wake = min(clock.next_deadline, time.monotonic() + self.poll_interval)
+                if preview is not None:
+                    wake = min(wake, slot.next_preview)
+                return wake
+        return time.monotonic()
+
+    def _run_preview_slice(self, slot):
+        # Лише попередній перегляд: зменшені кадри з додаткового потоку камери
+        interval = self.previews.get(slot.device.id)
+        if interval is None:
+            return time.monotonic() + self.poll_interval
+        if slot.cap is None:
+            opened = self._open(slot)
+            if opened is None:
+                return time.monotonic() + self.poll_interval
+            if not opened:
+                return self._capture_failed(slot, 'open failed')
+
+        slice_end = time.monotonic() + self.slice_time
+        while not slot.cancelled:
+            now = time.monotonic()
+            if now >= slot.next_preview:
+                slot.next_preview = now + interval
+                ret, frame = slot.grabber.snapshot()
+                if not ret:
+                    return self._capture_failed(slot, 'read failed', stalled=True)
+                self._streaming(slot)
+                self._preview(slot, frame)
+                continue
+            if now >= slice_end:
+                return now
+            if not slot.grabber.skip():
+                return self._capture_failed(slot, 'read failed', stalled=True)
+            self._streaming(slot)
+            if time.monotonic() - now >= self.catchup_time:
+                return min(slot.next_preview, time.monotonic() + self.poll_interval)
+        return time.monotonic()
+
+    def _open(self, slot):
+        # None - відкриття відкладено, бо справні пристрої чекають на свою чергу
+        retry = slot.health.retrying()
+        if not self.open_gate.acquire(retry):
+            return None
+        try:
+            slot.health.connecting()
+            slot.state.state = slot.health.state
+            slot.state.reconnects = slot.health.reconnects
+            return slot.open(retry)
+        finally:
+            self.open_gate.release(retry)
+
+    def _streaming(self, slot):
+        if slot.health.state != 'streaming':
+            if slot.health.failures:
+                logging.info(f"Stream reconnected - {slot.device.name}")
+            slot.health.streaming()
+            slot.state.state = 'streaming'
+            slot.state.error = None
+
+    def _capture_failed(self, slot, error, stalled=False):
+        slot.release()
+        delay = slot.health.failure(error, stalled)
+        slot.state.state = slot.health.state
+        slot.state.error = error
+        if slot.health.state == 'stalled':
+            logging.warning(f"Stream stalled ({error}) - {slot.device.name}, reconnecting")
+        elif slot.health.failures == self.max_failures:
+            logging.error(f"Stream failed {slot.health.failures} times ({error}) - {slot.device.name}, "
+                          f"{slot.device.rtsp_url}, retrying every {self.max_retry_delay} s")
+        elif slot.health.failures < self.max_failures:
+            logging.error(f"Failed to capture from {slot.device.name}, {slot.device.rtsp_url} ({error}), "
+                          f"retry in {delay:.1f} s")
+        return time.monotonic() + delay
+
+    def _preview(self, slot, frame):
+        # Зменшення і BGR->RGB у потоці захоплення: у потік Qt іде кадр,
+        # який QImage може використати без копіювання
+        if self.on_preview is None:
+            return
+        height, width = frame.shape[:2]
+        scale = min(self.preview_size[0] / width, self.preview_size[1] / height, 1.0)
+        size = (max(int(width * scale), 1), max(int(height * scale), 1))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        try:
+            self.on_preview(slot.device, cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        except Exception as e:
+            logging.error(f"Error in preview for device {slot.device.name}: {e}")
+
+    def _changed(self, slot, frame):
+        # Мініатюра рахується в потоці захоплення - це частки мілісекунди
+        if slot.detector is None:
+            return True
+        changed, signature = slot.detector.check(frame)
+        if changed or not slot.gate:
+            slot.detector.accept(signature)
+            return True
+        return False
+
+    def _dispatch(self, slot, frame):
+        slot.last_saved = time.monotonic()
+        slot.state.last_snapshot = dt.now()
+        slot.state.snapshots += 1
+        future = asyncio.run_coroutine_threadsafe(self.on_snapshot(slot.device, frame), self.loop)
+        future.add_done_callback(lambda f, name=slot.device.name: self._snapshot_done(f, name))
+
+    def _snapshot_done(self, future, device_name):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            logging.error(f"Error while saving frame for device {device_name}: {error}")
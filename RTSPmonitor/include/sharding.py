@@ -0,0 +1,438 @@
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from multiprocessing import shared_memory
+from types import SimpleNamespace
+
+import numpy as np
+
+from include.scheduler import CaptureScheduler, DeviceState
+
+
+# Розмір одного слота спільної пам'яті - кадр 1920x1080 BGR.
+# Більші кадри (4 Мп, 4K) передаються звичайною чергою з pickle
+DEFAULT_SLOT_BYTES = 1920 * 1080 * 3
+# Попередження про такі кадри не частіше, ніж раз на стільки секунд на пристрій
+OVERSIZED_LOG_INTERVAL = 600
+# Попередження про знімки, відкинуті через брак вільних слотів, - не частіше, ніж раз на хвилину на пристрій
+DROPPED_LOG_INTERVAL = 60
+# Скільки секунд чекати, поки процеси захоплення завершаться самі
+SHARD_STOP_TIMEOUT = 10
+
+
+def device_spec(device):
+    # Простий словник замість ORM-об'єкта, щоб передати пристрій у процес
+    if hasattr(device, '__table__'):
+        return {column.name: getattr(device, column.name) for column in device.__table__.columns}
+    return dict(vars(device))
+
+
+def shard_main(shard_id, memory_name, slots, slot_bytes, commands, events, free_slots, max_workers):
+    handler = RotatingFileHandler(f'log/RTSPMonitor_shard{shard_id}.txt', maxBytes=20 * 1024 * 1024, backupCount=2)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[handler])
+
+    # Дочірні процеси multiprocessing ділять resource_tracker з координатором,
+    # тому сегмент видаляє лише координатор у Shard.close
+    memory = shared_memory.SharedMemory(name=memory_name)
+    ring = np.ndarray((slots, slot_bytes), dtype=np.uint8, buffer=memory.buf)
+    dropped = {}
+    oversized_logged = {}
+
+    async def on_snapshot(device, frame):
+        if frame.nbytes > slot_bytes:
+            # Кадр не вміщається в слот - копія через чергу повільніша, але знімок не губиться
+            now = time.monotonic()
+            if now - oversized_logged.get(device.id, -OVERSIZED_LOG_INTERVAL) >= OVERSIZED_LOG_INTERVAL:
+                oversized_logged[device.id] = now
+                logging.warning(f"Frame from {device.name} ({frame.nbytes} bytes) does not fit shared memory slot "
+                                f"({slot_bytes} bytes), sending it through the event queue")
+            events.put(('frame_data', shard_id, device.id, frame))
+            return
+        try:
+            slot = free_slots.get_nowait()
+        except queue.Empty:
+            # Координатор не встигає забирати кадри
+            dropped[device.id] = dropped.get(device.id, 0) + 1
+            return
+        ring[slot, :frame.nbytes] = frame.reshape(-1)
+        events.put(('frame', shard_id, device.id, slot, frame.shape, frame.dtype.str))
+
+    def on_preview(device, frame):
+        # Кадр попереднього перегляду малий, тому передається звичайною чергою
+        events.put(('preview', shard_id, device.id, frame))
+
+    scheduler = CaptureScheduler(on_snapshot, max_workers=max_workers, on_preview=on_preview)
+    scheduler.start()
+    try:
+        while True:
+            try:
+                command = commands.get(timeout=1)
+            except queue.Empty:
+                states = {device_id: state.as_dict() for device_id, state in scheduler.get_states().items()}
+                events.put(('state', shard_id, states, dict(dropped), scheduler.get_stats()))
+                continue
+            if command[0] == 'add':
+                scheduler.add_device(SimpleNamespace(**command[1]))
+            elif command[0] == 'remove':
+                scheduler.remove_device(command[1])
+            elif command[0] == 'preview':
+                scheduler.set_preview(command[1], command[2])
+            elif command[0] == 'throttle':
+                scheduler.set_throttle(command[1], command[2], command[3])
+            elif command[0] == 'stop':
+                break
+    finally:
+        scheduler.stop()
+        del ring
+        memory.close()
+
+
+class Shard():
+    def __init__(self, context, shard_id, slots, slot_bytes, events, max_workers):
+        self.shard_id = shard_id
+        self.memory = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self.ring = np.ndarray((slots, slot_bytes), dtype=np.uint8, buffer=self.memory.buf)
+        self.commands = context.Queue()
+        self.free_slots = context.Queue()
+        for slot in range(slots):
+            self.free_slots.put(slot)
+        self.device_ids = set()
+        self.started = time.monotonic()
+        self.process = context.Process(
+            target=shard_main, name=f'capture-shard-{shard_id}', daemon=True,
+            args=(shard_id, self.memory.name, slots, slot_bytes, self.commands, events, self.free_slots, max_workers))
+
+    def close(self):
+        del self.ring
+        self.memory.close()
+        try:
+            self.memory.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class ShardCoordinator():
+    # Той самий інтерфейс, що й CaptureScheduler, але пристрої розподілені
+    # між процесами, а кадри повертаються через shared_memory без pickle
+    def __init__(self, on_snapshot, processes=None, slots=4, slot_bytes=DEFAULT_SLOT_BYTES, workers_per_shard=None,
+                 min_uptime=10, max_respawn_delay=60, on_preview=None):
+        self.on_snapshot = on_snapshot
+        self.on_preview = on_preview
+        self.previews = {}
+        self.throttles = {}
+        self.processes = processes or os.cpu_count() or 1
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.workers_per_shard = workers_per_shard
+        # Процес, що падає одразу після старту, перезапускається з наростаючою затримкою
+        self.min_uptime = min_uptime
+        self.max_respawn_delay = max_respawn_delay
+        self.respawn_delay = 1
+        self.respawns = []
+        self.unassigned = set()
+
+        self.context = multiprocessing.get_context('spawn')
+        self.events = None
+        self.shards = {}
+        self.shard_ids = itertools.count()
+        self.devices = {}
+        self.states = {}
+        # device_id -> знімки, відкинуті процесами захоплення (вільних слотів немає), за весь час роботи.
+        # Процеси надсилають власні лічильники з моменту старту, тож тут накопичується різниця
+        self.dropped = {}
+        self.shard_dropped = {}  # shard_id -> останні лічильники процесу
+        self.dropped_logged = {}  # device_id -> (час попередження, лічильник на той момент)
+        # device_id -> CaptureStats.as_dict() з процесу захоплення
+        self.stats = {}
+        self.lock = threading.RLock()
+        self.running = False
+        self.threads = []
+
+        self.loop = None
+        self.loop_thread = None
+        # Знімки, передані в цикл подій, але ще не збережені
+        self.saving = set()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.events = self.context.Queue()
+
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self._run_loop, name='capture-io', daemon=True)
+        self.loop_thread.start()
+
+        with self.lock:
+            for _ in range(self.processes):
+                self._spawn_shard()
+        for target, name in ((self._read_events, 'shard-events'), (self._watch_shards, 'shard-watchdog')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logging.info(f"Capture sharding started with {self.processes} processes")
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        with self.lock:
+            shards = list(self.shards.values())
+            for shard in shards:
+                shard.commands.put(('stop',))
+        # Процес не завершиться, поки його кадри й стани не вичитані з черги подій,
+        # тому черга вичерпується, доки всі процеси не вийдуть, і лише потім зупиняються потоки
+        deadline = time.monotonic() + SHARD_STOP_TIMEOUT
+        while any(shard.process.is_alive() for shard in shards) and time.monotonic() < deadline:
+            try:
+                self._drain_event(self.events.get(timeout=0.2))
+            except queue.Empty:
+                pass
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        while True:
+            try:
+                self._drain_event(self.events.get_nowait())
+            except queue.Empty:
+                break
+        with self.lock:
+            for shard in shards:
+                if shard.process.is_alive():
+                    logging.warning(f"Capture shard {shard.shard_id} did not stop in time, terminating it")
+                    shard.process.terminate()
+                shard.process.join(1)
+                shard.close()
+            self.shards.clear()
+            self.shard_dropped.clear()
+            self.devices.clear()
+            self.states.clear()
+            self.unassigned.clear()
+            self.respawns = []
+
+        # Останні вичитані знімки зберігаються до зупинки циклу подій
+        if self.saving:
+            concurrent.futures.wait(list(self.saving), SHARD_STOP_TIMEOUT)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.loop.close()
+        self.loop = None
+        logging.info("Capture sharding stopped")
+
+    def add_device(self, device):
+        with self.lock:
+            self.remove_device(device.id)
+            self.devices[device.id] = device
+            self._assign(device)
+
+    def remove_device(self, device_id):
+        with self.lock:
+            self.devices.pop(device_id, None)
+            self.states.pop(device_id, None)
+            self.throttles.pop(device_id, None)
+            self.unassigned.discard(device_id)
+            for shard in self.shards.values():
+                if device_id in shard.device_ids:
+                    shard.device_ids.discard(device_id)
+                    shard.commands.put(('remove', device_id))
+
+    def has_devices(self):
+        return bool(self.devices)
+
+    def get_states(self):
+        with self.lock:
+            return dict(self.states)
+
+    def get_stats(self):
+        # Останні лічильники, що надіслали процеси захоплення (раз на секунду),
+        # і відкинуті знімки - для метрик і ознаки перевантаження в ResourceGovernor
+        with self.lock:
+            stats = {}
+            for device_id in self.devices:
+                values = dict(self.stats.get(device_id, {}))
+                if device_id in self.dropped:
+                    values['dropped'] = self.dropped[device_id]
+                if values:
+                    stats[device_id] = values
+            return stats
+
+    def set_preview(self, device_id, fps=None):
+        with self.lock:
+            if fps:
+                self.previews[device_id] = fps
+            else:
+                self.previews.pop(device_id, None)
+            for shard in self.shards.values():
+                if device_id in shard.device_ids:
+                    shard.commands.put(('preview', device_id, fps))
+
+    def set_throttle(self, device_id, factor=1.0, decode_fps=None):
+        with self.lock:
+            self.throttles[device_id] = (factor, decode_fps)
+            for shard in self.shards.values():
+                if device_id in shard.device_ids:
+                    shard.commands.put(('throttle', device_id, factor, decode_fps))
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _spawn_shard(self):
+        shard = Shard(self.context, next(self.shard_ids), self.slots, self.slot_bytes, self.events, self.workers_per_shard)
+        shard.process.start()
+        self.shards[shard.shard_id] = shard
+        return shard
+
+    def _assign(self, device):
+        self.states[device.id] = DeviceState(device.id, device.name)
+        if not self.shards:
+            self.unassigned.add(device.id)
+            return
+        # Новий пристрій отримує найменш завантажений процес
+        shard = min(self.shards.values(), key=lambda item: len(item.device_ids))
+        shard.device_ids.add(device.id)
+        shard.commands.put(('add', device_spec(device)))
+        if device.id in self.previews:
+            shard.commands.put(('preview', device.id, self.previews[device.id]))
+        if device.id in self.throttles:
+            shard.commands.put(('throttle', device.id, *self.throttles[device.id]))
+
+    def _read_events(self):
+        while self.running:
+            try:
+                event = self.events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self._handle_event(event)
+
+    def _drain_event(self, event):
+        # Під час зупинки знімки ще зберігаються, а попередній перегляд уже нікому не потрібен
+        if event[0] != 'preview':
+            self._handle_event(event)
+
+    def _handle_event(self, event):
+        if event[0] == 'frame':
+            self._handle_frame(*event[1:])
+        elif event[0] == 'frame_data':
+            self._handle_frame_data(*event[1:])
+        elif event[0] == 'state':
+            self._handle_state(*event[1:])
+        elif event[0] == 'preview':
+            self._handle_preview(*event[1:])
+
+    def _handle_frame(self, shard_id, device_id, slot, shape, dtype):
+        with self.lock:
+            shard = self.shards.get(shard_id)
+            device = self.devices.get(device_id)
+            if shard is None:
+                return
+            dtype = np.dtype(dtype)
+            nbytes = int(np.prod(shape)) * dtype.itemsize
+            # Одне копіювання зі спільної пам'яті, після чого слот повертається процесу
+            frame = shard.ring[slot, :nbytes].view(dtype).reshape(shape).copy()
+            shard.free_slots.put(slot)
+        self._dispatch(device, frame)
+
+    def _handle_frame_data(self, shard_id, device_id, frame):
+        with self.lock:
+            if shard_id not in self.shards:
+                return
+            device = self.devices.get(device_id)
+        self._dispatch(device, frame)
+
+    def _dispatch(self, device, frame):
+        if device is not None:
+            future = asyncio.run_coroutine_threadsafe(self.on_snapshot(device, frame), self.loop)
+            self.saving.add(future)
+            future.add_done_callback(lambda f, name=device.name: self._snapshot_done(f, name))
+
+    def _handle_preview(self, shard_id, device_id, frame):
+        device = self.devices.get(device_id)
+        if device is not None and device_id in self.previews and self.on_preview is not None:
+            self.on_preview(device, frame)
+
+    def _handle_state(self, shard_id, states, dropped, stats):
+        with self.lock:
+            shard = self.shards.get(shard_id)
+            if shard is None:
+                return
+            for device_id, values in states.items():
+                if device_id not in shard.device_ids:
+                    continue
+                state = self.states.setdefault(device_id, DeviceState(device_id, values['name']))
+                for key, value in values.items():
+                    setattr(state, key, value)
+                if device_id in stats:
+                    self.stats[device_id] = stats[device_id]
+            self._count_dropped(shard_id, dropped)
+
+    def _count_dropped(self, shard_id, dropped):
+        last = self.shard_dropped.setdefault(shard_id, {})
+        now = time.monotonic()
+        for device_id, count in dropped.items():
+            grown = count - last.get(device_id, 0)
+            last[device_id] = count
+            if grown <= 0:
+                continue
+            total = self.dropped[device_id] = self.dropped.get(device_id, 0) + grown
+            logged_at, logged_total = self.dropped_logged.get(device_id, (-DROPPED_LOG_INTERVAL, 0))
+            if now - logged_at >= DROPPED_LOG_INTERVAL:
+                self.dropped_logged[device_id] = (now, total)
+                device = self.devices.get(device_id)
+                logging.warning(f"Capture shard {shard_id} dropped {total - logged_total} snapshots of "
+                                f"{device.name if device is not None else device_id}: no free shared memory slot "
+                                f"({total} in total)")
+
+    def _watch_shards(self):
+        while self.running:
+            time.sleep(1)
+            with self.lock:
+                if not self.running:
+                    return
+                dead = [shard for shard in self.shards.values() if not shard.process.is_alive()]
+                for shard in dead:
+                    self._rebalance(shard)
+
+                now = time.monotonic()
+                due = [respawn_at for respawn_at in self.respawns if respawn_at <= now]
+                for respawn_at in due:
+                    self.respawns.remove(respawn_at)
+                    self._spawn_shard()
+                if due:
+                    for device_id in sorted(self.unassigned):
+                        self._assign(self.devices[device_id])
+                        self.unassigned.discard(device_id)
+
+    def _rebalance(self, shard):
+        logging.error(f"Capture shard {shard.shard_id} died (exit code {shard.process.exitcode}), "
+                      f"moving {len(shard.device_ids)} devices")
+        del self.shards[shard.shard_id]
+        self.shard_dropped.pop(shard.shard_id, None)
+        shard.close()
+
+        if time.monotonic() - shard.started < self.min_uptime:
+            self.respawn_delay = min(self.respawn_delay * 2, self.max_respawn_delay)
+        else:
+            self.respawn_delay = 1
+        self.respawns.append(time.monotonic() + self.respawn_delay)
+
+        # Пристрої переходять на процеси, що залишилися
+        for device_id in sorted(shard.device_ids):
+            device = self.devices.get(device_id)
+            if device is not None:
+                self._assign(device)
+
+    def _snapshot_done(self, future, device_name):
+        self.saving.discard(future)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            logging.error(f"Error while saving frame for device {device_name}: {error}")
@@ -0,0 +1,283 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from configparser import ConfigParser
+
+
+MB = 1024 * 1024
+
+SPOOL_DEFAULTS = {'enabled': True, 'path': 'spool', 'max_mb': 2048, 'max_files': 100000, 'fsync': True,
+                  'compact_records': 10000}
+
+JOURNAL_NAME = 'journal.log'
+CHECKPOINT_NAME = 'pending.json'
+DATA_DIR = 'data'
+# Попередження про переповнення не частіше, ніж раз на стільки секунд
+EVICT_LOG_INTERVAL = 60
+
+
+def load_spool_config(path='spool.conf'):
+    # Секція [SPOOL], усі поля необов'язкові; enabled = no повертає стару чергу в пам'яті
+    config = ConfigParser()
+    config.read(path)
+    settings = dict(SPOOL_DEFAULTS)
+    if not config.has_section('SPOOL'):
+        return settings
+    settings['enabled'] = config.getboolean('SPOOL', 'enabled', fallback=settings['enabled'])
+    settings['path'] = config.get('SPOOL', 'path', fallback=settings['path'])
+    settings['max_mb'] = config.getfloat('SPOOL', 'max_mb', fallback=settings['max_mb'])
+    settings['max_files'] = config.getint('SPOOL', 'max_files', fallback=settings['max_files'])
+    settings['fsync'] = config.getboolean('SPOOL', 'fsync', fallback=settings['fsync'])
+    settings['compact_records'] = config.getint('SPOOL', 'compact_records', fallback=settings['compact_records'])
+    return settings
+
+
+class SpoolEntry():
+    def __init__(self, seq, remote_name, path, key, size, blob=False):
+        self.seq = seq
+        self.remote_name = remote_name
+        # Файл знімка на диску або копія кадру з пам'яті в теці data (blob)
+        self.path = path
+        # Ключ обліку відправлених (локальний шлях або ім'я знімка з пам'яті)
+        self.key = key
+        self.size = size
+        self.blob = blob
+
+    def as_dict(self):
+        return {'seq': self.seq, 'name': self.remote_name, 'path': self.path, 'key': self.key, 'size': self.size,
+                'blob': self.blob}
+
+    @classmethod
+    def from_dict(cls, record):
+        return cls(record['seq'], record['name'], record['path'], record['key'], record['size'], record.get('blob', False))
+
+
+class UploadSpool():
+    # Черга відправки на диску, що переживає падіння FTP і перезапуск програми.
+    # journal.log - лише дописування: рядок JSON на кожне додавання і завершення.
+    # pending.json - знімок незавершених записів; після його атомарного запису
+    # журнал обнуляється. Відновлення: pending.json + журнал, недописаний
+    # останній рядок ігнорується. Порядок відправки - порядок додавання.
+    # Ліміт розміру: найстаріші записи витісняються, on_evict(key) для кожного
+    def __init__(self, path='spool', max_bytes=2048 * MB, max_files=100000, fsync=True, compact_records=10000,
+                 on_evict=None):
+        self.path = path
+        self.data_path = os.path.join(path, DATA_DIR)
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.fsync = fsync
+        self.compact_records = compact_records
+        self.on_evict = on_evict
+        self.condition = threading.Condition()
+        self.entries = OrderedDict()  # seq -> SpoolEntry, від найстаріших
+        self.keys = {}  # ключ -> seq, щоб той самий знімок не потрапив двічі
+        self.in_flight = set()
+        self.bytes = 0
+        self.next_seq = 1
+        self.records = 0
+        self.evicted = 0
+        self.evict_logged = None
+        self.journal = None
+        self._open()
+
+    @classmethod
+    def from_settings(cls, settings, on_evict=None):
+        return cls(settings['path'], int(settings['max_mb'] * MB), settings['max_files'], settings['fsync'],
+                   settings['compact_records'], on_evict)
+
+    def __len__(self):
+        with self.condition:
+            return len(self.entries)
+
+    def _open(self):
+        os.makedirs(self.data_path, exist_ok=True)
+        checkpoint_path = os.path.join(self.path, CHECKPOINT_NAME)
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, encoding='utf-8') as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            self.next_seq = checkpoint['next_seq']
+            for record in checkpoint['entries']:
+                self._insert(SpoolEntry.from_dict(record))
+        checkpoint_seq = self.next_seq
+
+        journal_path = os.path.join(self.path, JOURNAL_NAME)
+        replayed = 0
+        if os.path.exists(journal_path):
+            with open(journal_path, encoding='utf-8') as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Рядок, що не дописався при аварійному завершенні
+                        logging.warning(f"Skipped damaged record in upload spool journal {journal_path}")
+                        continue
+                    replayed += 1
+                    if record['op'] == 'add':
+                        # Додавання до знімка pending.json уже враховані в ньому
+                        if record['seq'] >= checkpoint_seq:
+                            self._insert(SpoolEntry.from_dict(record))
+                            self.next_seq = max(self.next_seq, record['seq'] + 1)
+                    elif record['op'] == 'done':
+                        self._discard(record['seq'])
+
+        # Копії кадрів без запису в журналі - падіння між записом файлу і журналу
+        referenced = {entry.path for entry in self.entries.values() if entry.blob}
+        for name in os.listdir(self.data_path):
+            path = os.path.join(self.data_path, name)
+            if path not in referenced:
+                os.remove(path)
+        # Після відновлення журнал починається з чистого аркуша
+        self._compact()
+        if self.entries:
+            logging.info(f"Upload spool {self.path}: {len(self.entries)} pending uploads ({self.bytes} bytes) "
+                         f"restored, {replayed} journal records replayed")
+
+    def close(self):
+        with self.condition:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+
+    def add(self, remote_name, local_path=None, data=None, key=None):
+        # Повертає False, якщо такий знімок уже чекає відправки
+        key = key or local_path or remote_name
+        with self.condition:
+            if key in self.keys:
+                return False
+            seq = self.next_seq
+            self.next_seq += 1
+            if data is not None:
+                path = os.path.join(self.data_path, f'{seq}.bin')
+                self._write_blob(path, data)
+                entry = SpoolEntry(seq, remote_name, path, key, len(data), blob=True)
+            else:
+                entry = SpoolEntry(seq, remote_name, local_path, key, os.path.getsize(local_path))
+            self._append(dict(entry.as_dict(), op='add'), sync=self.fsync)
+            self._insert(entry)
+            self._evict()
+            self.condition.notify()
+        return True
+
+    def take(self, count, timeout=None):
+        # Найстаріші записи, які ще не відправляє інше з'єднання
+        with self.condition:
+            if timeout and len(self.in_flight) >= len(self.entries):
+                self.condition.wait(timeout)
+            batch = []
+            for seq, entry in self.entries.items():
+                if seq in self.in_flight:
+                    continue
+                self.in_flight.add(seq)
+                batch.append(entry)
+                if len(batch) >= count:
+                    break
+            return batch
+
+    def release(self, entries):
+        # Відправка не вдалася - записи повертаються в чергу на своє місце
+        with self.condition:
+            for entry in entries:
+                self.in_flight.discard(entry.seq)
+            self.condition.notify_all()
+
+    def done(self, entries):
+        # Відправлено або остаточно не вдалося: запис у журнал, видалення копій кадрів
+        with self.condition:
+            for entry in entries:
+                self.in_flight.discard(entry.seq)
+                if self._discard(entry.seq) is not None:
+                    self._append({'op': 'done', 'seq': entry.seq})
+            if self.journal is not None:
+                self.journal.flush()
+            if self.records >= self.compact_records:
+                self._compact()
+
+    def fill_ratio(self):
+        with self.condition:
+            return max(self.bytes / self.max_bytes if self.max_bytes else 0.0,
+                       len(self.entries) / self.max_files if self.max_files else 0.0)
+
+    def as_dict(self):
+        with self.condition:
+            return {'pending': len(self.entries), 'bytes': self.bytes, 'in_flight': len(self.in_flight),
+                    'evicted': self.evicted}
+
+    def _insert(self, entry):
+        self.entries[entry.seq] = entry
+        self.keys[entry.key] = entry.seq
+        self.bytes += entry.size
+
+    def _discard(self, seq):
+        entry = self.entries.pop(seq, None)
+        if entry is None:
+            return None
+        self.keys.pop(entry.key, None)
+        self.bytes -= entry.size
+        if entry.blob:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        return entry
+
+    def _evict(self):
+        # Найстаріші записи, крім тих, що саме відправляються
+        evicted = []
+        for seq in list(self.entries):
+            if not self._over_limit():
+                break
+            if seq in self.in_flight:
+                continue
+            entry = self._discard(seq)
+            self._append({'op': 'done', 'seq': seq})
+            evicted.append(entry)
+        if not evicted:
+            return
+        self.evicted += len(evicted)
+        self.journal.flush()
+        now = time.monotonic()
+        if self.evict_logged is None or now - self.evict_logged >= EVICT_LOG_INTERVAL:
+            self.evict_logged = now
+            logging.warning(f"Upload spool is full, dropping oldest uploads ({evicted[0].remote_name}), "
+                            f"{self.evicted} dropped so far")
+        if self.on_evict is not None:
+            for entry in evicted:
+                self.on_evict(entry.key)
+
+    def _over_limit(self):
+        return ((self.max_bytes and self.bytes > self.max_bytes) or
+                (self.max_files and len(self.entries) > self.max_files))
+
+    def _append(self, record, sync=False):
+        self.journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.records += 1
+        if sync:
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+
+    def _write_blob(self, path, data):
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as blob_file:
+            blob_file.write(data)
+            if self.fsync:
+                blob_file.flush()
+                os.fsync(blob_file.fileno())
+        os.replace(temp_path, path)
+
+    def _compact(self):
+        # Атомарний знімок незавершених записів, потім журнал з нуля
+        checkpoint_path = os.path.join(self.path, CHECKPOINT_NAME)
+        temp_path = checkpoint_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as checkpoint_file:
+            json.dump({'next_seq': self.next_seq, 'entries': [entry.as_dict() for entry in self.entries.values()]},
+                      checkpoint_file, ensure_ascii=False)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(temp_path, checkpoint_path)
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = open(os.path.join(self.path, JOURNAL_NAME), 'w', encoding='utf-8')
+        self.records = 0
@@ -0,0 +1,339 @@
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from datetime import datetime as dt
+
+import cv2
+
+from include.layout import local_path, safe_device_name
+from include.metrics import Histogram
+
+
+# off - лише JPEG, both - JPEG і відеосегменти, video - лише відеосегменти
+VIDEO_MODES = ('off', 'both', 'video')
+DEFAULT_VIDEO_MODE = 'off'
+# fourcc -> розширення файлу; MJPG не потребує FFmpeg і переживає аварійне завершення краще за MP4
+VIDEO_CODECS = {'mp4v': '.mp4', 'MJPG': '.avi', 'XVID': '.avi'}
+DEFAULT_VIDEO_CODEC = 'mp4v'
+# Тривалість сегмента за замовчуванням (хвилини) і частота кадрів відтворення
+SEGMENT_MINUTES = 60
+SEGMENT_FPS = 25
+# Поруч із сегментом - час захоплення кожного кадру, по рядку на кадр
+TIMES_SUFFIX = '.times'
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def segment_name(device, started_at, counter=0):
+    # Як і в знімків: мітка з мілісекундами, лічильник - якщо сегмент з такою міткою вже є
+    device_name = safe_device_name(device.name)
+    extension = VIDEO_CODECS.get(getattr(device, 'video_codec', None), VIDEO_CODECS[DEFAULT_VIDEO_CODEC])
+    stamp = started_at.strftime('%Y-%m-%d_%H-%M-%S') + f'-{started_at.microsecond // 1000:03d}'
+    return f"video/{device_name}/{device_name}_{stamp}{f'_{counter}' if counter else ''}{extension}"
+
+
+def segment_end(started_at, minutes):
+    # Межа сегмента на сітці настінного годинника: 60 хвилин - на початку кожної години
+    seconds = max(float(minutes or SEGMENT_MINUTES), 1.0 / 60) * 60
+    return dt.fromtimestamp((math.floor(started_at.timestamp() / seconds) + 1) * seconds)
+
+
+def codec_for(path):
+    extension = os.path.splitext(path)[1].lower()
+    return 'MJPG' if extension == '.avi' else DEFAULT_VIDEO_CODEC
+
+
+def read_frame_times(path):
+    try:
+        with open(path + TIMES_SUFFIX, encoding='utf-8') as times_file:
+            return [dt.strptime(line.strip(), TIME_FORMAT) for line in times_file if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+class Segment():
+    def __init__(self, device, started_at, fps=SEGMENT_FPS):
+        self.device_id = device.id
+        self.save_path = device.save_path
+        self.codec = getattr(device, 'video_codec', None) or DEFAULT_VIDEO_CODEC
+        counter = 0
+        self.name = segment_name(device, started_at)
+        self.path = local_path(device.save_path, self.name)
+        while os.path.exists(self.path):
+            counter += 1
+            self.name = segment_name(device, started_at, counter)
+            self.path = local_path(device.save_path, self.name)
+        self.started_at = started_at
+        self.ends_at = segment_end(started_at, getattr(device, 'segment_minutes', None))
+        segment_mb = getattr(device, 'segment_mb', None)
+        self.max_bytes = int(segment_mb * 1024 * 1024) if segment_mb else None
+        self.frame_size = None
+        self.fps = fps
+        self.frames = 0
+        self.size = 0
+        self.last_at = None
+        self.segment_id = None
+        self.writer = None
+        self.times = None
+
+    def open(self, frame_size):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.frame_size = frame_size
+        self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.codec), self.fps, frame_size)
+        if not self.writer.isOpened():
+            self.writer = None
+            raise ValueError(f"Video codec {self.codec} is not available for {self.path}")
+        self.times = open(self.path + TIMES_SUFFIX, 'w', encoding='utf-8')
+
+    def accepts(self, device, frame, captured_at):
+        # Новий сегмент: межа часу, розмір файлу, інший розмір кадру або змінені налаштування
+        height, width = frame.shape[:2]
+        return (captured_at < self.ends_at and (width, height) == self.frame_size
+                and (self.max_bytes is None or self.size < self.max_bytes)
+                and device.save_path == self.save_path
+                and (getattr(device, 'video_codec', None) or DEFAULT_VIDEO_CODEC) == self.codec)
+
+    def write(self, frame, captured_at):
+        self.writer.write(frame)
+        self.times.write(captured_at.strftime(TIME_FORMAT) + '\n')
+        self.times.flush()
+        self.frames += 1
+        self.last_at = captured_at
+        # Файл росте під час запису, stat дешевий порівняно з кодуванням кадру
+        self.size = os.path.getsize(self.path)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
+        if self.times is not None:
+            self.times.close()
+            self.times = None
+        if os.path.exists(self.path):
+            self.size = os.path.getsize(self.path)
+
+
+class SegmentStats():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.segments = 0
+        self.failed = 0
+        self.dropped = 0
+        self.write_time = Histogram()
+
+    def as_dict(self, open_segments=0, queue_depth=0):
+        with self.lock:
+            return {
+                'queue_depth': queue_depth,
+                'open_segments': open_segments,
+                'frames': self.frames,
+                'segments': self.segments,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'write_seconds': self.write_time.as_dict(),
+            }
+
+
+class SegmentSink():
+    # Дописує кадри знімків у відеосегменти (cv2.VideoWriter) замість окремих JPEG.
+    # Пристрій закріплений за одним потоком запису (device_id % workers), тому
+    # кадри сегмента пишуться по порядку і без блокувань. Сегменти закриваються
+    # на межі часу навіть без нових кадрів, on_closed(segment) - після закриття
+    def __init__(self, index=None, workers=1, queue_size=64, fps=SEGMENT_FPS, on_closed=None, disk_bucket=None):
+        self.index = index
+        self.disk_bucket = disk_bucket
+        self.fps = fps
+        self.on_closed = on_closed
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(max(workers, 1))]
+        self.segments = {}  # device_id -> відкритий Segment, кожен змінює лише свій потік
+        self.stats = SegmentStats()
+        self.workers = []
+
+    @property
+    def running(self):
+        return bool(self.workers)
+
+    def start(self):
+        if self.running:
+            return
+        for number, jobs in enumerate(self.queues):
+            worker = threading.Thread(target=self._worker, args=(jobs,), name=f'segment-writer-{number}', daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self, timeout=10):
+        # Дописуємо прийняті кадри і закриваємо всі сегменти
+        if not self.running:
+            return
+        for jobs in self.queues:
+            jobs.put(None)
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = []
+
+    def submit(self, device, frame, captured_at):
+        # Не блокує потік захоплення: при переповненні кадр відкидається
+        try:
+            self._queue(device.id).put_nowait(('frame', device, frame, captured_at))
+            return True
+        except queue.Full:
+            with self.stats.lock:
+                self.stats.dropped += 1
+            logging.warning(f"Video writer is behind for device {device.name}, frame dropped")
+            return False
+
+    def close_device(self, device_id):
+        if self.running:
+            self._queue(device_id).put(('close', device_id, None, None))
+
+    def get_stats(self):
+        return self.stats.as_dict(len(self.segments), sum(jobs.qsize() for jobs in self.queues))
+
+    def _queue(self, device_id):
+        return self.queues[device_id % len(self.queues)]
+
+    def _worker(self, jobs):
+        owned = set()
+        while True:
+            try:
+                job = jobs.get(timeout=1)
+            except queue.Empty:
+                job = ('tick', None, None, None)
+            if job is None:
+                for device_id in list(owned):
+                    self._close(device_id)
+                return
+            kind, device, frame, captured_at = job
+            try:
+                if kind == 'frame':
+                    owned.add(device.id)
+                    self._write(device, frame, captured_at)
+                elif kind == 'close':
+                    owned.discard(device)
+                    self._close(device)
+                # Закриття сегментів, час яких минув, поки пристрій не надсилав кадрів
+                now = dt.now()
+                for device_id in list(owned):
+                    segment = self.segments.get(device_id)
+                    if segment is not None and now >= segment.ends_at:
+                        self._close(device_id)
+            except Exception as e:
+                with self.stats.lock:
+                    self.stats.failed += 1
+                logging.error(f"Error while writing video segment: {e}")
+
+    def _write(self, device, frame, captured_at):
+        if not device.save_path:
+            raise ValueError(f"Device {device.name} has no save path for video segments")
+        segment = self.segments.get(device.id)
+        if segment is not None and not segment.accepts(device, frame, captured_at):
+            self._close(device.id)
+            segment = None
+        if segment is None:
+            segment = Segment(device, captured_at, self.fps)
+            height, width = frame.shape[:2]
+            segment.open((width, height))
+            if self.index is not None:
+                try:
+                    segment.segment_id = self.index.opened(device.id, segment.name, segment.path, captured_at)
+                except Exception:
+                    segment.close()
+                    raise
+            self.segments[device.id] = segment
+            logging.info(f"Started video segment {segment.path}")
+        started = time.perf_counter()
+        size = segment.size
+        segment.write(frame, captured_at)
+        self.stats.write_time.observe(time.perf_counter() - started)
+        if self.disk_bucket is not None:
+            # Розмір кадру відомий лише після запису - обмеження береться в борг
+            self.disk_bucket.wait(segment.size - size)
+        with self.stats.lock:
+            self.stats.frames += 1
+
+    def _close(self, device_id):
+        segment = self.segments.pop(device_id, None)
+        if segment is None:
+            return
+        segment.close()
+        if self.index is not None and segment.segment_id is not None:
+            self.index.closed(segment.segment_id, segment.last_at or segment.started_at, segment.frames,
+                              segment.size)
+        with self.stats.lock:
+            self.stats.segments += 1
+        logging.info(f"Closed video segment {segment.path}: {segment.frames} frames, {segment.size} bytes")
+        if self.on_closed is not None and segment.frames:
+            self.on_closed(segment)
+
+
+def segment_frames(segments, start=None, end=None, every=0.0):
+    # (час, кадр) з відеосегментів. Кадри поза проміжком або надто близькі до
+    # попереднього лише пропускаються (grab), без декодування
+    last = None
+    for segment in segments:
+        times = read_frame_times(segment.path)
+        capture = cv2.VideoCapture(segment.path)
+        if not capture.isOpened():
+            logging.warning(f"Skipped unreadable video segment {segment.path}")
+            continue
+        try:
+            for captured_at in times:
+                if end is not None and captured_at > end:
+                    break
+                wanted = ((start is None or captured_at >= start)
+                          and (last is None or (captured_at - last).total_seconds() >= every))
+                if not capture.grab():
+                    break
+                if not wanted:
+                    continue
+                ret, frame = capture.retrieve()
+                if ret:
+                    last = captured_at
+                    yield captured_at, frame
+        finally:
+            capture.release()
+
+
+def snapshot_frames(rows, every=0.0):
+    # (час, кадр) з JPEG-знімків; rows - (час, шлях) від найстаріших
+    last = None
+    for captured_at, path in rows:
+        if last is not None and (captured_at - last).total_seconds() < every:
+            continue
+        frame = cv2.imread(path)
+        if frame is None:
+            logging.warning(f"Skipped unreadable snapshot {path}")
+            continue
+        last = captured_at
+        yield captured_at, frame
+
+
+def build_timelapse(frames, output, fps=SEGMENT_FPS, width=None, codec=None):
+    # Усі кадри зводяться до розміру першого (після зменшення до width)
+    writer = None
+    size = None
+    count = 0
+    try:
+        for captured_at, frame in frames:
+            if writer is None:
+                height, frame_width = frame.shape[:2]
+                if width and frame_width > width:
+                    height, frame_width = max(int(height * width / frame_width), 1), int(width)
+                size = (frame_width, height)
+                directory = os.path.dirname(os.path.abspath(output))
+                os.makedirs(directory, exist_ok=True)
+                codec = codec or codec_for(output)
+                writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*codec), fps, size)
+                if not writer.isOpened():
+                    raise ValueError(f"Video codec {codec} is not available for {output}")
+            if (frame.shape[1], frame.shape[0]) != size:
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            writer.write(frame)
+            count += 1
+    finally:
+        if writer is not None:
+            writer.release()
+    return count
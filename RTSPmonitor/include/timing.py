@@ -0,0 +1,89 @@
+import math
+import time
+
+
+# Найменший інтервал між знімками (секунди)
+MIN_INTERVAL = 0.04
+
+
+def parse_interval(text, default=60):
+    try:
+        interval = float(text)
+    except (TypeError, ValueError):
+        return default
+    if not math.isfinite(interval) or interval <= 0:
+        return default
+    return max(interval, MIN_INTERVAL)
+
+
+class SnapshotClock():
+    # Дедлайни знімків на монотонному годиннику з фіксованою сіткою:
+    # наступний дедлайн = попередній + interval, тому похибка не накопичується.
+    # set_step розріджує знімки при деградації, не зсуваючи сітку.
+    # align=True прив'язує сітку до настінного годинника (інтервал 60 - на початку хвилини)
+    def __init__(self, interval, align=False, burst_count=1, burst_spacing=0.0, now=None):
+        self.interval = max(float(interval), MIN_INTERVAL)
+        self.align = align
+        self.burst_count = max(int(burst_count or 1), 1)
+        self.burst_spacing = max(float(burst_spacing or 0.0), 0.0)
+        self.skipped = 0
+
+        now = time.monotonic() if now is None else now
+        if align:
+            # Зсув між настінним і монотонним годинником фіксуємо один раз
+            wall_now = time.time()
+            next_wall = math.floor(wall_now / self.interval + 1) * self.interval
+            self.trigger = now + (next_wall - wall_now)
+        else:
+            self.trigger = now + self.interval
+        # Початок сітки; крок більший за interval (деградація) не зсуває її
+        self.origin = self.trigger
+        self.step = self.interval
+        self.burst_index = 0
+
+    def set_step(self, step):
+        # Інтервал з урахуванням деградації: дедлайни й далі на кратних interval,
+        # тож після зняття обмеження вирівнювання (початок хвилини) зберігається
+        self.step = max(float(step), self.interval)
+
+    def _on_grid(self, moment):
+        # Найближча точка сітки не раніше moment (допуск на похибку float)
+        ticks = math.ceil((moment - self.origin) / self.interval - 1e-9)
+        return self.origin + ticks * self.interval
+
+    @property
+    def next_deadline(self):
+        return self.trigger + self.burst_index * self.burst_spacing
+
+    def is_due(self, now=None):
+        now = time.monotonic() if now is None else now
+        return now >= self.next_deadline
+
+    def lag(self, now=None):
+        now = time.monotonic() if now is None else now
+        return now - self.next_deadline
+
+    def in_burst(self):
+        return self.burst_index > 0
+
+    def advance(self, now=None):
+        # Викликається після кожного збереженого кадру
+        now = time.monotonic() if now is None else now
+        self.burst_index += 1
+        if self.burst_index < self.burst_count:
+            return self.next_deadline
+
+        self.burst_index = 0
+        trigger = self.trigger + self.step
+        if now >= trigger:
+            # Пропущені тіки не надолужуємо, а залишаємося на сітці
+            missed = math.floor((now - trigger) / self.step) + 1
+            self.skipped += missed
+            trigger += missed * self.step
+        self.trigger = self._on_grid(trigger)
+        return self.next_deadline
+
+    def skip(self, now=None):
+        # Знімок не потрібен (кадр не змінився) - пропускаємо всю серію
+        self.burst_index = self.burst_count - 1
+        return self.advance(now)
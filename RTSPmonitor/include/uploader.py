@@ -0,0 +1,504 @@
+import logging
+import os
+import posixpath
+import queue
+import threading
+import time
+from collections import deque
+from configparser import ConfigParser
+
+from include.destinations import make_backend
+from include.frame_buffer import MemoryReader
+from include.metrics import LAG_BUCKETS, Histogram
+
+
+def load_ftp_config(path='ftp_data.conf'):
+    config = ConfigParser()
+    config.read(path)
+    if not config.has_section('FTP'):
+        return None
+    return {
+        # ftp або ftps (явний TLS)
+        'type': config.get('FTP', 'type', fallback='ftp'),
+        'host': config.get('FTP', 'host'),
+        'username': config.get('FTP', 'username'),
+        'password': config.get('FTP', 'password'),
+        'port': config.getint('FTP', 'port', fallback=21),
+        'remote_path': config.get('FTP', 'remote_path', fallback='/'),
+    }
+
+
+class UploadJob():
+    # Файл з диска (local_path) або байти з пам'яті (data)
+    def __init__(self, remote_name, local_path=None, data=None, ledger_key=None, spool_entry=None):
+        self.remote_name = remote_name
+        self.local_path = local_path
+        self.data = data
+        # Кадр з пам'яті, збережений у черзі на диску, зберігає свій ключ обліку
+        self.ledger_key = ledger_key
+        self.spool_entry = spool_entry
+        self.created = time.monotonic()
+        self.attempts = 0
+
+    def key(self):
+        return self.ledger_key or self.local_path or self.remote_name
+
+    def open(self):
+        if self.data is not None:
+            return MemoryReader(self.data)
+        return open(self.local_path, 'rb')
+
+    def size(self, source=None):
+        # З відкритого файлу: після відправки його могли вже видалити
+        if self.data is not None:
+            return len(self.data)
+        if source is not None:
+            return os.fstat(source.fileno()).st_size
+        return os.path.getsize(self.local_path)
+
+
+class UploadLedger():
+    # Локальний облік відправлених файлів замість ftp.nlst на кожен знімок.
+    # Ключі - локальні шляхи або імена знімків з пам'яті
+    def __init__(self, path='ftp_uploaded.txt'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.uploaded = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as ledger_file:
+                self.uploaded = {line.rstrip('\n') for line in ledger_file if line.strip()}
+
+    def __contains__(self, key):
+        return key in self.uploaded
+
+    def add_many(self, keys):
+        with self.lock:
+            new_keys = [key for key in keys if key not in self.uploaded]
+            if not new_keys:
+                return
+            self.uploaded.update(new_keys)
+            with open(self.path, 'a', encoding='utf-8') as ledger_file:
+                ledger_file.writelines(f'{key}\n' for key in new_keys)
+
+    def mark_failed(self, key):
+        # Файловий облік не зберігає невдалі спроби
+        pass
+
+
+class NullLedger():
+    # Для додаткових напрямків: таблиця snapshots веде облік основного FTP,
+    # а невідправлене на інші напрямки зберігає їхня черга на диску
+    def __contains__(self, key):
+        return False
+
+    def add_many(self, keys):
+        pass
+
+    def mark_failed(self, key):
+        pass
+
+
+class UploadMetrics():
+    def __init__(self, window=60):
+        self.lock = threading.Lock()
+        self.window = window
+        self.started = time.monotonic()
+        self.enqueued = 0
+        self.uploaded = 0
+        self.failed = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.bytes_sent = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.recent = deque()  # (час, байти) за останні window секунд
+        self.latency = Histogram(LAG_BUCKETS)
+
+    def record_upload(self, size, latency):
+        now = time.monotonic()
+        self.latency.observe(latency)
+        with self.lock:
+            self.uploaded += 1
+            self.bytes_sent += size
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            self.recent.append((now, size))
+            self._trim(now)
+
+    def _trim(self, now):
+        while self.recent and now - self.recent[0][0] > self.window:
+            self.recent.popleft()
+
+    def as_dict(self, queue_depth=0):
+        now = time.monotonic()
+        with self.lock:
+            self._trim(now)
+            span = min(self.window, now - self.started) or 1.0
+            recent_bytes = sum(size for _, size in self.recent)
+            return {
+                'queue_depth': queue_depth,
+                'enqueued': self.enqueued,
+                'uploaded': self.uploaded,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'reconnects': self.reconnects,
+                'bytes_sent': self.bytes_sent,
+                'bytes_per_sec': round(recent_bytes / span, 1),
+                'files_per_sec': round(len(self.recent) / span, 2),
+                'latency_avg': round(self.latency_total / self.uploaded, 3) if self.uploaded else 0.0,
+                'latency_max': round(self.latency_max, 3),
+                'latency_seconds': self.latency.as_dict(),
+            }
+
+
+class UploadPool():
+    # Пул з'єднань до одного напрямку відправки; протокол - у бекенді з include.destinations
+    # (FTP, FTPS, SFTP чи локальне дзеркало), config['type'] обирає бекенд
+    def __init__(self, config=None, workers=3, queue_size=1000, batch_size=10,
+                 keepalive=30, max_backoff=60, max_attempts=5, ledger=None, memory_buffer=None,
+                 file_bucket=None, byte_bucket=None, spool=None, name='ftp'):
+        self.name = name
+        # TokenBucket відправок і байтів за секунду, спільні для всіх з'єднань
+        self.file_bucket = file_bucket
+        self.byte_bucket = byte_bucket
+        # FrameRingBuffer з кадрами, закодованими в пам'яті (без запису на диск)
+        self.memory_buffer = memory_buffer
+        self.workers_count = workers
+        self.batch_size = batch_size
+        self.keepalive = keepalive
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        # UploadSpool: черга на диску замість queue, переживає відсутність FTP і перезапуск
+        self.spool = spool
+        if spool is not None:
+            spool.on_evict = self._spool_evicted
+            if memory_buffer is not None:
+                # На диск кадри з пам'яті потрапляють лише при переповненні буфера,
+                # обриві з'єднання чи зупинці пулу
+                memory_buffer.on_evict = self._spill_frame
+        # Віддалені теки розкладки, що вже існують; спільні для всіх з'єднань
+        self.remote_dirs = set()
+        self.ledger = ledger if ledger is not None else UploadLedger()
+        self.metrics = UploadMetrics()
+        self.stop_event = threading.Event()
+        self.workers = []
+        self.configure(config)
+
+    @property
+    def running(self):
+        return bool(self.workers)
+
+    def configure(self, config):
+        # Нові налаштування підхоплюються при наступному перепідключенні
+        self.config = config
+        self.backend = make_backend(config) if config else None
+        self.remote_dirs = set()
+
+    def start(self):
+        if self.running:
+            return
+        if not self.config:
+            logging.warning(f"Upload destination {self.name} is not configured, uploads are disabled")
+            return
+        self.stop_event.clear()
+        for index in range(self.workers_count):
+            worker = threading.Thread(target=self._worker, name=f'upload-{self.name}-{index}', daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        logging.info(f"Upload pool {self.name} started with {self.workers_count} connections to "
+                     f"{self.backend.describe()}")
+
+    def stop(self, timeout=10):
+        if not self.running:
+            return
+        self.stop_event.set()
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = []
+        if self.spool is not None and self.memory_buffer is not None:
+            for name, data, key in self.memory_buffer.take(len(self.memory_buffer)):
+                self._spill_frame(name, data, key)
+        logging.info(f"Upload pool {self.name} stopped, {self.depth()} uploads left in queue")
+
+    def depth(self):
+        if self.spool is not None:
+            return len(self.spool)
+        return self.queue.qsize()
+
+    @property
+    def capacity(self):
+        if self.spool is not None and self.spool.max_files:
+            return self.spool.max_files
+        return self.queue.maxsize
+
+    def fill_ratio(self):
+        if self.spool is not None:
+            return self.spool.fill_ratio()
+        return self.queue.qsize() / self.queue.maxsize
+
+    def submit(self, job):
+        if job.data is not None and self.memory_buffer is not None:
+            # Кодування в пам'яті без тимчасових файлів
+            self.memory_buffer.put(job.remote_name, job.data, job.ledger_key)
+            return True
+        if self.spool is not None and self.config:
+            return self._spool_submit(job)
+        if not self.running:
+            logging.warning(f"Not connected to {self.name}, {job.remote_name} is not uploaded")
+            return False
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            with self.metrics.lock:
+                self.metrics.dropped += 1
+            logging.warning(f"Upload queue of {self.name} is full, dropped {job.remote_name}")
+            return False
+        with self.metrics.lock:
+            self.metrics.enqueued += 1
+        return True
+
+    def _spool_submit(self, job):
+        # Приймається і без з'єднання: пул відправить чергу по порядку, коли FTP з'явиться
+        try:
+            added = self.spool.add(job.remote_name, job.local_path, job.data, job.key())
+        except OSError as e:
+            with self.metrics.lock:
+                self.metrics.dropped += 1
+            logging.error(f"Failed to add {job.remote_name} to upload spool: {e}")
+            return False
+        if added:
+            with self.metrics.lock:
+                self.metrics.enqueued += 1
+        return added
+
+    def _spill_frame(self, name, data, key=None):
+        self._spool_submit(UploadJob(name, data=data, ledger_key=key))
+
+    def _spill(self, jobs):
+        # Кадри з пам'яті переходять у чергу на диску; повертає решту завдань
+        if self.spool is None:
+            return jobs
+        kept = []
+        for job in jobs:
+            if job.data is not None and job.spool_entry is None:
+                self._spill_frame(job.remote_name, job.data, job.ledger_key)
+            else:
+                kept.append(job)
+        return kept
+
+    def _spool_evicted(self, key):
+        with self.metrics.lock:
+            self.metrics.dropped += 1
+        self.ledger.mark_failed(key)
+
+    def get_metrics(self):
+        metrics = self.metrics.as_dict(self.depth())
+        if self.spool is not None:
+            metrics['spool'] = self.spool.as_dict()
+        if self.memory_buffer is not None:
+            metrics['memory_buffer'] = self.memory_buffer.as_dict()
+        return metrics
+
+    def _connect_with_backoff(self):
+        backoff = 1
+        while not self.stop_event.is_set():
+            backend = self.backend
+            try:
+                return backend, backend.connect()
+            except Exception as e:
+                logging.error(f"Failed to connect to {self.name}: {e}, retry in {backoff} s")
+                with self.metrics.lock:
+                    self.metrics.reconnects += 1
+                self.stop_event.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        return None, None
+
+    def _next_batch(self):
+        if self.spool is not None:
+            return self._next_spool_batch()
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if self.memory_buffer is not None and len(batch) < self.batch_size:
+            batch.extend(self._memory_jobs(self.batch_size - len(batch)))
+        if batch:
+            return batch
+        try:
+            return [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+    def _next_spool_batch(self):
+        # Найстаріші записи черги на диску, потім кадри з пам'яті, якщо вони є
+        batch = self._spool_jobs(self.spool.take(self.batch_size))
+        if self.memory_buffer is not None and len(batch) < self.batch_size:
+            batch.extend(self._memory_jobs(self.batch_size - len(batch)))
+        if batch:
+            return batch
+        return self._spool_jobs(self.spool.take(self.batch_size, timeout=0.5))
+
+    def _memory_jobs(self, count):
+        return [UploadJob(name, data=data, ledger_key=key) for name, data, key in self.memory_buffer.take(count)]
+
+    def _spool_jobs(self, entries):
+        return [UploadJob(entry.remote_name, local_path=entry.path, ledger_key=entry.key, spool_entry=entry)
+                for entry in entries]
+
+    def _spool_done(self, jobs):
+        if self.spool is not None:
+            entries = [job.spool_entry for job in jobs if job.spool_entry is not None]
+            if entries:
+                self.spool.done(entries)
+
+    def _worker(self):
+        # З'єднання прив'язане до бекенда, що його створив: нові налаштування - після перепідключення
+        backend, connection = None, None
+        pending = []
+        # Обриви поспіль: пауза перед повторною спробою росте, поки щось не відправиться
+        failures = 0
+        last_activity = time.monotonic()
+        while not self.stop_event.is_set():
+            done = []
+            try:
+                if not pending:
+                    pending = self._next_batch()
+                    if not pending:
+                        # Простій: підтримуємо з'єднання живим
+                        if connection is not None and time.monotonic() - last_activity >= self.keepalive:
+                            last_activity = time.monotonic()
+                            try:
+                                backend.noop(connection)
+                            except Exception:
+                                connection = self._close(backend, connection)
+                        continue
+
+                if connection is None:
+                    backend, connection = self._connect_with_backoff()
+                    if connection is None:
+                        break
+
+                while pending:
+                    job = pending[0]
+                    try:
+                        source = job.open()
+                    except OSError as e:
+                        # Помилка читання локального файлу не стосується з'єднання
+                        if not os.path.exists(job.local_path):
+                            logging.error(f"File {job.local_path} disappeared before upload")
+                            self._spool_done([pending.pop(0)])
+                        else:
+                            logging.error(f"Failed to read {job.local_path}: {e}")
+                            self._retry_or_fail(pending)
+                        continue
+                    try:
+                        with source:
+                            size = job.size(source)
+                            self._ensure_remote_dir(backend, connection, job.remote_name)
+                            if self.file_bucket is not None:
+                                self.file_bucket.wait(1, self.stop_event)
+                            backend.store(connection, job.remote_name, source,
+                                          self._block_sent if self.byte_bucket is not None else None)
+                    except Exception as e:
+                        if job.local_path and not os.path.exists(job.local_path):
+                            logging.error(f"File {job.local_path} disappeared before upload")
+                            self._spool_done([pending.pop(0)])
+                            continue
+                        if isinstance(e, backend.connection_errors) or not self._alive(backend, connection):
+                            # Обрив не рахується як спроба: файл лишається в черзі, скільки б не тривав збій
+                            logging.error(f"Connection error while uploading {job.remote_name} to {self.name}: {e}")
+                            connection = self._close(backend, connection)
+                            pending = self._spill(pending)
+                            failures += 1
+                            self.stop_event.wait(min(2 ** (failures - 1), self.max_backoff))
+                            break
+                        logging.error(f"Error uploading {job.remote_name} to {self.name}: {e}")
+                        # Можливо, теку видалили на сервері - наступна спроба створить її знову
+                        self.remote_dirs.discard(posixpath.dirname(job.remote_name))
+                        self._retry_or_fail(pending)
+                        continue
+                    done.append(pending.pop(0))
+                    failures = 0
+                    self.metrics.record_upload(size, time.monotonic() - job.created)
+                    logging.info(f"Uploaded {job.remote_name} to {self.name}")
+                last_activity = time.monotonic()
+            except Exception:
+                # Непередбачена помилка не зупиняє потік: взяте повертається в черги
+                logging.exception(f"Unexpected error in upload worker of {self.name}")
+                connection = self._close(backend, connection)
+                self._requeue(pending)
+                pending = []
+                self.stop_event.wait(1)
+            finally:
+                self.ledger.add_many(job.key() for job in done)
+                self._spool_done(done)
+        # Невідправлене лишається в черзі на диску до наступного запуску
+        self._requeue(pending)
+        self._close(backend, connection)
+
+    def _block_sent(self, size):
+        # Обмеження смуги по блоках: великий файл не забирає весь канал одним шматком
+        self.byte_bucket.wait(size, self.stop_event)
+
+    def _ensure_remote_dir(self, backend, connection, remote_name):
+        # Створюємо лише теки, яких ще немає в кеші, без переліку чи CWD на кожен файл
+        directory = posixpath.dirname(remote_name)
+        if not directory or directory in self.remote_dirs:
+            return
+        parts = directory.split('/')
+        for index in range(1, len(parts) + 1):
+            prefix = '/'.join(parts[:index])
+            if prefix in self.remote_dirs:
+                continue
+            backend.make_dir(connection, prefix)
+            self.remote_dirs.add(prefix)
+
+    def _alive(self, backend, connection):
+        # Помилка стосується файлу, лише якщо з'єднання після неї працює
+        try:
+            backend.noop(connection)
+            return True
+        except Exception:
+            return False
+
+    def _requeue(self, jobs):
+        # Повертає взяті, але не відправлені завдання: записи черги на диску звільняються,
+        # кадри з пам'яті - назад у буфер, решта - у чергу в пам'яті
+        jobs = self._spill(jobs)
+        if self.spool is not None:
+            self.spool.release([job.spool_entry for job in jobs if job.spool_entry is not None])
+            return
+        for job in jobs:
+            if job.data is not None and self.memory_buffer is not None:
+                self.memory_buffer.put(job.remote_name, job.data, job.ledger_key)
+                continue
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                with self.metrics.lock:
+                    self.metrics.dropped += 1
+                logging.warning(f"Upload queue of {self.name} is full, dropped {job.remote_name}")
+
+    def _retry_or_fail(self, pending):
+        # Лише для помилок окремого файлу (немає доступу, неприпустиме ім'я)
+        job = pending[0]
+        job.attempts += 1
+        if job.attempts >= self.max_attempts:
+            pending.pop(0)
+            with self.metrics.lock:
+                self.metrics.failed += 1
+            self.ledger.mark_failed(job.key())
+            self._spool_done([job])
+            logging.error(f"Giving up on {job.remote_name} after {job.attempts} attempts")
+
+    def _close(self, backend, connection):
+        if connection is not None:
+            try:
+                backend.close(connection)
+            except Exception:
+                pass
+        return None
@@ -0,0 +1,170 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+from include.layout import local_path
+from include.metrics import Histogram
+
+
+class WriteJob():
+    def __init__(self, device_id, frame, image_name, save_path=None, quality=90, on_done=None, captured_at=None):
+        self.device_id = device_id
+        self.captured_at = captured_at
+        self.frame = frame
+        self.image_name = image_name
+        self.save_path = save_path
+        self.quality = quality
+        # on_done(job, encoded, image_path) - image_path None для запису лише в пам'ять
+        self.on_done = on_done
+        self.created = time.monotonic()
+
+
+class WriterStats():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.dropped_per_device = {}
+        self.encode_total = 0.0
+        self.encode_max = 0.0
+        self.write_total = 0.0
+        self.write_max = 0.0
+        self.encode_time = Histogram()
+        self.write_time = Histogram()
+
+    def record(self, encode_time, write_time):
+        self.encode_time.observe(encode_time)
+        self.write_time.observe(write_time)
+        with self.lock:
+            self.written += 1
+            self.encode_total += encode_time
+            self.encode_max = max(self.encode_max, encode_time)
+            self.write_total += write_time
+            self.write_max = max(self.write_max, write_time)
+
+    def record_drop(self, device_id):
+        with self.lock:
+            self.dropped += 1
+            self.dropped_per_device[device_id] = self.dropped_per_device.get(device_id, 0) + 1
+
+    def as_dict(self, queue_depth=0):
+        with self.lock:
+            done = self.written or 1
+            return {
+                'queue_depth': queue_depth,
+                'written': self.written,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'dropped_per_device': dict(self.dropped_per_device),
+                'encode_avg': round(self.encode_total / done, 4),
+                'encode_max': round(self.encode_max, 4),
+                'write_avg': round(self.write_total / done, 4),
+                'write_max': round(self.write_max, 4),
+                'encode_seconds': self.encode_time.as_dict(),
+                'write_seconds': self.write_time.as_dict(),
+            }
+
+
+class SnapshotWriter():
+    # Кодування JPEG і запис на диск поза потоками захоплення.
+    # OpenCV відпускає GIL під час imencode, тому достатньо пулу потоків
+    def __init__(self, workers=2, queue_size=64, per_device_limit=4, disk_bucket=None):
+        self.workers_count = workers
+        # TokenBucket байтів на диск за секунду, спільний з іншими записувачами
+        self.disk_bucket = disk_bucket
+        self.per_device_limit = per_device_limit
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        # Теки розкладки, які вже створено (щоб не викликати makedirs на кожен знімок)
+        self.created_dirs = set()
+        self.stats = WriterStats()
+        self.workers = []
+
+    @property
+    def running(self):
+        return bool(self.workers)
+
+    def start(self):
+        if self.running:
+            return
+        for index in range(self.workers_count):
+            worker = threading.Thread(target=self._worker, name=f'snapshot-writer-{index}', daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self, timeout=10):
+        # Дописуємо вже прийняті кадри, потім зупиняємо потоки
+        if not self.running:
+            return
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = []
+
+    def submit(self, job):
+        # Ніколи не блокує потік захоплення: при переповненні кадр відкидається
+        with self.pending_lock:
+            if self.pending.get(job.device_id, 0) >= self.per_device_limit:
+                self.stats.record_drop(job.device_id)
+                logging.warning(f"Writer is behind for device {job.device_id}, dropped {job.image_name}")
+                return False
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                self.stats.record_drop(job.device_id)
+                logging.warning(f"Writer queue is full, dropped {job.image_name}")
+                return False
+            self.pending[job.device_id] = self.pending.get(job.device_id, 0) + 1
+        return True
+
+    def get_stats(self):
+        return self.stats.as_dict(self.queue.qsize())
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            try:
+                self._write(job)
+            except Exception as e:
+                with self.stats.lock:
+                    self.stats.failed += 1
+                logging.error(f"Error while writing {job.image_name}: {e}")
+            finally:
+                with self.pending_lock:
+                    self.pending[job.device_id] -= 1
+
+    def _write(self, job):
+        started = time.perf_counter()
+        ok, encoded = cv2.imencode('.jpg', job.frame, [cv2.IMWRITE_JPEG_QUALITY, job.quality])
+        if not ok:
+            raise ValueError("JPEG encoding failed")
+        encoded_at = time.perf_counter()
+
+        image_path = None
+        write_started = encoded_at
+        if job.save_path:
+            if self.disk_bucket is not None:
+                self.disk_bucket.wait(len(encoded))
+                write_started = time.perf_counter()
+            # image_name може містити підтеки розкладки (cam/2024/01/31/cam_....jpg)
+            image_path = local_path(job.save_path, job.image_name)
+            directory = os.path.dirname(image_path)
+            if directory not in self.created_dirs:
+                os.makedirs(directory, exist_ok=True)
+                self.created_dirs.add(directory)
+            with open(image_path, 'wb') as image_file:
+                image_file.write(encoded)
+            logging.info(f'Save picture to path - {image_path}')
+        self.stats.record(encoded_at - started, time.perf_counter() - write_started)
+
+        if job.on_done is not None:
+            job.on_done(job, encoded, image_path)
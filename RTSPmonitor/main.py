@@ -1,45 +1,55 @@
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
 from logging.handlers import RotatingFileHandler
 import sys
 import logging
 import os
-import cv2
-from queue import Queue
-from datetime import datetime as dt 
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, 
-    QLabel,QPushButton, QTableWidget, QMessageBox, QSystemTrayIcon, QMenu, QTableWidgetItem)
-from PyQt5.QtGui import QIcon, QColor
+    QLabel,QPushButton, QTableView, QMessageBox, QSystemTrayIcon, QMenu, QFileDialog, QAbstractItemView)
+from PyQt5.QtGui import QIcon
+from PyQt5.QtCore import QTimer
 
 from include.utils import Utils
 from include.ftp_config import FTPConfigWindow
 from include.add_device import AddDeviceWindow
-
-from db.database import DataBase, Device
+from include.preview import PreviewWindow
+from include.bulk_probe import BulkProbeWindow
+from include.device_import import DeviceImportWindow
+from include.device_io import export_devices
+from include.device_model import DeviceTableModel
+from include.engine import CaptureEngine
+from include.timing import parse_interval
+
+from db.registry import get_registry
+
+# Як часто колонки Status і Last snapshot беруть стан з планувальника (мс)
+STATUS_REFRESH_MS = 1000
     
 class RTSPMonitor(QMainWindow):
     def __init__(self):
         super().__init__()
         
-        self.db = DataBase()
+        # Спільний кеш пристроїв; зміни з будь-якого вікна приходять через device_changed
+        self.registry = get_registry()
+        self.registry.subscribe(self.device_changed)
         self.current_device = None 
-        self.streaming_thread = None
-        self.device_streams = {}
-        self.device_threads = {}
-        
-        self.thread_pool = ThreadPoolExecutor(max_workers=10)  # Максимальна кількість одночасних потоків
-        self.frame_queues = {} # Черга для передачі кадрів між потоками
-        self.frame_queue_locks = {}
-        self.start_times = {}  # Словник для збереження початкового часу моніторингу
-        self.ftp_config_window = FTPConfigWindow()  # Створюємо екземпляр FTPConfigWindow
-        self.ftp = None
+
+        # Захоплення, запис і FTP живуть у CaptureEngine, вікно лише керує ним.
+        # RTSP_CAPTURE_PROCESSES > 0 розподіляє пристрої між процесами
+        capture_processes = int(os.environ.get('RTSP_CAPTURE_PROCESSES', '0'))
+        self.engine = CaptureEngine(processes=capture_processes)
+        self.ftp_config_window = FTPConfigWindow(self.engine)  # Створюємо екземпляр FTPConfigWindow
+        self.preview_window = PreviewWindow(self.engine)
+        self.bulk_probe_window = BulkProbeWindow(self.registry)
+        self.device_import_window = DeviceImportWindow(self.registry)
 
 
         self.init_ui()
-        
-        self.devices = []
-        self.utils.load_device_list()
+
+        # Періодично оновлюємо колонку Status зі стану планувальника;
+        # модель перемальовує лише рядки, стан яких змінився
+        self.status_timer = QTimer(self)
+        self.status_timer.timeout.connect(self.change_status)
+        self.status_timer.start(STATUS_REFRESH_MS)
         
         # Максимальний розмір файлу в байтах (20 МБ)
         max_log_size = 20 * 1024 * 1024  
@@ -76,11 +86,15 @@ class RTSPMonitor(QMainWindow):
         # Right side - Device List
         self.device_list_layout = QVBoxLayout()
         self.device_list_label = QLabel("Devices:")
-        self.device_list = QTableWidget()
-        self.device_list.setColumnCount(4)
-        self.device_list.setHorizontalHeaderLabels(["Name", "RTSP URL", "Save Path", "Status"])
+        # Модель слідкує за реєстром сама: додавання, зміна чи видалення оновлює один рядок
+        self.device_model = DeviceTableModel(self.registry, self.engine)
+        self.device_list = QTableView()
+        self.device_list.setModel(self.device_model)
+        self.device_list.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.device_list.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.device_list.verticalHeader().setVisible(False)
         self.device_list.horizontalHeader().setStretchLastSection(True)
-        self.device_list.cellClicked.connect(self.select_device)
+        self.device_list.clicked.connect(lambda index: self.select_device(index.row()))
 
         self.change_button = QPushButton("Change")
         self.delete_button = QPushButton("Delete")
@@ -122,6 +136,30 @@ class RTSPMonitor(QMainWindow):
         self.input_form_layout.addWidget(self.add_device_button)
         self.input_form_layout.addStretch()
 
+        # Кнопка попереднього перегляду активних камер
+        self.preview_button = QPushButton("Preview")
+        self.preview_button.clicked.connect(self.open_preview_window)
+
+        self.input_form_layout.addWidget(self.preview_button)
+        self.input_form_layout.addStretch()
+
+        # Паралельна перевірка багатьох камер без блокування вікна
+        self.check_streams_button = QPushButton("Check streams")
+        self.check_streams_button.clicked.connect(self.open_bulk_probe_window)
+
+        self.input_form_layout.addWidget(self.check_streams_button)
+        self.input_form_layout.addStretch()
+
+        # Масове додавання і вивантаження пристроїв (CSV або JSON)
+        self.import_button = QPushButton("Import devices")
+        self.import_button.clicked.connect(self.import_devices)
+        self.export_button = QPushButton("Export devices")
+        self.export_button.clicked.connect(self.export_devices)
+
+        self.input_form_layout.addWidget(self.import_button)
+        self.input_form_layout.addWidget(self.export_button)
+        self.input_form_layout.addStretch()
+
         self.main_layout.addLayout(self.input_form_layout)
         self.main_layout.addLayout(self.device_list_layout)
 
@@ -129,8 +167,6 @@ class RTSPMonitor(QMainWindow):
         
         self.add_device_window = AddDeviceWindow(self.device_list)  # Ініціалізуємо AddDeviceWindow
         self.utils = Utils(self.device_list)
-        # Load devices from database
-        self.utils.load_device_list()
         
     def open_ftp_config_window(self):
         #self.ftp_config_window = FTPConfigWindow()
@@ -139,162 +175,105 @@ class RTSPMonitor(QMainWindow):
     def open_add_device_window(self):
         self.add_device_window.show()
 
+    def open_preview_window(self):
+        self.preview_window.set_devices(self.registry.active())
+        self.preview_window.show()
+
+    def open_bulk_probe_window(self):
+        self.bulk_probe_window.show()
+
+    def import_devices(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Import devices", "", "Devices (*.csv *.json)")
+        if path and self.device_import_window.load(path):
+            self.device_import_window.show()
+
+    def export_devices(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export devices", "devices.csv", "CSV (*.csv);;JSON (*.json)")
+        if not path:
+            return
+        try:
+            count = export_devices(self.registry.all(), path)
+        except Exception as e:
+            QMessageBox.warning(self, "Error", f"Error while exporting devices: {e}")
+            return
+        QMessageBox.information(self, "Export devices", f"Exported {count} devices to {path}")
+
     def delete_device(self):
         if self.current_device:
-            self.db.session.delete(self.current_device)
-            self.db.session.commit()
+            self.engine.stop_device(self.current_device.id)
+            self.registry.delete(self.current_device.id)
             self.current_device = None
-            self.utils.load_device_list()
-
-        self.utils.load_device_list()
 
     def change_device(self):
         if self.current_device:
             new_name = self.name_input.text()
             new_rtsp_url = self.rtsp_input.text()
             new_save_path = self.save_path_input.text()
-            new_interval = int(self.interval_input.text()) if self.interval_input.text().isdigit() else 60
+            new_interval = parse_interval(self.interval_input.text())
 
             # Перевірка на дублікати
             if self.utils.is_duplicate_device(new_rtsp_url, new_name, exclude_id=self.current_device.id):
                 QMessageBox.warning(self, "Error", "A device with the same RTSP URL or name already exists.")
                 return
 
-            self.current_device.name = new_name
-            self.current_device.rtsp_url = new_rtsp_url
-            self.current_device.save_path = new_save_path
-            self.current_device.interval = new_interval
-
-            self.db.session.commit()
-            self.utils.load_device_list()
+            self.registry.update(self.current_device.id, name=new_name, rtsp_url=new_rtsp_url,
+                                 save_path=new_save_path, interval=new_interval)
             self.current_device = None
 
-        self.utils.load_device_list()
-
     def has_active_devices(self):
-        return self.db.session.query(Device).filter(Device.active == True).count() > 0
+        return self.registry.has_active()
     
     def start_monitoring(self):
         if self.current_device:
-            self.current_device.active = True
-            
-            if self.ftp is None and self.has_active_devices():
-                self.ftp = self.ftp_config_window.connect_to_ftp()
-                        
-            self.db.session.commit()
-
-            self.frame_queues[self.current_device.id] = Queue()  # Створити чергу для поточного пристрою
-            self.start_times[self.current_device.id] = dt.now()  # Збереження початкового часу
-            self.thread_pool.submit(self.run_async_task, self.current_device)
-            logging.info(f"Monitoring started for device {self.current_device.name}")
+            self.current_device = self.registry.set_active(self.current_device.id, True)
+
+            self.engine.start_device(self.current_device)
         
         self.change_status()
-        self.utils.load_device_list()
-
-    def run_async_task(self, device):
-        asyncio.run(self.start_streaming(device))
 
-    async def start_streaming(self, device):
-        logging.info(f"Starting streaming for device {device.name}")
-        try:
-            cap = cv2.VideoCapture(device.rtsp_url, cv2.CAP_FFMPEG)
-            while cap.isOpened() and device.active:
-                ret, frame = cap.read()
-                if ret:
-                    if self.frame_queues[device.id].qsize() >= 2:
-                        self.frame_queues[device.id].get()  # Видалити найстаріший кадр з черги
-                    current_time = dt.now()
-                    start_time = self.start_times.get(device.id)
-                    if start_time and (current_time - start_time).seconds >= device.interval:
-                        self.start_times[device.id] = current_time  # Оновити час старту для порівняння
-                        self.frame_queues[device.id].put(frame)  # Покласти новий кадр у чергу потоку
-                        await self.save_frames(device)
-                else:
-                    logging.error(f"Failed to capture frame from - {device.name}, {device.rtsp_url}")
-                    self.stop_monitoring
-            cap.release()
-        except Exception as e:
-            logging.error(f"Error while reading RTSP stream for device {device.name}: {e}")
-            cap.release()
-    
     def stop_monitoring(self):
         if self.current_device:
-            self.current_device.active = False
-            self.db.session.commit()
+            self.current_device = self.registry.set_active(self.current_device.id, False)
 
-            device_id = self.current_device.id
-            if device_id in self.device_streams:
-                self.device_streams[device_id].join()  # Зупинити потік для цього пристрою
-                logging.info(f"Monitoring stoped for device {self.current_device.name}")
-                
-            if not self.has_active_devices():
-                self.ftp_config_window.disconnect_from_ftp(self.ftp)
-                print('Disconnected')
-            else:
-                print('have active device')
+            self.engine.stop_device(self.current_device.id)
+            logging.info(f"Monitoring stoped for device {self.current_device.name}")
         self.change_status()
-        self.utils.load_device_list()
    
-    async def save_frames(self, device):
-        try:
-            frame_queue = self.frame_queues[device.id]
-            if frame_queue.qsize() > 0:
-                frame = frame_queue.queue[-1]
-                await self.async_save_frame(frame, device.name, device.save_path, device)
-                frame_queue.queue.clear() # Очистити чергу після збереження
-            else:
-                logging.error(f"No frames in queue for {device.name}")
-        except Exception as e:
-            logging.error(f"Error while saving frame for device {device.name}: {e}")
-
-    async def async_save_frame(self, frame, device_name, save_path, device):
-        try:
-            current_time = dt.now().strftime("%Y-%m-%d_%H-%M-%S")
-            image_name = f"{device_name}_{current_time}.jpg"
-            image_path = os.path.join(save_path, image_name)
-            if save_path:
-                cv2.imwrite(image_path, frame)
-                logging.info(f'Save picture from device {device_name} to path - {image_path}')
-                if self.ftp_config_window:
-                    self.ftp_config_window.send_photo_from_path(self.ftp, device) # Виклик методу send_photo з FTPConfigWindow
-            else:
-                if self.ftp_config_window:
-                    self.ftp_config_window.send_photo_from_buffer(self.ftp, frame, image_name) # Виклик методу send_photo з FTPConfigWindow
-        except Exception as e:
-            logging.error(f"Error in device {device_name}: {e}")
-
     def tray_icon_clicked(self, reason):
         if reason == QSystemTrayIcon.DoubleClick:
             self.show() 
             self.tray_icon.hide()
 
     def stop_all_streams(self):
-        for device in self.devices:
-            if device.active:
-                device.active = False
-                self.db.session.commit()
-                self.current_device = None
+        # Один UPDATE для всіх активних пристроїв
+        self.registry.update_many([device.id for device in self.registry.active()], active=False)
+        self.current_device = None
 
     def closeEvent(self, event):
+        self.preview_window.close()
+        self.bulk_probe_window.close()
+        self.bulk_probe_window.prober.shutdown()
+        self.device_import_window.close()
+        self.device_import_window.prober.shutdown()
+        self.add_device_window.prober.shutdown()
         self.stop_all_streams()
+        self.engine.stop()
         super().closeEvent(event)
-        if self.ftp is not None:
-            self.ftp_config_window.disconnect_from_ftp(self.ftp)
-        else:
-            pass
 
     def select_device(self, row):
-        self.devices = self.db.session.query(Device).all()
-        if self.devices and row < len(self.devices):
-            self.current_device = self.devices[row]
-        else:
+        self.current_device = self.device_model.device(row)
+
+    def device_changed(self, event, record):
+        # Рядки таблиці оновлює DeviceTableModel; тут лише актуальний запис вибраного пристрою
+        if self.current_device is None:
+            return
+        if event == 'deleted' and record.id == self.current_device.id:
             self.current_device = None
+        elif event == 'updated' and record.id == self.current_device.id:
+            self.current_device = record
             
     def change_status(self):
-        for row, device in enumerate(self.devices):
-            status_item = QTableWidgetItem("Active" if device.active else "Inactive")
-            status_item.setBackground(QColor(0, 255, 0) if device.active else QColor(255, 255, 255))
-            self.device_list.setItem(row, 3, status_item)
+        self.device_model.refresh_states()
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
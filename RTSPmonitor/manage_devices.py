@@ -0,0 +1,70 @@
+import argparse
+import logging
+import sys
+import time
+from types import SimpleNamespace
+
+from include.device_io import export_devices, read_devices
+from include.probe import PROBE_TIMEOUT, PROBE_WORKERS, StreamProber
+
+from db.registry import get_registry
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import or export RTSP Monitor devices (CSV or JSON)")
+    parser.add_argument('--db', default='sqlite:///rtsp_data.db', help="SQLAlchemy URL of the device database")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help="write all devices to a .csv or .json file")
+    export_parser.add_argument('path')
+
+    import_parser = commands.add_parser('import', help="add devices from a .csv or .json file")
+    import_parser.add_argument('path')
+    import_parser.add_argument('--probe', action='store_true', help="check streams first and add only reachable ones")
+    import_parser.add_argument('--timeout', type=float, default=PROBE_TIMEOUT, help="stream check timeout, seconds")
+    import_parser.add_argument('--workers', type=int, default=PROBE_WORKERS, help="parallel stream checks")
+    return parser.parse_args()
+
+
+def probe_rows(rows, timeout, workers):
+    # Номери рядків, які не пройшли перевірку, -> помилка
+    prober = StreamProber(workers, timeout)
+    prober.submit_many((index, SimpleNamespace(**row)) for index, row in enumerate(rows))
+    failed = {}
+    done = 0
+    while done < len(rows):
+        for index, result in prober.take_results():
+            done += 1
+            if not result.ok:
+                failed[index] = result.error
+        time.sleep(0.1)
+    return failed
+
+
+def import_command(registry, args):
+    rows, errors = read_devices(args.path)
+    for number, error in errors:
+        logging.warning(f"Row {number} skipped: {error}")
+    failed = probe_rows(rows, args.timeout, args.workers) if args.probe else {}
+    for index, error in sorted(failed.items()):
+        logging.warning(f"{rows[index]['name']} ({rows[index]['rtsp_url']}) skipped: {error}")
+    added, skipped = registry.add_many([row for index, row in enumerate(rows) if index not in failed])
+    for row, reason in skipped:
+        logging.warning(f"{row['name']} ({row['rtsp_url']}) skipped: {reason}")
+    logging.info(f"Imported {len(added)} devices, {len(skipped)} duplicates, {len(failed)} failed stream check, "
+                 f"{len(errors)} invalid rows")
+    return 0
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    registry = get_registry(args.db)
+    if args.command == 'export':
+        export_devices(registry.all(), args.path)
+        return 0
+    return import_command(registry, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+import argparse
+import logging
+import os
+import sys
+
+from sqlalchemy import update
+
+from include.layout import LAYOUTS, layout_dir, local_path, parse_snapshot_name, safe_device_name
+
+from db.database import Snapshot
+from db.registry import get_registry
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Move existing snapshots of RTSP Monitor devices to a folder layout")
+    parser.add_argument('layout', choices=list(LAYOUTS), help="target layout")
+    parser.add_argument('--db', default='sqlite:///rtsp_data.db', help="SQLAlchemy URL of the device database")
+    parser.add_argument('--device', action='append', help="device name (repeatable, default - all devices)")
+    parser.add_argument('--dry-run', action='store_true', help="only print what would be moved")
+    parser.add_argument('--batch-size', type=int, default=500, help="index rows updated per transaction")
+    return parser.parse_args()
+
+
+def device_files(device):
+    # Знімки пристрою в будь-якій розкладці: корінь save_path і підтеки.
+    # Лише імена знімків саме цього пристрою: "cam" не переносить "cam_2_..." чи "cam_notes.txt"
+    file_device = safe_device_name(device.name)
+    for root, dirs, files in os.walk(device.save_path):
+        for file_name in files:
+            parsed = parse_snapshot_name(file_name)
+            if parsed is None or parsed[0] != file_device:
+                continue
+            yield os.path.join(root, file_name), file_name, parsed[1]
+
+
+def remove_empty_dirs(top):
+    for root, dirs, files in os.walk(top, topdown=False):
+        if root != top and not os.listdir(root):
+            os.rmdir(root)
+
+
+def migrate_device(registry, device, layout, dry_run, batch_size):
+    if not device.save_path or not os.path.isdir(device.save_path):
+        logging.info(f"{device.name}: no save path, only the layout setting is changed")
+        if not dry_run:
+            registry.update(device.id, layout=layout)
+        return 0
+
+    session = registry.db.session
+    moved = 0
+    updates = []
+
+    def flush():
+        # Рядки індексу змінюються пачками, за старим шляхом
+        for old_path, new_path, name in updates:
+            session.execute(update(Snapshot).where(Snapshot.device_id == device.id, Snapshot.path == old_path)
+                            .values(path=new_path, name=name))
+        session.commit()
+        updates.clear()
+
+    created = set()
+    for path, file_name, captured_at in list(device_files(device)):
+        subdir = layout_dir(layout, device.name, captured_at)
+        name = f"{subdir}/{file_name}" if subdir else file_name
+        new_path = local_path(device.save_path, name)
+        if new_path == path:
+            continue
+        if os.path.exists(new_path):
+            logging.warning(f"{device.name}: {new_path} already exists, {path} is left in place")
+            continue
+        if dry_run:
+            print(f"{path} -> {new_path}")
+            moved += 1
+            continue
+        directory = os.path.dirname(new_path)
+        if directory not in created:
+            os.makedirs(directory, exist_ok=True)
+            created.add(directory)
+        os.replace(path, new_path)
+        updates.append((path, new_path, name))
+        moved += 1
+        if len(updates) >= batch_size:
+            flush()
+
+    if not dry_run:
+        flush()
+        remove_empty_dirs(device.save_path)
+        registry.update(device.id, layout=layout)
+    logging.info(f"{device.name}: {moved} snapshots {'would be ' if dry_run else ''}moved to layout '{layout}'")
+    return moved
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    registry = get_registry(args.db)
+    devices = registry.all()
+    if args.device:
+        devices = [device for device in devices if device.name in args.device]
+        missing = set(args.device) - {device.name for device in devices}
+        if missing:
+            logging.error(f"Unknown devices: {', '.join(sorted(missing))}")
+            return 1
+    active = [device.name for device in devices if device.active]
+    if active and not args.dry_run:
+        # Захоплення під час переміщення записало б нові файли в стару розкладку
+        logging.warning(f"Devices are marked active, stop capture before migrating: {', '.join(active)}")
+
+    total = sum(migrate_device(registry, device, args.layout, args.dry_run, args.batch_size) for device in devices)
+    logging.info(f"Done, {total} snapshots {'would be ' if args.dry_run else ''}moved")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())